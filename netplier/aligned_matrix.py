@@ -0,0 +1,107 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import logging
+import os
+
+import numpy as np
+
+"""
+The MSA output as a matrix: one row per message, one uint8 per column of the alignment (the characters of the oneline
+file: hex digits, gaps '-' and separators '~'), with the gaps as a bitmask (one bit per column) and the number of
+characters that are not gaps of each row
+The matrix is saved as msa_matrix.npy next to the oneline file and memory-mapped by the next loads (it is rebuilt
+if the oneline file is newer); the fields are column ranges, so their values are views of the matrix
+"""
+class AlignedMatrix:
+    FILENAME = "msa_matrix.npy"
+    GAP = ord('-')
+    SEPARATOR = ord('~')
+
+    def __init__(self, data, gap_bits=None):
+        self.data = data
+        self.num_rows, self.num_columns = data.shape
+        self.gap_bits = gap_bits if gap_bits is not None else np.packbits(data == AlignedMatrix.GAP, axis=1)
+        self.lengths = self.num_columns - np.unpackbits(self.gap_bits, axis=1).sum(axis=1, dtype=np.int64)
+
+    @staticmethod
+    def from_lines(lines):
+        num_columns = len(lines[0]) if len(lines) > 0 else 0
+        assert all(len(line) == num_columns for line in lines), "The aligned messages don't have same length"
+        data = np.frombuffer(''.join(lines).encode('ascii'), dtype=np.uint8).reshape(len(lines), num_columns)
+        return AlignedMatrix(data.copy())
+
+    # the matrix of an oneline file (msa_output_oneline.txt)
+    @staticmethod
+    def load(filepath_output_oneline):
+        assert os.path.isfile(filepath_output_oneline), "The msa output oneline file doesn't exist"
+        filepath = os.path.join(os.path.dirname(filepath_output_oneline), AlignedMatrix.FILENAME)
+        if not os.path.isfile(filepath) or os.path.getmtime(filepath) < os.path.getmtime(filepath_output_oneline):
+            with open(filepath_output_oneline) as f:
+                AlignedMatrix.from_lines(f.read().splitlines()).save(filepath)
+        return AlignedMatrix(np.load(filepath, mmap_mode='r'))
+
+    def save(self, filepath):
+        logging.debug("[+] Save aligned matrix: {}".format(filepath))
+        # the file is complete only when it is renamed
+        with open(filepath + ".tmp", 'wb') as f:
+            np.save(f, np.asarray(self.data))
+        os.replace(filepath + ".tmp", filepath)
+
+    # the matrix of the rows (in this order)
+    def select(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        return AlignedMatrix(self.data[rows], self.gap_bits[rows])
+
+    # the matrix of these rows followed by the rows of matrix (the same columns of the alignment)
+    def concatenate(self, matrix):
+        assert matrix.num_columns == self.num_columns, "The aligned messages don't have same length"
+        return AlignedMatrix(np.concatenate([self.data, matrix.data]), np.concatenate([self.gap_bits, matrix.gap_bits]))
+
+    # the matrices of the requests and the responses
+    def divide_by_directionlist(self, direction_list):
+        direction_list = np.asarray(direction_list)
+        return self.select(np.flatnonzero(direction_list == 0)), self.select(np.flatnonzero(direction_list != 0))
+
+    # the gaps of the rows (all rows if None) as a boolean matrix
+    def get_gaps(self, rows=None):
+        gap_bits = self.gap_bits if rows is None else self.gap_bits[rows]
+        return np.unpackbits(gap_bits, axis=1, count=self.num_columns).view(bool)
+
+    # the columns [il, ir) of the rows (all rows if None) as one bytes value per row
+    def get_field_keys(self, il, ir, rows=None):
+        block = self.data[:, il:ir] if rows is None else self.data[rows, il:ir]
+        if block.shape[1] == 0:
+            return np.zeros(len(block), dtype='S1')
+        return np.ascontiguousarray(block).view('S{}'.format(block.shape[1])).ravel()
+
+    # the strings of columns [il, ir) of the rows (all rows if None)
+    def get_field_values(self, il, ir, rows=None):
+        if ir <= il:
+            return [''] * (self.num_rows if rows is None else len(rows))
+        return self.get_field_keys(il, ir, rows).astype('U{}'.format(ir - il)).tolist()
+
+    # the aligned data of each row (as in the oneline file)
+    def get_rows(self):
+        return self.get_field_values(0, self.num_columns)
+
+    # the bytes of each row, without the gaps and separators
+    def get_raw_data_list(self):
+        data_list = list()
+        for row in self.data:
+            row = np.asarray(row)
+            data_list.append(bytes.fromhex(row[(row != AlignedMatrix.GAP) & (row != AlignedMatrix.SEPARATOR)].tobytes().decode('ascii')))
+        return data_list
@@ -19,6 +19,10 @@ import os
 import logging
 import copy
 
+import numpy as np
+
+from aligned_matrix import AlignedMatrix
+
 """
 mafft mode: ginsi, linsi, einsi
 details: https://mafft.cbrc.jp/alignment/software/algorithms/algorithms.html
@@ -59,6 +63,7 @@ class Alignment:
         self.change_to_oneline()
         ## Remove tilde
         self.remove_character(self.filepath_output_oneline)
+        AlignedMatrix.load(self.filepath_output_oneline)
 
         ## Analyze fields
         self.generate_fields_info(self.filepath_output_oneline)
@@ -150,26 +155,29 @@ class Alignment:
         
         assert os.path.isfile(filepath_input), "The file doesn't exist: {}".format(filepath_input)
 
-        with open(filepath_input) as f:
-            linelist = f.read().splitlines()
-
-        length_message = len(linelist[0])
+        matrix = AlignedMatrix.load(filepath_input)
+        length_message = matrix.num_columns
+        # the columns that end a field: all messages have an even number of characters (not gaps) before them
+        columns_even = np.flatnonzero(self.get_even_columns(matrix))
 
         ## Only record fields info
         results_fields = list()
 
         i = 0
         isLastStatic = False
+        valuelist = None
         while i < length_message:
-            offset = 2
-            while i + offset <= length_message:
-                valuelist = [line[i:i+offset] for line in linelist]
-                if not self.has_even_number_of_bytes(valuelist):
-                    offset += 1
-                    continue
-                else:
-                    break
-            if not len(set(valuelist)) == 1:
+            # the shortest field (at least 2 characters) with an even number of characters in all messages
+            j = np.searchsorted(columns_even, i + 2)
+            if j < len(columns_even):
+                offset = int(columns_even[j]) - i
+                valuelist = matrix.data[:, i:i+offset]
+            else:
+                # the end of the messages is not even
+                offset = length_message - i + 1
+                if offset > 2 or valuelist is None:
+                    valuelist = matrix.data[:, i:]
+            if not np.all(valuelist == valuelist[:1]):
                 if self.is_variable_field(valuelist):
                     fields_info = [offset, 'V']
                 else:
@@ -191,18 +199,16 @@ class Alignment:
             for fields_info in results_fields:
                 fout.write("Raw 0 {0} {1}\n".format(fields_info[0]*8, fields_info[1]))
 
-    def has_even_number_of_bytes(self, valuelist):
-        for value in valuelist:
-            value_string = ''.join(value)
-            if len(value_string.replace("-", "")) % 2 != 0:
-                return False
-        return True
+    # for each column k (0..length), if all messages have an even number of characters (not gaps) in [0, k)
+    def get_even_columns(self, matrix, chunk_size=4096):
+        columns_even = np.ones(matrix.num_columns + 1, dtype=bool)
+        for il in range(0, matrix.num_rows, chunk_size):
+            parity = np.bitwise_xor.accumulate(~matrix.get_gaps(np.arange(il, min(il + chunk_size, matrix.num_rows))), axis=1)
+            columns_even[1:] &= ~np.any(parity, axis=0)
+        return columns_even
 
     def is_variable_field(self, valuelist):
-        for value in valuelist:
-            if '-' in value:
-                return True
-        return False
+        return bool(np.any(valuelist == AlignedMatrix.GAP))
 
     # from fields_info
     def generate_fields_visual_from_fieldsinfo(self):
@@ -210,19 +216,13 @@ class Alignment:
         fields_info = self.get_fields_info()
         #print(fields_info)
 
-        assert os.path.isfile(self.filepath_output_oneline), "The msa output oneline file doesn't exist"
-        with open(self.filepath_output_oneline) as f:
-            messages_data_mafft = f.read().splitlines()
+        matrix = AlignedMatrix.load(self.filepath_output_oneline)
 
+        # the values of each field (and the rest of the messages)
+        pos_list = [0] + sorted(list(fields_info.keys())) + [matrix.num_columns]
+        fields_values = [matrix.get_field_values(pos_start, max(pos_start, pos_end)) for pos_start, pos_end in zip(pos_list[:-1], pos_list[1:])]
         with open(self.filepath_fields_visual, 'w') as fout:
-            for messages_data in messages_data_mafft:
-                fields_value = list()
-                pos_list = sorted(list(fields_info.keys()))
-                pos_start = 0
-                for i,pos_end in enumerate(pos_list):
-                    fields_value.append(messages_data[pos_start:pos_end])
-                    pos_start = pos_end
-                fields_value.append(messages_data[pos_start:])
+            for fields_value in zip(*fields_values):
                 fout.write("{0}\n".format(' '.join(fields_value)))
 
     # read fileds info from saved files
@@ -242,11 +242,13 @@ class Alignment:
 
     @staticmethod
     def get_messages_aligned(messages, filepath_output_oneline):
-        assert os.path.isfile(filepath_output_oneline), "The msa output oneline file doesn't exist"
+        return Alignment.attach_messages(messages, AlignedMatrix.load(filepath_output_oneline))
 
-        messages_aligned = copy.deepcopy(messages)
-        with open(filepath_output_oneline) as f:
-            messages_aligned_data = f.read().splitlines()
+    # the messages with the aligned data of the rows of the matrix (shallow copies: only the data differs)
+    @staticmethod
+    def attach_messages(messages, matrix):
+        messages_aligned = [copy.copy(message) for message in messages]
+        messages_aligned_data = matrix.get_rows()
 
         for i in range(len(messages_aligned)):
             messages_aligned[i].data = messages_aligned_data[i]
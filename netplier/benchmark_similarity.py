@@ -0,0 +1,118 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from netplier import NetPlier
+from processing import Processing
+from alignment import Alignment
+from constraint.constraint import Constraint
+from constraint.message_similarity import MessageSimilarity
+
+"""
+Compare the modes of MessageSimilarity with the exact pairwise EER
+For each trace (the output directory of a previous run), compute p_m of the clusters of each candidate fid with each mode,
+and report the time and the difference of p_m with the exact mode
+"""
+class SimilarityBenchmark:
+    FILENAME_RESULTS = "benchmark_similarity.txt"
+
+    # traces: list of [output_dir of a previous run, filepath of input trace, protocol_type]
+    def __init__(self, traces, modes, output_dir='tmp/', epsilon=0.01, pair_budget=1 << 14):
+        self.traces = traces
+        self.modes = modes
+        self.output_dir = output_dir
+        self.epsilon = epsilon
+        self.pair_budget = pair_budget
+
+        if not os.path.exists(self.output_dir):
+            logging.debug("Folder {0} doesn't exist".format(self.output_dir))
+            os.makedirs(self.output_dir)
+
+    def execute(self):
+        results = list()
+        for trace_dir, filepath, protocol_type in self.traces:
+            print("[++++++++] Benchmark trace {}".format(trace_dir))
+            p = Processing(filepath=filepath, protocol_type=protocol_type)
+            netplier = NetPlier(messages=p.messages, direction_list=p.direction_list, output_dir=trace_dir)
+            fields, fid_list = netplier.generate_fields_by_fieldsinfo(os.path.join(trace_dir, Alignment.FILENAME_FIELDS_INFO))
+            constraint = Constraint(messages=p.messages, direction_list=p.direction_list, fields=fields, fid_list=fid_list, output_dir=trace_dir)
+
+            messages_aligned = Alignment.get_messages_aligned(p.messages, os.path.join(trace_dir, Alignment.FILENAME_OUTPUT_ONELINE))
+            for messages_direction_aligned in Processing.divide_msgs_by_directionlist(messages_aligned, p.direction_list):
+                clusters_list = self.generate_clusters(constraint, messages_direction_aligned)
+
+                p_m_exact = None
+                for mode in self.modes:
+                    time_start = time.time()
+                    p_m = self.compute_p_m(messages_direction_aligned, clusters_list, mode)
+                    time_used = time.time() - time_start
+                    if p_m_exact is None:
+                        p_m_exact = p_m
+                    diff = np.abs(p_m - p_m_exact)
+                    results.append([trace_dir, len(messages_direction_aligned), len(clusters_list), mode, time_used, diff.max(), diff.mean()])
+                    logging.info("{} ({} messages, {} fids) {}: {:.3f}s, p_m diff max {:.4f} mean {:.4f}".format(*results[-1]))
+
+        self.save_results(results)
+        return results
+
+    # the clusters of each candidate fid
+    def generate_clusters(self, constraint, messages_aligned):
+        clusters_list = list()
+        rows = constraint.get_rows(messages_aligned)
+        for fid in constraint.filter_fields(constraint.fid_list, messages_aligned):
+            clusters_list.append(Constraint.get_clusters(*constraint.generate_clusters(fid, rows)))
+        return clusters_list
+
+    # output: p_m of all clusters of all fids
+    def compute_p_m(self, messages_aligned, clusters_list, mode):
+        constraint_m = MessageSimilarity(messages=messages_aligned, mode=mode, epsilon=self.epsilon, pair_budget=self.pair_budget)
+        constraint_m.compute_similarity_matrix()
+        p_m = list()
+        for clusters in clusters_list:
+            p_m += constraint_m.compute_constraint_message_similarity(clusters)
+        return np.array(p_m, dtype=np.float64)
+
+    def save_results(self, results):
+        filepath = os.path.join(self.output_dir, SimilarityBenchmark.FILENAME_RESULTS)
+        with open(filepath, 'w') as fout:
+            fout.write("trace\tmessages\tfids\tmode\ttime\tdiff_max\tdiff_mean\n")
+            for result in results:
+                fout.write("{}\t{}\t{}\t{}\t{:.4f}\t{:.6f}\t{:.6f}\n".format(*result))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-tr', '--trace', required=True, dest='traces', nargs=3, action='append', metavar=('OUTPUT_DIR', 'INPUT', 'TYPE'),
+        help='a trace: the output directory of a previous run, the filepath of input trace, and the type of the protocol')
+    parser.add_argument('-o', '--output_dir', dest='output_dir', default='tmp_benchmark/', help='output directory')
+    parser.add_argument('-sim', '--similarity', dest='modes', default=[], action='append', help='the modes to compare with exact: [approx, profile, stratified, pairwise]')
+    parser.add_argument('-eps', '--epsilon', dest='epsilon', default=0.01, type=float, help='the error bound of the approximate message similarity')
+    parser.add_argument('-pb', '--pair_budget', dest='pair_budget', default=1 << 14, type=int, help='the number of sampled pairs per cluster of the stratified message similarity')
+
+    args = parser.parse_args()
+
+    modes = [MessageSimilarity.MODE_EXACT] + [mode for mode in args.modes if mode != MessageSimilarity.MODE_EXACT]
+    benchmark = SimilarityBenchmark(traces=args.traces, modes=modes, output_dir=args.output_dir, epsilon=args.epsilon, pair_budget=args.pair_budget)
+    benchmark.execute()
@@ -0,0 +1,129 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import collections
+import contextlib
+import io
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+
+from probabilistic_inference import ProbabilisticInference
+
+"""
+Estimate the stability of the inferred keyword by resampling the messages
+Each resample is a random subset of the messages; the alignment, the candidate fields and the similarity matrices
+prepared by the Constraint are reused, so only the clustering, the constraints and the inference are rerun
+"""
+class Bootstrap:
+    FILENAME_RESULTS = "bootstrap.txt"
+    MIN_SUPPORT = 0.5 # the inferred fid is unstable if it ranks first in fewer resamples
+
+    # constraint: the Constraint of the full run (prepared)
+    def __init__(self, constraint, ffid_list, remote=True, engine='exact', num=100, ratio=0.8, seed=None, processes=None, output_dir='tmp/'):
+        self.constraint = constraint
+        self.ffid_list = ffid_list
+        self.remote = remote
+        self.engine = engine
+        self.num = num
+        self.ratio = ratio
+        self.seed = seed
+        self.processes = processes if processes else os.cpu_count()
+        self.output_dir = output_dir
+
+    # fid_inferred/margin: the result of the full run
+    def execute(self, fid_inferred, margin):
+        print("[++++++++] Bootstrap the inferred keyword")
+        if self.constraint.messages_aligned is None:
+            self.constraint.prepare()
+
+        rng = np.random.RandomState(self.seed)
+        num_message = len(self.constraint.messages)
+        num_sample = max(2, int(num_message * self.ratio))
+        samples = [np.sort(rng.choice(num_message, num_sample, replace=False)).tolist() for i in range(self.num)]
+
+        # the prepared constraint is shared with the workers when they are forked
+        with multiprocessing.Pool(self.processes, initializer=Bootstrap.init_worker, initargs=(self,)) as pool:
+            results = pool.map(Bootstrap.run_in_worker, samples)
+
+        result = self.summarize(fid_inferred, margin, results)
+        self.save_result(result, results)
+        return result
+
+    # output: [fid ranked first, margin to the second one]
+    def run(self, indices):
+        p_observation_request, p_observation_response = self.constraint.compute_observation_probabilities(indices)
+        pi = ProbabilisticInference(p_observation=p_observation_request, remote=self.remote, engine=self.engine)
+        fid_inferred = pi.execute(self.ffid_list)
+        fid = fid_inferred[0] if len(fid_inferred) > 0 else None
+        return [fid, Bootstrap.compute_margin(pi.pk_result)]
+
+    def summarize(self, fid_inferred, margin, results):
+        fid_count = collections.Counter([fid for fid, m in results])
+        margins = np.array([m for fid, m in results])
+
+        result = dict()
+        result['fid'] = fid_inferred
+        result['margin'] = margin
+        result['support'] = fid_count[fid_inferred] / len(results) if len(results) > 0 else 0.0
+        result['margin_mean'] = float(np.mean(margins)) if len(margins) > 0 else 0.0
+        result['margin_ci'] = [float(np.percentile(margins, 2.5)), float(np.percentile(margins, 97.5))] if len(margins) > 0 else [0.0, 0.0]
+        result['fid_count'] = dict(fid_count.most_common())
+        result['stable'] = result['support'] >= Bootstrap.MIN_SUPPORT
+
+        logging.info("Bootstrap: fid {} ranks first in {:.2%} of {} resamples, margin {:.4} (95% CI: {:.4}-{:.4})".format(
+            fid_inferred, result['support'], len(results), margin, result['margin_ci'][0], result['margin_ci'][1]))
+        if not result['stable']:
+            logging.warning("The inferred fid {} is unstable: {}".format(fid_inferred, result['fid_count']))
+
+        return result
+
+    def save_result(self, result, results):
+        filepath = os.path.join(self.output_dir, Bootstrap.FILENAME_RESULTS)
+        with open(filepath, 'w') as fout:
+            for key in ['fid', 'margin', 'support', 'margin_mean', 'margin_ci', 'fid_count', 'stable']:
+                fout.write("{}: {}\n".format(key, result[key]))
+            fout.write("resamples:\n")
+            for fid, margin in results:
+                fout.write("{} {}\n".format(fid, margin))
+
+    # pk_result: {fid: P(k=1)}
+    @staticmethod
+    def compute_margin(pk_result):
+        pk_sorted = sorted(pk_result.values(), reverse=True)
+        if len(pk_sorted) == 0:
+            return 0.0
+        if len(pk_sorted) == 1:
+            return float(pk_sorted[0])
+        return float(pk_sorted[0] - pk_sorted[1])
+
+    @staticmethod
+    def init_worker(bootstrap):
+        global _bootstrap
+        _bootstrap = bootstrap
+        # the workers can't have worker processes of their own
+        bootstrap.constraint.processes = 1
+        logging.getLogger().setLevel(logging.WARNING)
+
+    @staticmethod
+    def run_in_worker(indices):
+        # skip the progress info of each resample
+        with contextlib.redirect_stdout(io.StringIO()):
+            return _bootstrap.run(indices)
+
+_bootstrap = None
@@ -19,14 +19,28 @@ from sklearn import metrics
 import logging
 import struct
 from getkw import get_true_keyword_updated as gtk
+from field_table import FieldTable
 
 class Clustering:
     def __init__(self, fields, protocol_type):
         self.fields = fields
         self.protocol_type = protocol_type
+        self.field_table = FieldTable.from_fields(fields)
         
     def evaluation(self, clustering_result_true, clustering_result_method):
         print("[++++++++] Evaluate Clustering results")
+        results_list = self.compute_scores(clustering_result_true, clustering_result_method)
+        if results_list is None:
+            return
+
+        for test_id, test_direction in enumerate(["Request", "Response", "Total"]):
+            h, c, v = results_list[test_id]
+            print("{}:\nHomogeneity score: {:.8}\nCompleteness score: {:.8}\nV-measure score: {:.8}".format(test_direction, h, c, v))
+
+        return results_list
+
+    # output: [h, c, v] of request, response, and total
+    def compute_scores(self, clustering_result_true, clustering_result_method):
         results_list = list()
         labels_true_list, labels_method_list = list(), list()
         for test_id in [0, 1]:
@@ -52,9 +66,6 @@ class Clustering:
             h = metrics.homogeneity_score(labels_true, labels_method)
             c = metrics.completeness_score(labels_true, labels_method)
             v = metrics.v_measure_score(labels_true, labels_method) 
-            
-            test_direction = "Request" if test_id == 0 else "Response"
-            print("{}:\nHomogeneity score: {:.8}\nCompleteness score: {:.8}\nV-measure score: {:.8}".format(test_direction, h, c, v))
             results_list.append([h, c, v])
         # total
         labels_true_request, labels_true_response = labels_true_list
@@ -64,9 +75,10 @@ class Clustering:
         h = metrics.homogeneity_score(labels_true_total, labels_method_total)
         c = metrics.completeness_score(labels_true_total, labels_method_total)
         v = metrics.v_measure_score(labels_true_total, labels_method_total)
-        print("Total:\nHomogeneity score: {:.8}\nCompleteness score: {:.8}\nV-measure score: {:.8}".format(h, c, v))
         results_list.append([h, c, v])
 
+        return results_list
+
     def cluster_by_kw_true(self, messages):
         print("[++++++++] Cluster by True Keyword")
         results = list()
@@ -111,19 +123,29 @@ class Clustering:
         
         return kw
 
-    def cluster_by_kw_inferred(self, fid_inferred_list, messages):
-        print("[++++++++] Cluster by Inferred Keyword")
+    # aligned_matrix: the AlignedMatrix of the messages (the values are sliced from the aligned data of the messages if None)
+    def cluster_by_kw_inferred(self, fid_inferred_list, messages, verbose=True, aligned_matrix=None):
+        if verbose:
+            print("[++++++++] Cluster by Inferred Keyword")
         results = [list() for message in messages]
         for fid_inferred in fid_inferred_list:
-            il, ir = 0, 0
-            for i in range(fid_inferred):
-                il += self.fields[i].domain.dataType.size[1] // 8
-            ir = il + (self.fields[fid_inferred].domain.dataType.size[1] // 8)
+            il, ir = self.field_table.get_range(fid_inferred)
 
-            for j in range(len(messages)):
-                results[j].append(messages[j].data[il:ir])
+            if aligned_matrix is not None:
+                for j, value in enumerate(aligned_matrix.get_field_values(il, ir)):
+                    results[j].append(value)
+            else:
+                for j in range(len(messages)):
+                    results[j].append(messages[j].data[il:ir])
         results = [''.join(result) for result in results]
-        print("results")
-        for i,r in enumerate(results):
-            print("\t"+r,messages[i].data.replace("-","").replace("~",""))
+        if verbose:
+            print("results")
+            for i,r in enumerate(results):
+                print("\t"+r,messages[i].data.replace("-","").replace("~",""))
         return results
+
+    # the cluster of each row of aligned_matrix by the inferred fids (the codes of their values, see FieldTable),
+    # which can be evaluated as the results of cluster_by_kw_inferred
+    def label_by_kw_inferred(self, fid_inferred_list, aligned_matrix):
+        codes = self.field_table.compute_codes(aligned_matrix, fid_inferred_list)
+        return FieldTable.combine(codes)[0].tolist()
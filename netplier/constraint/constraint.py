@@ -16,161 +16,327 @@
 
 import os
 import logging
-import copy
 import collections
-import gc
+import multiprocessing
+
+import numpy as np
 
-from netzob.Model.Vocabulary.Symbol import Symbol
-from netzob.Model.Vocabulary.Field import Field
-from netzob.Model.Vocabulary.Types.Raw import Raw
 #from netzob.Import.PCAPImporter.all import *
 #from netzob.Model.Vocabulary.Session import Session
 
 from processing import Processing
 from alignment import Alignment
+from aligned_matrix import AlignedMatrix
+from field_table import FieldTable
+from observation import ObservationProbabilities
 from constraint.message_similarity import MessageSimilarity
 from constraint.remote_coupling import RemoteCoupling
+from constraint.session_index import SessionIndex
 
 class Constraint:
     TEST_TYPE_REQUEST = 0
     TEST_TYPE_RESPONSE = 1
+    PAIRING_DIAGONAL = 'diagonal' # only the pairs fid-fid (the ones of the inference)
+    PAIRING_FULL = 'full' # all pairs of request and response fids
+    PAIRING_SINGLE = 'single' # the pairs fid-fid of the request fids alone (all messages are requests)
+    CONSTRAINTS = ['m', 'r', 's', 'd', 'v']
+    MAX_FIELD_SIZE = 10 # the longer fields are not candidates
     #FILENAME_P_REQUEST = "prob_request.txt"
     #FILENAME_P_RESPONSE = "prob_response.txt"
 
-    def __init__(self, messages, direction_list, fields, fid_list, output_dir='tmp/'):
+    def __init__(self, messages, direction_list, fields, fid_list, output_dir='tmp/', similarity_mode='exact', similarity_epsilon=0.01,
+            similarity_storage='memory', memory_budget=1 << 30, similarity_cache=True, similarity_budget=1 << 14, similarity_seed=0,
+            similarity_band=32, similarity_min_score=0.0, processes=1, pairing='diagonal',
+            constraints=None, directions=None):
         self.messages = messages
         self.direction_list = direction_list
         self.fields = fields
         self.fid_list = fid_list
+        self.field_table = FieldTable.from_fields(fields) # the columns of each field in the aligned matrix
         self.output_dir = output_dir
+        self.similarity_mode = similarity_mode # see MessageSimilarity
+        self.similarity_epsilon = similarity_epsilon
+        self.similarity_storage = similarity_storage # memory, or disk (memory-mapped files in output_dir)
+        self.memory_budget = memory_budget # bytes of the working buffers of the similarity matrices
+        self.similarity_cache = similarity_cache # keep the similarity matrices in output_dir for the next runs
+        self.similarity_budget = similarity_budget # the sampled pairs per cluster of the stratified mode
+        self.similarity_seed = similarity_seed
+        self.similarity_band = similarity_band # the band and early-exit score of the pairwise mode
+        self.similarity_min_score = similarity_min_score
+
+        self.processes = processes # the worker processes of the candidate fids (1: no workers)
+        self.pairing = pairing # the pairs of request and response fids to compute
+        # the constraints and directions used by the inference (all by default); the other ones are not computed
+        self.constraints = constraints if constraints is not None else Constraint.CONSTRAINTS
+        self.directions = directions if directions is not None else [Constraint.TEST_TYPE_REQUEST, Constraint.TEST_TYPE_RESPONSE]
+        self.pool = None
+
+        # shared by all runs of compute_observation_probabilities (see prepare)
+        self.messages_aligned = None
+        self.aligned_matrix = None # the MSA of the trace (see get_aligned_matrix)
+        self.i_row = None # the row of each message in the aligned matrix: {message id: row}
+        self.value_codes = None # the code matrix of the candidate fids (see get_value_codes)
+        self.i_code = None # the row of each candidate fid in the code matrix: {fid: row}
+        self.context = None # the messages and similarity of the last run (see get_context)
+
+    # load the alignment, filter the candidate fields, and compute the similarity matrices once
+    def prepare(self):
+        self.messages_aligned = Alignment.attach_messages(self.messages, self.get_aligned_matrix())
+        messages_request_aligned, messages_response_aligned = Processing.divide_msgs_by_directionlist(self.messages_aligned, self.direction_list)
+        matrix_request, matrix_response = self.aligned_matrix.divide_by_directionlist(self.direction_list)
+
+        self.fid_list_request = self.filter_fields(self.fid_list, messages_request_aligned)
+        self.fid_list_response = self.filter_fields(self.fid_list, messages_response_aligned)
+        logging.debug("request candidate fid: {}\nresponse candidate fid: {}".format(self.fid_list_request, self.fid_list_response))
 
-    def compute_observation_probabilities(self):
+        # compute matrix of similarity scores
+        self.constraint_m_request = MessageSimilarity(messages=messages_request_aligned, mode=self.similarity_mode, epsilon=self.similarity_epsilon,
+            storage=self.similarity_storage, output_dir=self.output_dir, tag='request', memory_budget=self.memory_budget, cache=self.similarity_cache,
+            pair_budget=self.similarity_budget, seed=self.similarity_seed, band=self.similarity_band, min_score=self.similarity_min_score,
+            aligned_matrix=matrix_request)
+        self.constraint_m_response = MessageSimilarity(messages=messages_response_aligned, mode=self.similarity_mode, epsilon=self.similarity_epsilon,
+            storage=self.similarity_storage, output_dir=self.output_dir, tag='response', memory_budget=self.memory_budget, cache=self.similarity_cache,
+            pair_budget=self.similarity_budget, seed=self.similarity_seed, band=self.similarity_band, min_score=self.similarity_min_score,
+            aligned_matrix=matrix_response)
+        if 'm' in self.constraints:
+            self.constraint_m_request.compute_similarity_matrix()
+            if Constraint.TEST_TYPE_RESPONSE in self.directions:
+                self.constraint_m_response.compute_similarity_matrix()
+
+        # the request/response pairs of the sessions (shared by the remote coupling of all fids)
+        self.session_index = None
+        if 'r' in self.constraints:
+            self.session_index = SessionIndex.from_messages(self.messages_aligned, self.direction_list)
+
+        # the index of each message in its direction
+        self.i_direction_list = list()
+        num_request, num_response = 0, 0
+        for d in self.direction_list:
+            if d == 0:
+                self.i_direction_list.append(num_request)
+                num_request += 1
+            else:
+                self.i_direction_list.append(num_response)
+                num_response += 1
+
+    # indices: only use these messages (e.g., a resample of Bootstrap); all messages if None
+    # output: the observation probabilities of each direction (None if the direction is not in directions)
+    # with processes > 1, the candidate fids are evaluated by a pool of worker processes, which is kept for the next runs
+    # (see close); the workers are forked after prepare, so they share the aligned messages and similarity matrices
+    def compute_observation_probabilities(self, indices=None):
         print("[++++++++] Compute probabilities of observation constraints")
-        messages_aligned = Alignment.get_messages_aligned(self.messages, os.path.join(self.output_dir, Alignment.FILENAME_OUTPUT_ONELINE))
-        messages_request, messages_response = Processing.divide_msgs_by_directionlist(self.messages, self.direction_list)
-        messages_request_aligned, messages_response_aligned = Processing.divide_msgs_by_directionlist(messages_aligned, self.direction_list)
-
-        fid_list_request = self.filter_fields(self.fields, self.fid_list, messages_request_aligned)
-        fid_list_response = self.filter_fields(self.fields, self.fid_list, messages_response_aligned)
-        logging.debug("request candidate fid: {}\nresponse candidate fid: {}".format(fid_list_request, fid_list_response))
+        if self.messages_aligned is None:
+            self.prepare()
+
+        fid_list_request = self.fid_list_request
+        tasks = [(Constraint.TEST_TYPE_REQUEST, fid, indices) for fid in fid_list_request]
+        # the response fids of any pair (their clusters are only needed by the response direction and the remote coupling)
+        fid_pairs = [(fid_request, fid_response) for fid_request in fid_list_request for fid_response in self.get_paired_fids(fid_request)]
+        fid_list_response = [fid for fid in self.fid_list if fid in set(fid_response for fid_request, fid_response in fid_pairs)]
+        if Constraint.TEST_TYPE_RESPONSE not in self.directions and 'r' not in self.constraints:
+            fid_list_response = list()
+        tasks += [(Constraint.TEST_TYPE_RESPONSE, fid, indices) for fid in fid_list_response]
+        if self.processes > 1 and len(tasks) > 1:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.processes, initializer=Constraint.init_worker, initargs=(self,))
+            results = self.pool.map(Constraint.run_in_worker, tasks)
+        else:
+            results = [self.run_task(task) for task in tasks]
+        results_request, results_response = results[:len(fid_list_request)], results[len(fid_list_request):]
 
-        # compute matrix of similarity scores
-        constraint_m_request, constraint_m_response = MessageSimilarity(messages = messages_request_aligned), MessageSimilarity(messages = messages_response_aligned)
-        constraint_m_request.compute_similarity_matrix()
-        constraint_m_response.compute_similarity_matrix()
-        
         # the observation prob of each cluster: {fid: the list of observation probabilities ([pm,ps,pd,pv])} 
-        cluster_p_request, cluster_p_response = dict(), dict() 
+        cluster_p_request = {fid: p for fid, (p, size, labels) in zip(fid_list_request, results_request)}
+        cluster_p_response = {fid: p for fid, (p, size, labels) in zip(fid_list_response, results_response)}
         # the size of each cluster
-        cluster_size_request, cluster_size_response = dict(), dict()
+        cluster_size_request = {fid: size for fid, (p, size, labels) in zip(fid_list_request, results_request)}
+        cluster_size_response = {fid: size for fid, (p, size, labels) in zip(fid_list_response, results_response)}
+        # the remote coupling of all pairs: {fid-fid: [p_r_request, p_r_response]}
+        pairs_p_r = self.compute_remote_coupling(indices, fid_pairs, fid_list_request, results_request, fid_list_response, results_response)
+
         # the observation prob of each cluster pair: {fid-fid: [,]}
         pairs_p_request, pairs_p_response = dict(), dict()
         pairs_size_request, pairs_size_response = dict(), dict()
 
-        for fid_request in fid_list_request:
-            logging.info("[++++] Test Request Field {0}-*".format(fid_request))
-
-            # merge other fields
-            fields_merged_request = self.merge_nontest_fields(self.fields, fid_request)
-            fid_merged_request = 0 if fid_request == 0 else 1
-
-            # generate clusters
-            symbols_request_aligned = self.cluster_by_field(fields_merged_request, messages_request_aligned, fid_merged_request)
-            # change symbol names
-            symbols_request_aligned = self.change_symbol_name(symbols_request_aligned)
-
-            # compute prob of m,s,d,v
-            cluster_p_request[fid_request] = list()
-            cluster_p_request[fid_request].append(constraint_m_request.compute_constraint_message_similarity(symbols_request_aligned))
-            cluster_p_request[fid_request].append(self.compute_constraint_structure(symbols_request_aligned))
-            cluster_p_request[fid_request].append(self.compute_constraint_dimension(symbols_request_aligned))
-            cluster_p_request[fid_request].append(self.compute_constraint_value(symbols_request_aligned))
-            cluster_size_request[fid_request] = [len(s.messages) for s in symbols_request_aligned.values()]
-
-            for fid_response in fid_list_response:
-                #if fid_request != fid_response:
-                #    continue
-                logging.debug("[++] Test Response Field {0}-{1}".format(fid_request, fid_response))
-
-                # merge other fields
-                fields_merged_response = self.merge_nontest_fields(self.fields, fid_response)
-                fid_merged_response = 0 if fid_response == 0 else 1
-
-                # generate clusters
-                symbols_response_aligned = self.cluster_by_field(fields_merged_response, messages_response_aligned, fid_merged_response)
-                # change symbol names
-                symbols_response_aligned = self.change_symbol_name(symbols_response_aligned)
-
-                # compute prob of m,s,d,v
-                if fid_response not in cluster_p_response:
-                    cluster_p_response[fid_response] = list()
-                    cluster_p_response[fid_response].append(constraint_m_response.compute_constraint_message_similarity(symbols_response_aligned))
-                    cluster_p_response[fid_response].append(self.compute_constraint_structure(symbols_response_aligned))
-                    cluster_p_response[fid_response].append(self.compute_constraint_dimension(symbols_response_aligned))
-                    cluster_p_response[fid_response].append(self.compute_constraint_value(symbols_response_aligned))
-                    cluster_size_response[fid_response] = [len(s.messages) for s in symbols_response_aligned.values()]
-
-                # print msg numbers of each cluster
-                logging.debug("Number of request symbols: {0}".format(len(symbols_request_aligned.values())))
-                for s in symbols_request_aligned.values():
-                    logging.debug("  Symbol {0} msgs numbers: {1}".format(str(s.name), len(s.messages)))
-                logging.debug("Number of response symbols: {0}".format(len(symbols_response_aligned.values())))
-                for s in symbols_response_aligned.values():
-                    logging.debug("  Symbol {0} msgs numbers: {1}".format(str(s.name), len(s.messages)))
-
-                # compute remote coupling probabilities
-                rc = RemoteCoupling(messages_all=messages_aligned, symbols_request=symbols_request_aligned, symbols_response=symbols_response_aligned, direction_list=self.direction_list)
-                rc.compute_pairs_by_directionlist()
-                fid_pair = "{}-{}".format(fid_request, fid_response)
-                p_r_request = rc.compute_constraint_remote_coupling(RemoteCoupling.TEST_TYPE_REQUEST)
-                p_r_response = rc.compute_constraint_remote_coupling(RemoteCoupling.TEST_TYPE_RESPONSE)
-
-                logging.debug("[+] Observation Prob Results for pairs {}".format(fid_pair))
-                p_m, p_s, p_d, p_v = cluster_p_request[fid_request][0], cluster_p_request[fid_request][1], cluster_p_request[fid_request][2], cluster_p_request[fid_request][3]
-                logging.debug("Request:\nPm: {0}\nPr: {1}\nPs: {2}\nPd: {3}\nPv: {4}".format(p_m, p_r_request, p_s, p_d, p_v))
-                pairs_p_request[fid_pair] = [p_m, p_r_request, p_s, p_d, p_v]
-                pairs_size_request[fid_pair] = cluster_size_request[fid_request]
-                
-                p_m, p_s, p_d, p_v = cluster_p_response[fid_response][0], cluster_p_response[fid_response][1], cluster_p_response[fid_response][2], cluster_p_response[fid_response][3]
-                logging.debug("Response:\nPm: {0}\nPr: {1}\nPs: {2}\nPd: {3}\nPv: {4}".format(p_m, p_r_response, p_s, p_d, p_v))
-                pairs_p_response[fid_pair] = [p_m, p_r_response, p_s, p_d, p_v]
-                pairs_size_response[fid_pair] = cluster_size_response[fid_response]
-                
-                del rc
-                del symbols_response_aligned #symbols
-                del fields_merged_response
-                gc.collect()
-            del symbols_request_aligned
-            del fields_merged_request
-            gc.collect()
-
-        pairs_p = [pairs_p_request, pairs_p_response]
-        pairs_size = [pairs_size_request, pairs_size_response]
-
-        return pairs_p, pairs_size
-
-    def save_observation_probabilities(self, pairs_p, pairs_size, direction):
+        for fid_request, fid_response in fid_pairs:
+            fid_pair = "{}-{}".format(fid_request, fid_response)
+            logging.debug("[+] Observation Prob Results for pairs {}".format(fid_pair))
+            p_r_request, p_r_response = pairs_p_r[fid_pair] if fid_pair in pairs_p_r else [[-1] * len(cluster_size_request[fid_request]), None]
+            p_m, p_s, p_d, p_v = cluster_p_request[fid_request][0], cluster_p_request[fid_request][1], cluster_p_request[fid_request][2], cluster_p_request[fid_request][3]
+            logging.debug("Request:\nPm: {0}\nPr: {1}\nPs: {2}\nPd: {3}\nPv: {4}".format(p_m, p_r_request, p_s, p_d, p_v))
+            pairs_p_request[fid_pair] = [p_m, p_r_request, p_s, p_d, p_v]
+            pairs_size_request[fid_pair] = cluster_size_request[fid_request]
+            if Constraint.TEST_TYPE_RESPONSE not in self.directions:
+                continue
+            if p_r_response is None:
+                p_r_response = [-1] * len(cluster_size_response[fid_response])
+
+            p_m, p_s, p_d, p_v = cluster_p_response[fid_response][0], cluster_p_response[fid_response][1], cluster_p_response[fid_response][2], cluster_p_response[fid_response][3]
+            logging.debug("Response:\nPm: {0}\nPr: {1}\nPs: {2}\nPd: {3}\nPv: {4}".format(p_m, p_r_response, p_s, p_d, p_v))
+            pairs_p_response[fid_pair] = [p_m, p_r_response, p_s, p_d, p_v]
+            pairs_size_response[fid_pair] = cluster_size_response[fid_response]
+
+        p_observation_request = ObservationProbabilities.from_lists(pairs_p_request, pairs_size_request)
+        p_observation_response = None
+        if Constraint.TEST_TYPE_RESPONSE in self.directions:
+            p_observation_response = ObservationProbabilities.from_lists(pairs_p_response, pairs_size_response)
+
+        return p_observation_request, p_observation_response
+
+    # the messages and similarity of a run (cached for the next tasks of the same run)
+    def get_context(self, indices):
+        if self.context is not None and self.context[0] == indices:
+            return self.context[1]
+        context = dict()
+        rows = np.arange(len(self.messages)) if indices is None else np.asarray(indices, dtype=np.int64)
+        directions = np.asarray(self.direction_list, dtype=np.int64)[rows]
+        context['num_messages'] = len(rows)
+        # the positions of the messages of each direction in the run, and their rows in the aligned matrix
+        context['positions_request'], context['positions_response'] = np.flatnonzero(directions == 0), np.flatnonzero(directions != 0)
+        context['rows_request'], context['rows_response'] = rows[context['positions_request']], rows[context['positions_response']]
+        if indices is None:
+            context['constraint_m_request'], context['constraint_m_response'] = self.constraint_m_request, self.constraint_m_response
+            context['session_index'] = self.session_index
+        else:
+            context['constraint_m_request'], context['constraint_m_response'] = None, None
+            if 'm' in self.constraints:
+                context['constraint_m_request'] = self.constraint_m_request.select([self.i_direction_list[i] for i in indices if self.direction_list[i] == 0])
+            if 'm' in self.constraints and Constraint.TEST_TYPE_RESPONSE in self.directions:
+                context['constraint_m_response'] = self.constraint_m_response.select([self.i_direction_list[i] for i in indices if self.direction_list[i] != 0])
+            context['session_index'] = self.session_index.select(indices) if self.session_index is not None else None
+        self.context = (indices, context)
+        return context
+
+    # the clusters of the messages of rows by a candidate fid (the messages with the same value of the field)
+    # output: the cluster of each message (numbered by first appearance) and the size of each cluster
+    def generate_clusters(self, fid, rows):
+        labels, num_clusters = FieldTable.factorize(self.get_value_codes()[self.i_code[fid]][rows])
+        return labels, np.bincount(labels, minlength=num_clusters)
+
+    # the indices of the messages of each cluster
+    @staticmethod
+    def get_clusters(labels, sizes):
+        return np.split(np.argsort(labels, kind='stable'), np.cumsum(sizes)[:-1])
+
+    # compute prob of m,s,d,v (-1 for the constraints that are not used)
+    # rows: the rows of the messages of the clusters in the aligned matrix
+    def compute_cluster_probabilities(self, clusters, rows, constraint_m):
+        computes = collections.OrderedDict()
+        computes['m'] = lambda: constraint_m.compute_constraint_message_similarity(clusters)
+        computes['s'] = lambda: self.compute_constraint_structure(clusters, rows)
+        computes['d'] = lambda: self.compute_constraint_dimension(clusters)
+        computes['v'] = lambda: self.compute_constraint_value(clusters)
+        return [compute() if c in self.constraints else [-1] * len(clusters) for c, compute in computes.items()]
+
+    # the remote coupling of all pairs of fids at once, from the clusters of the tasks (empty if r is not used)
+    def compute_remote_coupling(self, indices, fid_pairs, fid_list_request, results_request, fid_list_response, results_response):
+        if 'r' not in self.constraints or len(fid_pairs) == 0:
+            return dict()
+        session_index = self.session_index if indices is None else self.session_index.select(indices)
+        i_request = {fid: i for i, fid in enumerate(fid_list_request)}
+        i_response = {fid: i for i, fid in enumerate(fid_list_response)}
+
+        rc = RemoteCoupling(session_index=session_index, labels_request=np.stack([labels for (p, size, labels) in results_request]),
+            labels_response=np.stack([labels for (p, size, labels) in results_response]),
+            pairs=[(i_request[fid_request], i_response[fid_response]) for fid_request, fid_response in fid_pairs])
+        rc.compute_pairs_by_directionlist()
+        p_r_request_list = rc.compute_constraint_remote_coupling(RemoteCoupling.TEST_TYPE_REQUEST)
+        p_r_response_list = rc.compute_constraint_remote_coupling(RemoteCoupling.TEST_TYPE_RESPONSE)
+
+        pairs_p_r = dict()
+        for (fid_request, fid_response), p_r_request, p_r_response in zip(fid_pairs, p_r_request_list, p_r_response_list):
+            pairs_p_r["{}-{}".format(fid_request, fid_response)] = [p_r_request, p_r_response]
+        return pairs_p_r
+
+    # [pm,ps,pd,pv], cluster sizes, and the cluster of each message (for the remote coupling, None if r is not used)
+    # the constraints of the responses are None if the response direction is not used (only the clusters are needed)
+    def run_task(self, task):
+        test_type, fid, indices = task
+        context = self.get_context(indices)
+        direction = 'response' if test_type == Constraint.TEST_TYPE_RESPONSE else 'request'
+        if test_type == Constraint.TEST_TYPE_REQUEST:
+            logging.info("[++++] Test Request Field {0}-*".format(fid))
+        rows = context['rows_' + direction]
+        labels_direction, cluster_size = self.generate_clusters(fid, rows)
+
+        cluster_p = None
+        if test_type == Constraint.TEST_TYPE_REQUEST or Constraint.TEST_TYPE_RESPONSE in self.directions:
+            clusters = Constraint.get_clusters(labels_direction, cluster_size)
+            cluster_p = self.compute_cluster_probabilities(clusters, rows, context['constraint_m_' + direction])
+        # the cluster of each message of the run (-1 for the messages of the other direction)
+        labels = None
+        if 'r' in self.constraints:
+            labels = np.full(context['num_messages'], -1, dtype=np.int64)
+            labels[context['positions_' + direction]] = labels_direction
+        return cluster_p, cluster_size.tolist(), labels
+
+    # the aligned matrix of the trace (loaded once, memory-mapped)
+    def get_aligned_matrix(self):
+        if self.aligned_matrix is None:
+            self.aligned_matrix = AlignedMatrix.load(os.path.join(self.output_dir, Alignment.FILENAME_OUTPUT_ONELINE))
+            self.i_row = {message.id: i for i, message in enumerate(self.messages)}
+        return self.aligned_matrix
+
+    # the rows of the messages in the aligned matrix
+    def get_rows(self, messages):
+        self.get_aligned_matrix()
+        return np.array([self.i_row[message.id] for message in messages], dtype=np.int64)
+
+    # the code matrix of the fields that may be candidates, for all rows of the aligned matrix (computed once, and
+    # shared by the filter and the clusters of all runs)
+    def get_value_codes(self):
+        if self.value_codes is None:
+            fid_list = [fid for fid in self.fid_list if self.field_table.get_size(fid) <= Constraint.MAX_FIELD_SIZE]
+            self.value_codes = self.field_table.compute_codes(self.get_aligned_matrix(), fid_list)
+            self.i_code = {fid: k for k, fid in enumerate(fid_list)}
+        return self.value_codes
+
+    # the response fids paired with a request fid
+    def get_paired_fids(self, fid_request):
+        if self.pairing == Constraint.PAIRING_FULL:
+            return self.fid_list_response
+        if self.pairing == Constraint.PAIRING_SINGLE:
+            return [fid_request]
+        return [fid_request] if fid_request in self.fid_list_response else []
+
+    # stop the worker processes
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    @staticmethod
+    def init_worker(constraint):
+        global _constraint
+        _constraint = constraint
+
+    @staticmethod
+    def run_in_worker(task):
+        return _constraint.run_task(task)
+
+    def save_observation_probabilities(self, p_observation, direction):
         filename = "prob_request.txt" if direction == Constraint.TEST_TYPE_REQUEST else "prob_response.txt"
         filepath = os.path.join(self.output_dir, filename)
         
-        fid_pair_list = sorted(pairs_p.keys(), key= lambda x: (int(x.split('-')[direction]), int(x.split('-')[1 - direction])))
+        fid_pair_list = sorted(p_observation.keys(), key= lambda x: (int(x.split('-')[direction]), int(x.split('-')[1 - direction])))
         # Write into files
         with open(filepath, 'w') as fout:
             for fid_pair in fid_pair_list:
                 fout.write("{} ".format(fid_pair))
 
                 # write Pm/r/s/d/v
-                for p_list in pairs_p[fid_pair]:
+                for p_list in p_observation[fid_pair]:
                     for p in p_list[:-1]:
                         fout.write("{},".format(p))
                     try:
                         fout.write("{} ".format(p_list[-1]))
                     except:
                         pass
-                for n in pairs_size[fid_pair][:-1]:
+                size_list = p_observation.get_size(fid_pair)
+                for n in size_list[:-1]:
                     fout.write("{},".format(n))
                 try:
-                    fout.write("{} ".format(pairs_size[fid_pair][-1]))
+                    fout.write("{} ".format(size_list[-1]))
                 except:
                     pass
                 fout.write("\n")
@@ -195,57 +361,48 @@ class Constraint:
                 pairs_size[fid_pair] = [int(n) for n in line.split()[-1].split(",")]
                 #print("fid {}: {}".format(fid, dict_sn_msgnum[fid]))
 
-        return pairs_p, pairs_size
+        return ObservationProbabilities.from_lists(pairs_p, pairs_size)
 
     # compute p_s
     # TODO: provide another method to align each cluster again
-    def compute_constraint_structure(self, symbols):
+    def compute_constraint_structure(self, clusters, rows):
         logging.debug("[+] Compute observation probabilities of structure coherence")
-        sn_list = [str(s.name) for s in symbols.values()]
 
         # if there is ony one msg, then it is always 1.0
-        dict_result = dict() 
-        for s in symbols.values():
+        p_s = list()
+        matrix = self.get_aligned_matrix()
+        for mi_array in clusters:
+            gaps = matrix.get_gaps(rows[mi_array])
             # compute the num of gaps shared by all msgs
-            num_gap_extra = 0
-            for i in range(len(s.messages[0].data)):
-                valuelist = [message.data[i] for message in s.messages]
-                if len(set(valuelist)) == 1 and valuelist[0] == '-':
-                    num_gap_extra += 1
+            num_gap_extra = int(np.sum(np.all(gaps, axis=0)))
             #print("Num Extra Gaps: {}".format(num_gap_extra))
             
             # compute ave num of gaps
-            num_gap = 0 
-            for message in s.messages:
-                num_gap += (message.data.count("-") - num_gap_extra)
+            num_gap = int(np.sum(gaps)) - num_gap_extra * len(mi_array)
 
-            num_gap_ave = num_gap / len(s.messages)
-            percentage_gap = num_gap_ave / (len(s.messages[0].data) - num_gap_extra)
-            dict_result[s.name] = [1 - percentage_gap, num_gap_ave]
-
-        p_s = list()
-        for s in sn_list:
-            p_s.append(dict_result[s][0])
+            num_gap_ave = num_gap / len(mi_array)
+            percentage_gap = num_gap_ave / (matrix.num_columns - num_gap_extra)
+            p_s.append(1 - percentage_gap)
 
         return p_s
 
     # compute p_d
-    def compute_constraint_dimension(self, symbols):
+    def compute_constraint_dimension(self, clusters):
         logging.debug("[+] Compute observation probabilities of dimension")
         num_smallsymbols = 0
-        for s in symbols.values():
-            if len(s.messages) <= 2:
+        for mi_array in clusters:
+            if len(mi_array) <= 2:
                 num_smallsymbols += 1
 
-        p = 1 - num_smallsymbols / len(symbols.values())
+        p = 1 - num_smallsymbols / len(clusters)
         p_d = [p]
 
         return p_d
 
     # compute p_v
-    def compute_constraint_value(self, symbols):
+    def compute_constraint_value(self, clusters):
         # TODO: may not need it
-        if len(symbols.values()) == 1:
+        if len(clusters) == 1:
             p = -1
         else:
             p = 1
@@ -256,19 +413,17 @@ class Constraint:
     """ Processing Func
     """
     # eliminate impossible fileds
-    def filter_fields(self, fields, fid_list, messages):
+    def filter_fields(self, fid_list, messages):
         logging.debug("[++++] Filter Fields")
         fid_list_new = list()
+        rows = self.get_rows(messages)
         for fid in fid_list:
             logging.debug("\n[+] Test Field_{0}".format(fid))
 
-            il, ir = 0, 0
-            for i in range(fid):
-                il += fields[i].domain.dataType.size[1] // 8
-            ir = il + (fields[fid].domain.dataType.size[1] // 8)
+            il, ir = self.field_table.get_range(fid)
 
             # -1: the test field is too long
-            if (fields[fid].domain.dataType.size[1] // 8) > 10:
+            if self.field_table.get_size(fid) > Constraint.MAX_FIELD_SIZE:
                 logging.debug("The tested field is too long.")
                 continue
 
@@ -281,17 +436,16 @@ class Constraint:
 
             #-3: too many symbols (>60%)
             # TODO
-            f_values = [message.data[il:ir] for message in messages]
-            try:
-                percentage = len(messages) / len(set(f_values))
-                if percentage < 1.5 or len(set(f_values)) > 50: # TODO: save time, but may cause error in small data set (modbus_100)
-                    logging.debug("There are too many symbols")
-                    continue
-
-                fid_list_new.append(fid)
-            except:
+            num_values = len(np.unique(self.get_value_codes()[self.i_code[fid]][rows]))
+            if num_values == 0:
+                continue
+            percentage = len(messages) / num_values
+            if percentage < 1.5 or num_values > 50: # TODO: save time, but may cause error in small data set (modbus_100)
+                logging.debug("There are too many symbols")
                 continue
 
+            fid_list_new.append(fid)
+
         #print(len(fid_list_new), fid_list_new)
         return fid_list_new
 
@@ -301,78 +455,4 @@ class Constraint:
                 return True
         return False
 
-    # merge other fields that are not tested in this run
-    def merge_nontest_fields(self, fields_origin, fid):
-        logging.debug("[+] Merge Fields")
-        fields_merged = list()
-        fields = copy.deepcopy(fields_origin)
-        fsize_total = 0
-        for i in range(len(fields)):
-            typename = fields[i].domain.dataType.typeName
-            if typename != "Raw":
-                logging.error("Field type is not Raw")
-            typesize = fields[i].domain.dataType.size[1]
-            # print(i, fid, typesize, type(typesize))
-
-            if i == fid:
-                if fsize_total > 0:
-                    field = Field(Raw(nbBytes=fsize_total//8))
-                    fields_merged.append(field)
-                    fsize_total = 0
-                if fid != (len(fields) - 1):    
-                    field = Field(Raw(nbBytes=typesize//8))
-                    fields_merged.append(field)
-                    field = Field()
-                    fields_merged.append(field)
-                else:
-                    if type(typesize).__name__ == 'NoneType':
-                        field = Field()
-                    else:
-                        field = Field(Raw(nbBytes=typesize//8))
-                    fields_merged.append(field)
-                break
-            else:
-                fsize_total += typesize         
-
-        return fields_merged
-
-    def cluster_by_field(self, fields, messages, fid_merged):
-        logging.debug("[+] Generate Clusters")
-        if fid_merged == 0:
-            il = 0
-            ir = fields[0].domain.dataType.size[1] // 8
-        elif fid_merged == 1:
-            il =fields[0].domain.dataType.size[1] // 8
-            ir = il + (fields[1].domain.dataType.size[1] // 8)
-        else:
-            logging.error("Error: fid_merged should be 0 or 1")
-
-        f_values = [message.data[il:ir] for message in messages]
-
-        dict_fv_i = dict()
-        for i,fv in enumerate(f_values):
-            if fv not in dict_fv_i:
-                dict_fv_i[fv] = list()
-            dict_fv_i[fv].append(i)
-
-        symbols = collections.OrderedDict()
-        for fv in dict_fv_i:
-            s = Symbol(name=fv, messages=[messages[i] for i in dict_fv_i[fv]])
-            symbols[fv] = s
-
-        return symbols
-
-    def change_symbol_name(self, symbols):
-        logging.debug("[+] Change symbol names")
-        for keyFieldName, symbol in symbols.items():
-            if type(keyFieldName).__name__ == "bytes":
-                keyFieldName = binascii.unhexlify(keyFieldName)
-                keyFieldName = keyFieldName.hex()
-                symbol.name = str(keyFieldName)
-            else:
-                symbol.name = keyFieldName
-            if len(symbol.name) > 40:
-                md5 = hashlib.md5()
-                md5.update(symbol.name.encode('utf-8'))
-                symbol.name = str(md5.hexdigest())
-        return symbols
+_constraint = None # the prepared Constraint in the workers
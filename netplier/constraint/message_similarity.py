@@ -15,33 +15,609 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>
 
 import logging
+import glob
+import hashlib
+import math
+import multiprocessing
+import os
+import tempfile
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+
+from aligned_matrix import AlignedMatrix
+
+"""
+The similarity score of two aligned messages is the fraction of matching characters
+The scores are stored as a symmetric matrix of match counts (uint16) together with the length of each message,
+and computed by square tiles of the upper triangle (one thread per tile)
+With the disk storage, the matrix is a memory-mapped .npy file in output_dir (the row histograms and the matrices of
+selected subsets are temporary files there), and all working buffers (tiles, chunks of rows) are bounded by memory_budget
+The files are mapped again for each tile or chunk (see reopen), so the pages read or written are not kept resident
+With the cache, the matrix is saved in output_dir as similarity_{tag}_{fingerprint}.npy, where the fingerprint is a hash
+of the aligned messages (thus of the alignment and the direction split), and memory-mapped back by the next runs
+When all messages have the same length L, the scores only take L+1 values (matches/L), so the inner/inter scores of
+each cluster are kept as histograms of the match counts
+
+In the approximate mode (for large traces), the N*N matrix is not computed: the messages are encoded as bit-sampling
+LSH signatures (the characters at signature_size random positions, all positions by default), and the inner/inter
+histograms of each cluster are estimated from num_samples random pairs. By the DKW inequality, num_samples bounds the
+error of both distributions (and thus of the EER) by epsilon with probability 1-delta
+The stratified mode samples in the same way with a fixed budget of pair_budget inner and inter pairs per cluster, and
+the inter pairs are stratified over the other clusters, so the cost of a candidate fid doesn't depend on the sizes of
+its clusters (see benchmark_similarity.py for the drift of p_m against the exact mode)
+
+In the profile mode, each cluster is summarized by its column profile (the frequency of each character in each column),
+and each message is scored against the profiles: the mean score with the messages of a cluster.
+The inner scores of a cluster are the ones of its messages (without themselves), the inter scores are the ones of the
+other messages, so the cost is O(N*C*L) for C clusters instead of O(N*N*L)
+
+In the pairwise mode, the scores don't come from the MSA rows but from a banded global alignment of each pair of raw
+messages (see align_pairs). The pairs are aligned by batches in a process pool, each step computing an anti-diagonal of
+all pairs of a batch, so the cost is O(N*N*L*band) instead of O(N*N*L*L)
+"""
 class MessageSimilarity:
+    SCORE_SAME = 100.0 # the score of a message with itself
+    SCORE_LENGTH_MISMATCH = -2
+    TILE_BUDGET = 1 << 25 # the number of compared characters of a tile
+    MODE_EXACT = 'exact'
+    MODE_APPROXIMATE = 'approx'
+    MODE_PROFILE = 'profile'
+    MODE_STRATIFIED = 'stratified'
+    MODE_PAIRWISE = 'pairwise'
+    MODES_SIGNATURE = [MODE_APPROXIMATE, MODE_PROFILE, MODE_STRATIFIED] # the modes without the N*N matrix
+    PAIRWISE_SCALE = 1000 # the pairwise scores are quantized to PAIRWISE_SCALE+1 codes
+    PAIRWISE_BATCH = 4096 # the max number of pairs aligned together
+    PAIRWISE_CHECK = 32 # the anti-diagonals between two checks of the finished and abandoned pairs
+    STORAGE_MEMORY = 'memory'
+    STORAGE_DISK = 'disk'
+    FILENAME_MATRIX = "similarity_{}.npy"
+    FILENAME_MATRIX_CACHE = "similarity_{}_{}.npy"
 
-    def __init__(self, messages):
+    # tag: the name of the files of the disk storage and the cache (e.g., request or response)
+    # aligned_matrix: the AlignedMatrix of the messages (the characters are encoded from the messages if None)
+    def __init__(self, messages, threads=None, mode='exact', epsilon=0.01, delta=0.05, signature_size=None, seed=0,
+            storage='memory', output_dir='tmp/', tag='messages', memory_budget=1 << 30, cache=False, pair_budget=1 << 14,
+            band=32, min_score=0.0, aligned_matrix=None):
         self.messages = messages
-        self.similarity_matrix = list()
+        self.aligned_matrix = aligned_matrix
+        self.threads = threads if threads else os.cpu_count()
+        self.storage = storage
+        self.cache = cache
+        self.output_dir = output_dir
+        self.tag = tag
+        self.memory_budget = memory_budget
+        self.mode = mode
+        self.epsilon = epsilon
+        self.delta = delta
+        self.signature_size = signature_size
+        self.seed = seed
+        self.pair_budget = pair_budget # the number of sampled inner (and inter) pairs of a cluster in the stratified mode
+        self.band = band # the band of the pairwise alignments (besides the difference of lengths)
+        self.min_score = min_score # the pairwise alignments that can't reach it are abandoned (scored 0)
+        self.rng = np.random.RandomState(seed)
+        self.signatures = None
+        self.num_codes = None
+        self.match_counts = None
+        self.match_counts_buffer = None # the buffer of the matrix in memory when it has been grown (see grow_matrix)
+        self.data_matrix = None
+        self.lengths = None
+        self.length = None # the length of all messages (None if they don't have same length)
+        self.row_histograms = None
 
     def compute_similarity_matrix(self):
+        # use the MSA result is quick, but less accurate
+        if self.mode == MessageSimilarity.MODE_PAIRWISE:
+            self.compute_pairwise_matrix()
+            return
+        if self.aligned_matrix is not None:
+            data_matrix = self.aligned_matrix.data
+            self.lengths = np.full(self.aligned_matrix.num_rows, self.aligned_matrix.num_columns, dtype=np.int64)
+        else:
+            data_matrix, self.lengths = MessageSimilarity.encode_messages(self.messages)
+        self.length = MessageSimilarity.get_common_length(self.lengths)
+        if self.mode in MessageSimilarity.MODES_SIGNATURE:
+            if self.length is not None:
+                self.compute_signatures(data_matrix)
+                return
+            logging.warning("The messages don't have same length, use the exact similarity matrix")
+            self.mode = MessageSimilarity.MODE_EXACT
+
+        fingerprint = None
+        if self.cache:
+            fingerprint = MessageSimilarity.compute_fingerprint(data_matrix, self.lengths, self.tag)
+            if self.load_cache(fingerprint):
+                self.data_matrix = data_matrix
+                return
+            # the matrix of a previous run on the first messages (the trace was extended since)
+            num_prefix = self.load_cache_prefix(data_matrix)
+            if num_prefix > 0:
+                lengths = self.lengths
+                self.data_matrix, self.lengths = data_matrix[:num_prefix], lengths[:num_prefix]
+                self.append_data(data_matrix[num_prefix:], lengths[num_prefix:])
+                return
+
         print("[++++] Compute matrix of similarity scores")
-        scoreslist = list()
-        for i in range(len(self.messages)):
-            initial_scores_list = [-1 for i in range(len(self.messages))]
-            scoreslist.append(initial_scores_list)
+        num_message, length_max = data_matrix.shape
+        dtype = np.uint16 if length_max <= np.iinfo(np.uint16).max else np.uint32
+        self.data_matrix = data_matrix
+        self.match_counts_buffer = None
+        if num_message == 0:
+            self.match_counts = np.zeros((0, 0), dtype=dtype)
+            return
+        if self.cache:
+            # the cache file is complete only when it is renamed (see save_cache)
+            filename = MessageSimilarity.FILENAME_MATRIX_CACHE.format(self.tag, fingerprint) + ".tmp"
+        else:
+            filename = MessageSimilarity.FILENAME_MATRIX.format(self.tag)
+        self.match_counts = self.allocate((num_message, num_message), dtype, filename)
+        self.compute_rows(0)
+        if self.cache:
+            self.save_cache(fingerprint)
+        self.log_length_mismatch()
+
+    # append new aligned messages: only the N*M+M*M pairs with them are computed, and the matrix is grown in place
+    # (the messages of the matrix are kept as they are, so the new ones must be aligned in the same way)
+    def append_messages(self, messages):
+        if self.mode != MessageSimilarity.MODE_EXACT or self.match_counts is None:
+            logging.error("Only the computed exact similarity matrix can be appended")
+            return
+        data_new, lengths_new = MessageSimilarity.encode_messages(messages)
+        self.messages = list(self.messages) + list(messages)
+        self.append_data(data_new, lengths_new)
+
+    def append_data(self, data_new, lengths_new):
+        num_old, num_message = len(self.data_matrix), len(self.data_matrix) + len(data_new)
+        print("[++++] Append {} messages to matrix of similarity scores of {} messages".format(len(data_new), num_old))
+        # the padding of the shorter messages is corrected in compute_tile
+        length_max = max(self.data_matrix.shape[1], data_new.shape[1])
+        data_matrix = np.zeros((num_message, length_max), dtype=np.uint8)
+        data_matrix[:num_old, :self.data_matrix.shape[1]] = self.data_matrix
+        data_matrix[num_old:, :data_new.shape[1]] = data_new
+        length_old = self.length
+        self.data_matrix = data_matrix
+        self.lengths = np.concatenate([self.lengths, lengths_new])
+        self.length = MessageSimilarity.get_common_length(self.lengths)
+        self.append_aligned_matrix(num_old, data_new, lengths_new)
+
+        dtype = self.match_counts.dtype
+        if length_max > np.iinfo(dtype).max:
+            dtype = np.uint32
+        fingerprint = MessageSimilarity.compute_fingerprint(self.data_matrix, self.lengths, self.tag) if self.cache else None
+        self.grow_matrix(num_old, num_message, dtype, fingerprint)
+        self.compute_rows(num_old)
+        self.update_row_histograms(num_old, length_old)
+        if self.cache:
+            self.save_cache(fingerprint)
+        self.log_length_mismatch()
+
+    # keep the rows of the aligned matrix in sync with the appended messages (they are its rows already if they were
+    # loaded from it, see compute_similarity_matrix); the matrix is not used anymore if they aren't aligned in the same way
+    def append_aligned_matrix(self, num_old, data_new, lengths_new):
+        if self.aligned_matrix is None or self.aligned_matrix.num_rows == num_old + len(data_new):
+            return
+        num_columns = self.aligned_matrix.num_columns
+        if self.aligned_matrix.num_rows == num_old and data_new.shape[1] == num_columns and np.all(lengths_new == num_columns):
+            self.aligned_matrix = self.aligned_matrix.concatenate(AlignedMatrix(data_new))
+        else:
+            logging.warning("The appended messages are not aligned as the aligned matrix, which is not used anymore")
+            self.aligned_matrix = None
+
+    # the scores of rows [row_start, N) against all columns, by square tiles (mirrored)
+    def compute_rows(self, row_start):
+        num_message, length_max = self.data_matrix.shape
+        # each thread holds a tile of tile_size*tile_size*length_max compared characters
+        tile_budget = min(MessageSimilarity.TILE_BUDGET, self.memory_budget // self.threads)
+        tile_size = max(1, int(math.sqrt(tile_budget // max(1, length_max)))) # math.isqrt needs python 3.8
+        tiles = list()
+        for il in range(row_start, num_message, tile_size):
+            ir = min(il + tile_size, num_message)
+            tiles += [(il, ir, jl, min(jl + tile_size, row_start)) for jl in range(0, row_start, tile_size)]
+            tiles += [(il, ir, jl, min(jl + tile_size, num_message)) for jl in range(row_start, il + 1, tile_size)]
+        # numpy releases the GIL in the comparisons, and the tiles write disjoint blocks
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            list(executor.map(lambda tile: self.compute_tile(*tile), tiles))
+
+    # rows [il, ir) against columns [jl, jr), mirrored
+    def compute_tile(self, il, ir, jl, jr):
+        data_matrix = self.data_matrix
+        counts = (data_matrix[il:ir, None, :] == data_matrix[None, jl:jr, :]).sum(axis=2, dtype=self.match_counts.dtype)
+        if self.length is None:
+            # two messages of same length also match on the padding (the other pairs are scored as length mismatch)
+            lengths_rows, lengths_cols = self.lengths[il:ir, None], self.lengths[None, jl:jr]
+            counts -= np.where(lengths_rows == lengths_cols, data_matrix.shape[1] - lengths_rows, 0).astype(counts.dtype)
+        match_counts = MessageSimilarity.reopen(self.match_counts, 'r+')
+        match_counts[il:ir, jl:jr] = counts
+        match_counts[jl:jr, il:ir] = counts.T
+        if isinstance(match_counts, np.memmap):
+            match_counts.flush()
+
+    # grow the matrix from num_old to num_message messages (the new rows and columns are computed after)
+    # in memory, the matrix is a view of a buffer whose capacity is doubled when it is full, so the old scores are
+    # copied O(log N) times; on disk, the .npy file is rewritten by chunks of rows (the rows of a file are contiguous)
+    def grow_matrix(self, num_old, num_message, dtype, fingerprint):
+        buffer = self.match_counts_buffer
+        if self.storage != MessageSimilarity.STORAGE_DISK:
+            if buffer is None or len(buffer) < num_message or buffer.dtype != dtype:
+                capacity = max(num_message, 2 * num_old)
+                buffer = np.zeros((capacity, capacity), dtype=dtype)
+                buffer[:num_old, :num_old] = self.match_counts
+                self.match_counts_buffer = buffer
+            self.match_counts = buffer[:num_message, :num_message]
+            return
+
+        if self.cache:
+            filename = MessageSimilarity.FILENAME_MATRIX_CACHE.format(self.tag, fingerprint) + ".tmp"
+        else:
+            filename = MessageSimilarity.FILENAME_MATRIX.format(self.tag) + ".tmp"
+        match_counts = self.allocate((num_message, num_message), dtype, filename)
+        chunk_size = self.get_chunk_size(num_message * match_counts.itemsize * 2)
+        for il in range(0, num_old, chunk_size):
+            ir = min(il + chunk_size, num_old)
+            MessageSimilarity.reopen(match_counts, 'r+')[il:ir, :num_old] = MessageSimilarity.reopen(self.match_counts)[il:ir]
+        self.match_counts = match_counts
+        if not self.cache:
+            # the file of the matrix is only replaced when the old rows are copied
+            filepath = os.path.join(self.output_dir, MessageSimilarity.FILENAME_MATRIX.format(self.tag))
+            os.replace(filepath + ".tmp", filepath)
+            self.match_counts = np.load(filepath, mmap_mode='r')
+
+    def log_length_mismatch(self):
+        num_message = len(self.lengths)
+        length_counts = np.unique(self.lengths, return_counts=True)[1]
+        num_mismatch = (num_message * num_message - int(np.sum(length_counts * length_counts))) // 2
+        if num_mismatch > 0:
+            logging.error("{} pairs of compared messages don't have same length.".format(num_mismatch))
+
+    # the scores of banded global alignments of the raw messages, instead of the rows of the MSA
+    # the matrix holds the scores quantized to 0..PAIRWISE_SCALE, with all lengths set to PAIRWISE_SCALE,
+    # so the histograms of the inner/inter scores are computed as in the exact mode
+    def compute_pairwise_matrix(self):
+        if self.aligned_matrix is not None:
+            data_matrix, lengths = MessageSimilarity.encode_data_list(self.aligned_matrix.get_raw_data_list())
+        else:
+            data_matrix, lengths = MessageSimilarity.encode_messages_raw(self.messages)
+        num_message = len(data_matrix)
+        self.lengths = np.full(num_message, MessageSimilarity.PAIRWISE_SCALE, dtype=np.int64)
+        self.length = MessageSimilarity.PAIRWISE_SCALE if num_message > 0 else None
+
+        fingerprint = None
+        if self.cache:
+            key = "{} pairwise {} {}".format(self.tag, self.band, self.min_score)
+            fingerprint = MessageSimilarity.compute_fingerprint(data_matrix, lengths, key)
+            if self.load_cache(fingerprint):
+                return
+
+        print("[++++] Compute matrix of pairwise similarity scores")
+        if num_message == 0:
+            self.match_counts = np.zeros((0, 0), dtype=np.uint16)
+            return
+        if self.cache:
+            filename = MessageSimilarity.FILENAME_MATRIX_CACHE.format(self.tag, fingerprint) + ".tmp"
+        else:
+            filename = MessageSimilarity.FILENAME_MATRIX.format(self.tag)
+        self.match_counts = self.allocate((num_message, num_message), np.uint16, filename)
+        match_counts = MessageSimilarity.reopen(self.match_counts, 'r+')
+        np.fill_diagonal(match_counts, MessageSimilarity.PAIRWISE_SCALE)
+
+        # each batch holds 3 anti-diagonals (int32) and the 2 messages of each pair
+        batch_size = self.get_chunk_size((data_matrix.shape[1] + 1) * 14 * self.threads)
+        batch_size = min(batch_size, MessageSimilarity.PAIRWISE_BATCH)
+        batches = MessageSimilarity.generate_pair_batches(num_message, batch_size)
+        with multiprocessing.Pool(self.threads, initializer=MessageSimilarity.init_worker,
+                initargs=(data_matrix, lengths, self.band, self.min_score)) as pool:
+            for rows, cols, codes in pool.imap_unordered(MessageSimilarity.align_pairs_in_worker, batches):
+                match_counts[rows, cols] = codes
+                match_counts[cols, rows] = codes
+        if isinstance(match_counts, np.memmap):
+            match_counts.flush()
+        del match_counts
+        if self.cache:
+            self.save_cache(fingerprint)
+
+    # the pairs (i, j) with i < j, by batches of batch_size pairs
+    @staticmethod
+    def generate_pair_batches(num_message, batch_size):
+        rows, cols, num_pair = list(), list(), 0
+        for i in range(num_message - 1):
+            cols_i = np.arange(i + 1, num_message, dtype=np.int64)
+            while len(cols_i) > 0:
+                num_take = min(batch_size - num_pair, len(cols_i))
+                rows.append(np.full(num_take, i, dtype=np.int64))
+                cols.append(cols_i[:num_take])
+                cols_i, num_pair = cols_i[num_take:], num_pair + num_take
+                if num_pair == batch_size:
+                    yield np.concatenate(rows), np.concatenate(cols)
+                    rows, cols, num_pair = list(), list(), 0
+        if num_pair > 0:
+            yield np.concatenate(rows), np.concatenate(cols)
+
+    # the scores (0..PAIRWISE_SCALE) of the pairs (rows[p], cols[p]): the number of matching bytes of the best global
+    # alignment within the band |i-j| <= band+|len_row-len_col| (no gap penalty), over the length of the longer message
+    # the cells of an anti-diagonal only depend on the two previous ones, so each step computes a diagonal of all pairs
+    # every PAIRWISE_CHECK steps, the pairs that can't reach min_score any more are abandoned (scored 0)
+    @staticmethod
+    def align_pairs(data_matrix, lengths, rows, cols, band, min_score):
+        num_pair = len(rows)
+        len_x, len_y = lengths[rows], lengths[cols]
+        length_max = max(1, int(max(len_x.max(), len_y.max())))
+        widths = band + np.abs(len_x - len_y) # the band of each pair
+        width = int(widths.max())
+        x = data_matrix[rows, :length_max]
+        y_reversed = data_matrix[cols, :length_max][:, ::-1] # y[k] is y_reversed[length_max-1-k]
+        ends = len_x + len_y
+        scores_max = np.maximum(np.maximum(len_x, len_y), 1)
+        index = np.arange(num_pair) # the pairs of the rows of the diagonals
+        matches = np.zeros(num_pair, dtype=np.int64)
+        abandoned = np.zeros(num_pair, dtype=bool)
+
+        # diagonals[d % 3][:, i] is the cell (i, d-i); the cells out of the band are NEG
+        neg = np.iinfo(np.int32).min // 2
+        diagonals = [np.full((num_pair, length_max + 1), neg, dtype=np.int32) for k in range(3)]
+        diagonals[0][:, 0] = 0
+        d, end_max = 0, int(ends.max())
+        while len(index) > 0:
+            d += 1
+            prev2, prev1, cur = diagonals[(d - 2) % 3], diagonals[(d - 1) % 3], diagonals[d % 3]
+            lo = max(0, d - length_max, -((width - d) // 2))
+            hi = min(d, length_max, (d + width) // 2)
+            il, ir = max(lo, 1), min(hi, d - 1)
+            if il <= ir:
+                # x[i-1] against y[d-i-1], for i in [il, ir]
+                equal = x[:, il-1:ir] == y_reversed[:, length_max-d+il:length_max-d+ir+1]
+                cur[:, il:ir+1] = np.maximum(np.maximum(prev2[:, il-1:ir] + equal, prev1[:, il-1:ir]), prev1[:, il:ir+1])
+            if lo == 0:
+                cur[:, 0] = 0
+            if hi == d:
+                cur[:, d] = 0
+            if width > band:
+                cur[:, lo:hi+1][np.abs(2 * np.arange(lo, hi + 1) - d) > widths[:, None]] = neg
+            # the band moves by at most one cell per diagonal, so only its borders are read again
+            if lo > 0:
+                cur[:, lo-1] = neg
+            if hi < length_max:
+                cur[:, hi+1] = neg
+
+            finished = ends == d
+            if np.any(finished):
+                matches[index[finished]] = cur[finished, len_x[finished]]
+            if d % MessageSimilarity.PAIRWISE_CHECK != 0 and d < end_max:
+                continue
+            active = ends > d
+            if min_score > 0:
+                # the best final score of the paths through the two last diagonals
+                bound = np.full(len(index), neg, dtype=np.int64)
+                for dd, diagonal in [(d, cur), (d - 1, prev1)]:
+                    ii = np.arange(max(0, dd - length_max, -((width - dd) // 2)), min(dd, length_max, (dd + width) // 2) + 1)
+                    remaining = np.minimum(len_x[:, None] - ii, len_y[:, None] - (dd - ii))
+                    bound = np.maximum(bound, (diagonal[:, ii] + remaining).max(axis=1))
+                lost = active & (bound < min_score * scores_max)
+                abandoned[index[lost]] = True
+                active &= ~lost
+            if not np.all(active):
+                index, x, y_reversed = index[active], x[active], y_reversed[active]
+                len_x, len_y, ends, scores_max, widths = len_x[active], len_y[active], ends[active], scores_max[active], widths[active]
+                diagonals = [diagonal[active] for diagonal in diagonals]
+                end_max = int(ends.max()) if len(ends) > 0 else 0
+
+        scale = MessageSimilarity.PAIRWISE_SCALE
+        codes = np.rint(matches * scale / np.maximum(np.maximum(lengths[rows], lengths[cols]), 1)).astype(np.uint16)
+        codes[(lengths[rows] == 0) & (lengths[cols] == 0)] = scale
+        codes[abandoned] = 0
+        return codes
+
+    @staticmethod
+    def init_worker(data_matrix, lengths, band, min_score):
+        global _pairwise
+        _pairwise = (data_matrix, lengths, band, min_score)
+
+    @staticmethod
+    def align_pairs_in_worker(batch):
+        data_matrix, lengths, band, min_score = _pairwise
+        rows, cols = batch
+        return rows, cols, MessageSimilarity.align_pairs(data_matrix, lengths, rows, cols, band, min_score)
+
+    # an array in memory, or a memory-mapped .npy file in output_dir (a temporary one if filename is None)
+    def allocate(self, shape, dtype, filename=None):
+        if self.storage != MessageSimilarity.STORAGE_DISK:
+            return np.zeros(shape, dtype=dtype)
+        if filename is None:
+            fd, filepath = tempfile.mkstemp(suffix='.npy', dir=self.output_dir)
+            os.close(fd)
+            # removed with the array (e.g., the row histograms replaced by update_row_histograms)
+            array = np.lib.format.open_memmap(filepath, mode='w+', dtype=dtype, shape=shape)
+            weakref.finalize(array, os.remove, filepath)
+            return array
+        filepath = os.path.join(self.output_dir, filename)
+        return np.lib.format.open_memmap(filepath, mode='w+', dtype=dtype, shape=shape)
+
+    # the hash of the aligned messages of this direction
+    @staticmethod
+    def compute_fingerprint(data_matrix, lengths, tag):
+        h = hashlib.sha256()
+        h.update("{} {}".format(tag, data_matrix.shape).encode())
+        h.update(lengths.astype(np.int64).tobytes())
+        h.update(np.ascontiguousarray(data_matrix).tobytes())
+        return h.hexdigest()[:16]
+
+    # output: whether the matrix of the fingerprint is in the cache
+    def load_cache(self, fingerprint):
+        filepath = os.path.join(self.output_dir, MessageSimilarity.FILENAME_MATRIX_CACHE.format(self.tag, fingerprint))
+        if not os.path.isfile(filepath):
+            return False
+        try:
+            match_counts = np.load(filepath, mmap_mode='r')
+        except ValueError:
+            logging.warning("The cached similarity matrix {} is broken".format(filepath))
+            return False
+        if match_counts.shape != (len(self.messages), len(self.messages)):
+            logging.warning("The cached similarity matrix {} doesn't match the messages".format(filepath))
+            return False
+
+        logging.info("Load the similarity matrix from {}".format(filepath))
+        self.match_counts = match_counts
+        return True
+
+    # output: the number of messages of a cached matrix of the first messages (0 if there is none)
+    def load_cache_prefix(self, data_matrix):
+        for filepath in glob.glob(os.path.join(self.output_dir, MessageSimilarity.FILENAME_MATRIX_CACHE.format(self.tag, '*'))):
+            try:
+                match_counts = np.load(filepath, mmap_mode='r')
+            except ValueError:
+                continue
+            num_prefix = match_counts.shape[0]
+            if num_prefix == 0 or num_prefix >= len(self.messages) or match_counts.shape != (num_prefix, num_prefix):
+                continue
+            lengths = self.lengths[:num_prefix]
+            fingerprint = MessageSimilarity.compute_fingerprint(data_matrix[:num_prefix, :lengths.max()], lengths, self.tag)
+            if filepath == os.path.join(self.output_dir, MessageSimilarity.FILENAME_MATRIX_CACHE.format(self.tag, fingerprint)):
+                logging.info("Load the similarity matrix of the first {} messages from {}".format(num_prefix, filepath))
+                self.match_counts = match_counts
+                return num_prefix
+        return 0
+
+    # save the matrix, and remove the ones of other fingerprints (of a previous alignment or direction list)
+    def save_cache(self, fingerprint):
+        filepath = os.path.join(self.output_dir, MessageSimilarity.FILENAME_MATRIX_CACHE.format(self.tag, fingerprint))
+        filepath_tmp = filepath + ".tmp"
+        if isinstance(self.match_counts, np.memmap):
+            self.match_counts.flush()
+        else:
+            with open(filepath_tmp, 'wb') as f:
+                np.save(f, self.match_counts)
+        os.replace(filepath_tmp, filepath)
+        if isinstance(self.match_counts, np.memmap):
+            self.match_counts = np.load(filepath, mmap_mode='r')
+
+        for filepath_old in glob.glob(os.path.join(self.output_dir, MessageSimilarity.FILENAME_MATRIX_CACHE.format(self.tag, '*'))):
+            if filepath_old != filepath:
+                os.remove(filepath_old)
+
+    # a new mapping of an array of the disk storage (the array itself if it is in memory)
+    # the pages of a mapping stay resident until it is dropped, so the long-lived one is only used for its shape and dtype
+    @staticmethod
+    def reopen(array, mode='r'):
+        if isinstance(array, np.memmap):
+            return np.load(array.filename, mmap_mode=mode)
+        return array
+
+    # the number of rows of a chunk within memory_budget
+    def get_chunk_size(self, bytes_per_row):
+        return max(1, self.memory_budget // max(1, bytes_per_row))
+
+    # approx: the sampled characters; profile: the characters encoded as 0..num_codes-1
+    def compute_signatures(self, data_matrix):
+        print("[++++] Compute signatures of messages")
+        if self.mode == MessageSimilarity.MODE_PROFILE:
+            chars, codes = np.unique(data_matrix, return_inverse=True)
+            self.signatures = codes.reshape(data_matrix.shape).astype(np.uint8)
+            self.num_codes = len(chars)
+            return
+        if self.signature_size is not None and self.signature_size < self.length:
+            positions = np.sort(self.rng.choice(self.length, self.signature_size, replace=False))
+            data_matrix = data_matrix[:, positions]
+            self.length = self.signature_size
+        self.signatures = np.ascontiguousarray(data_matrix)
+        logging.debug("Signatures of {} characters, {} sampled pairs per distribution".format(self.length, self.get_num_samples()))
+
+    # the number of samples of a distribution, such that the error of its CDF is at most epsilon
+    # (the two distributions of a cluster share the failure probability delta)
+    def get_num_samples(self):
+        return int(math.ceil(math.log(4 / self.delta) / (2 * self.epsilon ** 2)))
+
+    # output: uint8 matrix of the characters (padded with 0), lengths of messages
+    @staticmethod
+    def encode_messages(messages):
+        data_list = [m.data.encode('latin-1') if isinstance(m.data, str) else bytes(m.data) for m in messages]
+        return MessageSimilarity.encode_data_list(data_list)
+
+    # the bytes of the messages, without the gaps and separators of the alignment (the aligned data is in hex)
+    @staticmethod
+    def encode_messages_raw(messages):
+        data_list = [bytes.fromhex(m.data.replace('-', '').replace('~', '')) if isinstance(m.data, str) else bytes(m.data) for m in messages]
+        return MessageSimilarity.encode_data_list(data_list)
+
+    @staticmethod
+    def encode_data_list(data_list):
+        lengths = np.array([len(data) for data in data_list], dtype=np.int64)
+        data_matrix = np.zeros((len(data_list), lengths.max() if len(data_list) > 0 else 0), dtype=np.uint8)
+        for i, data in enumerate(data_list):
+            data_matrix[i, :len(data)] = np.frombuffer(data, dtype=np.uint8)
+        return data_matrix, lengths
+
+    @staticmethod
+    def get_common_length(lengths):
+        if len(lengths) == 0 or np.any(lengths != lengths[0]):
+            return None
+        return int(lengths[0])
+
+    # the scores of rows x cols (index arrays), with the same semantics as compute_similarity_scores_by_alignment
+    def get_scores(self, rows, cols):
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        if self.mode in MessageSimilarity.MODES_SIGNATURE:
+            scores = (self.signatures[rows][:, None, :] == self.signatures[cols][None, :, :]).sum(axis=2) / self.length
+        else:
+            scores = MessageSimilarity.reopen(self.match_counts)[np.ix_(rows, cols)] / self.lengths[rows][:, None]
+        scores[self.lengths[rows][:, None] != self.lengths[cols][None, :]] = MessageSimilarity.SCORE_LENGTH_MISMATCH
+        scores[rows[:, None] == cols[None, :]] = MessageSimilarity.SCORE_SAME
+        return scores
+
+    # the similarity of a subset of messages (reuse the computed scores)
+    def select(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        result = MessageSimilarity(messages=[self.messages[i] for i in indices], threads=self.threads, mode=self.mode,
+            epsilon=self.epsilon, delta=self.delta, signature_size=self.signature_size, seed=self.seed, pair_budget=self.pair_budget,
+            band=self.band, min_score=self.min_score, storage=self.storage, output_dir=self.output_dir, tag=self.tag, memory_budget=self.memory_budget,
+            aligned_matrix=self.aligned_matrix.select(indices) if self.aligned_matrix is not None else None)
+        result.lengths = self.lengths[indices]
+        if self.mode in MessageSimilarity.MODES_SIGNATURE:
+            result.signatures = self.signatures[indices]
+            result.num_codes = self.num_codes
+            result.length = self.length
+        else:
+            result.data_matrix = self.data_matrix[indices] if self.data_matrix is not None else None
+            result.match_counts = result.allocate((len(indices), len(indices)), self.match_counts.dtype)
+            chunk_size = self.get_chunk_size(len(indices) * self.match_counts.itemsize * 2)
+            for il in range(0, len(indices), chunk_size):
+                match_counts, match_counts_result = MessageSimilarity.reopen(self.match_counts), MessageSimilarity.reopen(result.match_counts, 'r+')
+                match_counts_result[il:il+chunk_size] = match_counts[np.ix_(indices[il:il+chunk_size], indices)]
+                del match_counts, match_counts_result
+            result.length = MessageSimilarity.get_common_length(result.lengths)
+        return result
+
+    # the histogram of the match counts of each row (including the diagonal)
+    def compute_row_histograms(self):
+        num_message = len(self.messages)
+        self.row_histograms = self.allocate((num_message, self.length + 1), np.int64)
+        self.add_row_histograms(0, num_message, 0, num_message)
+
+    # the new rows of the histograms count all columns, the old rows only count the new columns
+    def update_row_histograms(self, num_old, length_old):
+        if self.row_histograms is None or self.length is None or self.length != length_old:
+            self.row_histograms = None
+            return
+        num_message = len(self.messages)
+        row_histograms = self.allocate((num_message, self.length + 1), np.int64)
+        chunk_size = self.get_chunk_size(row_histograms.shape[1] * row_histograms.itemsize)
+        for il in range(0, num_old, chunk_size):
+            ir = min(il + chunk_size, num_old)
+            MessageSimilarity.reopen(row_histograms, 'r+')[il:ir] = MessageSimilarity.reopen(self.row_histograms)[il:ir]
+        self.row_histograms = row_histograms
+        self.add_row_histograms(0, num_old, num_old, num_message)
+        self.add_row_histograms(num_old, num_message, 0, num_message)
+
+    # add the match counts of rows [row_start, row_end) x columns [col_start, col_end) to the row histograms
+    def add_row_histograms(self, row_start, row_end, col_start, col_end):
+        num_bins = self.row_histograms.shape[1]
+        # the mapped rows, their copy in int64 and the bins to count
+        chunk_size = self.get_chunk_size(len(self.messages) * self.match_counts.itemsize + (col_end - col_start) * 16)
+        for il in range(row_start, row_end, chunk_size):
+            ir = min(il + chunk_size, row_end)
+            codes = MessageSimilarity.reopen(self.match_counts)[il:ir, col_start:col_end].astype(np.int64)
+            codes += (np.arange(ir - il) * num_bins)[:, None]
+            MessageSimilarity.reopen(self.row_histograms, 'r+')[il:ir] += np.bincount(codes.ravel(), minlength=(ir - il) * num_bins).reshape(ir - il, num_bins)
 
-        # use the MSA result is quick, but less accurate
-        for i in range(len(self.messages)):
-            for j in range(i, len(self.messages)):
-                if j == i:
-                    score = 100.0
-                    scoreslist[i][j] = score
-                else:
-                    score = self.compute_similarity_scores_by_alignment(self.messages[i].data, self.messages[j].data)
-                    scoreslist[i][j] = score
-                    scoreslist[j][i] = score 
-        
-        self.similarity_matrix = scoreslist
-        
     def compute_similarity_scores_by_alignment(self, msgdata1, msgdata2):
         if len(msgdata1) != len(msgdata2):
             logging.error("The two compared messages don't have same length.")
@@ -52,12 +628,23 @@ class MessageSimilarity:
         return score
 
     # compute p_m
-    def compute_constraint_message_similarity(self, symbols):
+    # clusters: the indices of the messages of each cluster (see Constraint.get_clusters)
+    def compute_constraint_message_similarity(self, clusters):
         logging.debug("[+] Compute observation probabilities of message similarity")
-        sn_list = [str(s.name) for s in symbols.values()]
+        sn_list = list(range(len(clusters)))
 
-        inner_inter_scores = self.compute_inner_inter_scores(symbols)
-        symbol_m = self.compute_similarity_constraints(inner_inter_scores)
+        if self.mode in [MessageSimilarity.MODE_APPROXIMATE, MessageSimilarity.MODE_STRATIFIED]:
+            inner_inter_histograms = self.sample_inner_inter_histograms(clusters)
+            symbol_m = self.compute_similarity_constraints_by_histogram(inner_inter_histograms)
+        elif self.mode == MessageSimilarity.MODE_PROFILE:
+            inner_inter_scores = self.compute_inner_inter_scores_by_profile(clusters)
+            symbol_m = self.compute_similarity_constraints_by_values(inner_inter_scores)
+        elif self.length is not None:
+            inner_inter_histograms = self.compute_inner_inter_histograms(clusters)
+            symbol_m = self.compute_similarity_constraints_by_histogram(inner_inter_histograms)
+        else: # the messages don't have same length
+            inner_inter_scores = self.compute_inner_inter_scores(clusters)
+            symbol_m = self.compute_similarity_constraints(inner_inter_scores)
 
         p_m = list()
         for s in sn_list:
@@ -72,50 +659,202 @@ class MessageSimilarity:
         return p_m
 
     # compute Inner/Inter scores
-    # inner_inter_scores: {symbol_name: [num of msgs, inner scores, inter scores]}
-    def compute_inner_inter_scores(self, symbols):
+    # inner_inter_scores: {cluster: [num of msgs, inner scores, inter scores]}
+    def compute_inner_inter_scores(self, clusters):
         logging.debug("[+] Compute Inner/Inter Scores")
 
-        dict_mid_i = dict()
-        for i,message in enumerate(self.messages):
-            dict_mid_i[message.id] = i
-
         inner_inter_scores = dict()
 
-        for s in symbols.values():
-            sn = str(s.name)
-
+        for sn, mi_array in enumerate(clusters):
             #0: message num
             #1: inner scores list
             #2: inter scores list
             inner_inter_scores[sn] = list()
             # TODO: message num is not used
             
-            mi_list = [dict_mid_i[message.id] for message in s.messages]
+            mi_list = mi_array.tolist()
             inner_inter_scores[sn].append(mi_list) #0: message num
             
-            inner_score_list, inter_score_list = list(), list()
-            for i in range(len(mi_list)):
-                for j in range(i + 1, len(mi_list)):
-                    inner_score_list.append(self.similarity_matrix[mi_list[i]][mi_list[j]])
-            for i in mi_list:
-                for j in range(len(self.messages)):
-                    if j not in mi_list:
-                        inter_score_list.append(self.similarity_matrix[i][j])
+            scores_inner = self.get_scores(mi_array, mi_array)
+            inner_score_list = scores_inner[np.triu_indices(len(mi_list), 1)].tolist()
+            in_symbol = np.zeros(len(self.messages), dtype=bool)
+            in_symbol[mi_array] = True
+            inter_score_list = self.get_scores(mi_array, np.flatnonzero(~in_symbol)).ravel().tolist()
             
             inner_inter_scores[sn].append(sorted(inner_score_list, reverse=True))
             inner_inter_scores[sn].append(sorted(inter_score_list, reverse=True))
             
         return inner_inter_scores
 
+    # compute Inner/Inter histograms of the match counts
+    # inner_inter_histograms: {cluster: [message indices, inner histogram, inter histogram]}
+    def compute_inner_inter_histograms(self, clusters):
+        logging.debug("[+] Compute Inner/Inter Histograms")
+        if self.row_histograms is None:
+            self.compute_row_histograms()
+
+        num_message, num_bins = len(self.messages), self.length + 1
+        inner_inter_histograms = dict()
+        for c, mi_array in enumerate(clusters):
+            # all ordered pairs in the cluster, including the diagonal (match count = length)
+            # streamed by chunks of rows, which are within memory_budget
+            histogram_inner_all = np.zeros(num_bins, dtype=np.int64)
+            histogram_rows = np.zeros(num_bins, dtype=np.int64)
+            # the mapped rows, their copy, and the columns of the cluster in int64
+            chunk_size = self.get_chunk_size(num_message * self.match_counts.itemsize * 2 + len(mi_array) * (self.match_counts.itemsize + 8) + num_bins * 8)
+            for il in range(0, len(mi_array), chunk_size):
+                rows = mi_array[il:il+chunk_size]
+                histogram_inner_all += np.bincount(MessageSimilarity.reopen(self.match_counts)[rows][:, mi_array].ravel(), minlength=num_bins)
+                histogram_rows += MessageSimilarity.reopen(self.row_histograms)[rows].sum(axis=0)
+            histogram_inter = histogram_rows - histogram_inner_all
+            histogram_inner = histogram_inner_all.copy()
+            histogram_inner[self.length] -= len(mi_array)
+            histogram_inner //= 2
+
+            inner_inter_histograms[c] = [mi_array, histogram_inner, histogram_inter]
+
+        return inner_inter_histograms
+
+    # estimate Inner/Inter histograms from sampled pairs of messages (all pairs if there are no more than num_samples)
+    # inner_inter_histograms: {cluster: [message indices, inner histogram, inter histogram]}
+    def sample_inner_inter_histograms(self, clusters):
+        logging.debug("[+] Sample Inner/Inter Histograms")
+
+        num_message = len(self.messages)
+        num_samples = self.pair_budget if self.mode == MessageSimilarity.MODE_STRATIFIED else self.get_num_samples()
+        # the pairs of each call are drawn from the seed, so they don't depend on the previous calls (e.g., other fids)
+        rng = np.random.RandomState(self.seed)
+        mi_arrays = clusters
+        labels = np.full(num_message, -1, dtype=np.int64)
+        for c, mi_array in enumerate(mi_arrays):
+            labels[mi_array] = c
+
+        inner_inter_histograms = dict()
+        for c, mi_array in enumerate(mi_arrays):
+            num_inner, num_other = len(mi_array), num_message - len(mi_array)
+            histogram_inner = np.zeros(self.length + 1, dtype=np.int64)
+            histogram_inter = np.zeros(self.length + 1, dtype=np.int64)
+            # the eer is 1 without inner or inter scores
+            if num_inner > 1 and num_other > 0:
+                # inner pairs
+                if num_inner * (num_inner - 1) // 2 <= num_samples:
+                    il, ir = np.triu_indices(num_inner, 1)
+                else:
+                    il = rng.randint(num_inner, size=num_samples)
+                    ir = rng.randint(num_inner - 1, size=num_samples)
+                    ir += (ir >= il)
+                histogram_inner = self.compute_pair_histogram(mi_array[il], mi_array[ir])
+
+                # inter pairs
+                if num_inner * num_other <= num_samples:
+                    others = np.flatnonzero(labels != c)
+                    histogram_inter = self.compute_pair_histogram(np.repeat(mi_array, num_other), np.tile(others, num_inner))
+                elif self.mode == MessageSimilarity.MODE_STRATIFIED:
+                    il = mi_array[rng.randint(num_inner, size=num_samples)]
+                    histogram_inter = self.compute_pair_histogram(il, self.sample_others_stratified(mi_arrays, c, num_samples, rng))
+                else:
+                    il = mi_array[rng.randint(num_inner, size=num_samples)]
+                    histogram_inter = self.compute_pair_histogram(il, self.sample_others(labels, c, num_other, num_samples, rng))
+
+            inner_inter_histograms[c] = [mi_array, histogram_inner, histogram_inter]
+
+        return inner_inter_histograms
+
+    # compute Inner/Inter scores against the profiles of clusters
+    # inner_inter_scores: {cluster: [message indices, inner scores, inter scores]} (arrays)
+    def compute_inner_inter_scores_by_profile(self, clusters):
+        logging.debug("[+] Compute Inner/Inter Scores by Profiles")
+
+        num_message = len(self.messages)
+        sn_list = list(range(len(clusters)))
+        mi_arrays = clusters
+        labels = np.full(num_message, -1, dtype=np.int64)
+        for c, mi_array in enumerate(mi_arrays):
+            labels[mi_array] = c
+
+        # the eer is 1 without inner or inter scores, so these clusters are not profiled
+        profiled = [c for c, mi_array in enumerate(mi_arrays) if 1 < len(mi_array) < num_message]
+        profiles = self.compute_profiles(labels, len(mi_arrays), profiled)
+        # match_sums[p][i]: the number of matching characters of message i with all messages of cluster profiled[p]
+        match_sums = np.zeros((len(profiled), num_message), dtype=np.int64)
+        for col in range(self.length):
+            match_sums += profiles[:, col, self.signatures[:, col]]
+
+        inner_inter_scores = dict()
+        for c, sn in enumerate(sn_list):
+            inner_inter_scores[sn] = [mi_arrays[c], np.zeros(0), np.zeros(0)]
+        for p, c in enumerate(profiled):
+            mi_array = mi_arrays[c]
+            num_inner = len(mi_array)
+            in_symbol = labels == c
+            inner_scores = (match_sums[p][mi_array] - self.length) / (self.length * (num_inner - 1))
+            inter_scores = match_sums[p][~in_symbol] / (self.length * num_inner)
+            inner_inter_scores[sn_list[c]] = [mi_array, inner_scores, inter_scores]
+
+        return inner_inter_scores
+
+    # profiles[p][col][code]: the number of messages of cluster clusters[p] with code in column col
+    def compute_profiles(self, labels, num_clusters, clusters):
+        profile_ids = np.full(num_clusters + 1, -1, dtype=np.int64)
+        profile_ids[clusters] = np.arange(len(clusters))
+        pids = profile_ids[labels] # the label -1 maps to the last item
+        rows = np.flatnonzero(pids >= 0)
+
+        profile_size = self.length * self.num_codes
+        keys = pids[rows][:, None] * profile_size + np.arange(self.length) * self.num_codes + self.signatures[rows]
+        profiles = np.bincount(keys.ravel(), minlength=len(clusters) * profile_size)
+        return profiles.reshape(len(clusters), self.length, self.num_codes)
+
+    # num random messages not in cluster c
+    def sample_others(self, labels, c, num_other, num, rng):
+        num_message = len(labels)
+        if num_other * 4 < num_message:
+            others = np.flatnonzero(labels != c)
+            return others[rng.randint(num_other, size=num)]
+
+        # rejection sampling, without listing the other messages
+        others = np.zeros(0, dtype=np.int64)
+        while len(others) < num:
+            candidates = rng.randint(num_message, size=int((num - len(others)) * num_message / num_other * 1.2) + 16)
+            others = np.concatenate([others, candidates[labels[candidates] != c]])
+        return others[:num]
+
+    # num random messages of the clusters other than c, stratified by cluster: each cluster gets a share of the samples
+    # in proportion to its size (largest remainders), so the inter scores against small clusters are not left to chance
+    def sample_others_stratified(self, mi_arrays, c, num, rng):
+        sizes = np.array([len(mi_array) for mi_array in mi_arrays], dtype=np.int64)
+        sizes[c] = 0
+        quotas = num * sizes / sizes.sum()
+        counts = np.floor(quotas).astype(np.int64)
+        counts[np.argsort(counts - quotas, kind='stable')[:num - counts.sum()]] += 1
+        others = [mi_arrays[d][rng.randint(sizes[d], size=counts[d])] for d in np.flatnonzero(counts)]
+        return np.concatenate(others)
+
+    # the histogram of the match counts of pairs (rows[i], cols[i]) of signatures
+    def compute_pair_histogram(self, rows, cols):
+        counts = (self.signatures[rows] == self.signatures[cols]).sum(axis=1)
+        return np.bincount(counts, minlength=self.length + 1)
+
     # compute similarity constraints of each cluster
-    # symbol_m: {symbol_name: list of p_m}
+    # symbol_m: {cluster: list of p_m}
     def compute_similarity_constraints(self, inner_inter_scores):
         symbol_m = {}
         for key,values in inner_inter_scores.items():
             symbol_m[key] = 1 - self.compute_eer(values[1], values[2])
         return symbol_m
 
+    def compute_similarity_constraints_by_histogram(self, inner_inter_histograms):
+        symbol_m = {}
+        for key,values in inner_inter_histograms.items():
+            symbol_m[key] = 1 - self.compute_eer_by_histogram(values[1], values[2])
+        return symbol_m
+
+    def compute_similarity_constraints_by_values(self, inner_inter_scores):
+        symbol_m = {}
+        for key,values in inner_inter_scores.items():
+            symbol_m[key] = 1 - self.compute_eer_by_values(values[1], values[2])
+        return symbol_m
+
     # compute eer
     def compute_eer(self, inner_scores, inter_scores):
         #tfnmr = stat_scores(inner_score_list)
@@ -125,7 +864,28 @@ class MessageSimilarity:
 
         t_fnmr_list = self.compute_fnmrs(inner_scores)
         t_fmr_list = self.compute_fmrs(inter_scores)
+        return self.compute_eer_by_lists(t_fnmr_list, t_fmr_list)
+
+    # the same as compute_eer, with the histograms of match counts
+    def compute_eer_by_histogram(self, histogram_inner, histogram_inter):
+        if histogram_inner.sum() == 0 or histogram_inter.sum() == 0:
+            return 1 # 0.05
+
+        t_fnmr_list = self.compute_fnmrs_by_cdf(*self.get_distinct_scores(histogram_inner))
+        t_fmr_list = self.compute_fmrs_by_cdf(*self.get_distinct_scores(histogram_inter))
+        return self.compute_eer_by_lists(t_fnmr_list, t_fmr_list)
+
+    # the same as compute_eer, with arrays of scores
+    def compute_eer_by_values(self, inner_scores, inter_scores):
+        if len(inner_scores) == 0 or len(inter_scores) == 0:
+            return 1 # 0.05
 
+        t_fnmr_list = self.compute_fnmrs_by_cdf(*self.get_distinct_scores_by_values(inner_scores))
+        t_fmr_list = self.compute_fmrs_by_cdf(*self.get_distinct_scores_by_values(inter_scores))
+        return self.compute_eer_by_lists(t_fnmr_list, t_fmr_list)
+
+    # find the eer with the lists of [t, fnmr] and [t, fmr]
+    def compute_eer_by_lists(self, t_fnmr_list, t_fmr_list):
         tfnmrlist = [x[0] for x in t_fnmr_list]
         fnmrlist = [x[1] for x in t_fnmr_list]
         tfmrlist = [x[0] for x in t_fmr_list]
@@ -241,3 +1001,24 @@ class MessageSimilarity:
         t_fmr_list.append(result)
 
         return t_fmr_list
+
+    # the same as compute_fnmrs, with the distinct scores and the number of scores <= each one
+    def compute_fnmrs_by_cdf(self, t_list, cdf_list, num):
+        return [[0, 0]] + [[t, fnmr] for t, fnmr in zip(t_list, (cdf_list / num).tolist())] + [[1, 1]]
+
+    # the same as compute_fmrs, with the distinct scores and the number of scores <= each one
+    def compute_fmrs_by_cdf(self, t_list, cdf_list, num):
+        return [[0, 1]] + [[t, fmr] for t, fmr in zip(t_list, ((num - cdf_list) / num).tolist())] + [[1, 0]]
+
+    # output: the distinct scores, the number of scores <= each one, the number of scores
+    # the distinct scores are the match counts in the histogram (divided by length)
+    def get_distinct_scores(self, histogram):
+        counts = np.flatnonzero(histogram)
+        cdf = np.cumsum(histogram)
+        return (counts / self.length).tolist(), cdf[counts], int(cdf[-1])
+
+    def get_distinct_scores_by_values(self, scores):
+        values, counts = np.unique(scores, return_counts=True)
+        return values.tolist(), np.cumsum(counts), len(scores)
+
+_pairwise = None # the messages of the pairwise alignments in the workers
@@ -14,169 +14,91 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>
 
-import copy
 import logging
 
-from netzob.Model.Vocabulary.Session import Session
+import numpy as np
 
+"""
+The remote coupling of the clusters of requests and responses
+The labels are the cluster of each message (of the messages of the session index) by each clustering of the requests
+and responses; the pairs of requests and responses are looked up in the session index, which is shared by all clusterings
+The contingency tables of all pairs of clusterings are counted at once, by the unique codes of (request cluster, response cluster)
+"""
 class RemoteCoupling:
     TEST_TYPE_REQUEST = 0
     TEST_TYPE_RESPONSE = 1
+    MAX_CODES = 1 << 22 # the codes counted at once (pairs of clusterings x pairs of messages)
 
-    def __init__(self, messages_all, symbols_request, symbols_response, direction_list):
-        self.messages_all = messages_all
-        self.symbols_request = symbols_request
-        self.symbols_response = symbols_response
-        self.direction_list = direction_list
+    # labels_request/labels_response: the cluster of each message by each request/response clustering (one row per clustering)
+    # pairs: the (request clustering, response clustering) pairs to couple
+    def __init__(self, session_index, labels_request, labels_response, pairs):
+        self.session_index = session_index
+        self.labels_request = labels_request
+        self.labels_response = labels_response
+        self.pairs = pairs
 
-        self.pairs_request = dict()
-        self.pairs_response = dict()
+        # for each pair, the proportion of the larger paired cluster of each request/response cluster
+        self.pairs_request = list()
+        self.pairs_response = list()
 
-    # Use directionlist to check if it is valid session
+    # Use the request/response pairs of the sessions
     def compute_pairs_by_directionlist(self):
         logging.debug("[+] Compute request/respnse pairs info")
 
-        symbolList_request = list(self.symbols_request.values())
-        symbolList_response = list(self.symbols_response.values())
-        symbolNameList_request = [str(s.name) for s in self.symbols_request.values()]
-        symbolNameList_response = [str(s.name) for s in self.symbols_response.values()]
-
-        # generate new messages
-        messages = copy.deepcopy(self.messages_all)
-        sessions = Session(messages)
-        # lenofSession = len(sessions.getTrueSessions())
-        # print("lenth of session: {0}".format(lenofSession))
-
-        dict_mid_sn = dict()
-        for s in self.symbols_request.values():
-            sn = str(s.name)
-            for message in s.messages:
-                dict_mid_sn[message.id] = sn
-        for s in self.symbols_response.values():
-            sn = str(s.name)
-            for message in s.messages:
-                dict_mid_sn[message.id] = sn
-
-        for i in range(len(self.direction_list)):
-            data = [dict_mid_sn[messages[i].id], self.direction_list[i]]
-            messages[i].data = data
-
-        # count pair info
-        dict_request, dict_response = dict(), dict()
-        for sn in symbolNameList_request:
-            dict_request[sn] = dict()
-        for sn in symbolNameList_response:
-            dict_response[sn] = dict()
-
-        # TODO: improve
-        for session in sessions.getTrueSessions():
-            messages_list = list(session.messages.values())
-            messages_list = sorted(messages_list, key=lambda x:x.date)
-
-            #Check if it is invalid (the first is request)
-            '''
-            if messages_list[0].data[1] != 0:
-                continue
-            '''
-            '''
-            # Check if it is invalid (only request)
-            srcIP_list = [message.source for message in messages_list]
-            if len(set(srcIP_list)) == 1:
-                #print("This session is invalid.")
-                continue
-            '''
-
-            # Find the first request msg
-            i_first_request_msg = -1
-            for i,message in enumerate(messages_list):
-                if message.data[1] == 0:
-                    i_first_request_msg = i 
-                    break
-            if i_first_request_msg == -1:
-                continue
-
-            #requestSrcIP = str(messages_list[0].source)
-            preRequestS = None  
-            for message in messages_list[i_first_request_msg:]:
-                sn = message.data[0]
-                if message.data[1] == 0:
-                    preRequestS = sn
-                else:
-                    if sn in dict_request[preRequestS]:
-                        dict_request[preRequestS][sn] += 1
-                    else:
-                        dict_request[preRequestS][sn] = 1
-                    if preRequestS in dict_response[sn]:
-                        dict_response[sn][preRequestS] += 1
-                    else:
-                        dict_response[sn][preRequestS] = 1
-        #print(dict_request)
-        
-        '''
-        print("Request pairs info:")
-        for key, dict_key in dict_request.items():
-            print(repr(key))
-            list_msgcount= sorted(dict_key.items(),key=lambda x:x[1],reverse=True)
-            print(list_msgcount)
-
-        print("Response pairs info:")
-        for key, dict_key in dict_response.items():
-            print(repr(key))
-            list_msgcount= sorted(dict_key.items(),key=lambda x:x[1],reverse=True)
-            print(list_msgcount)
-        '''
-
-        # compute pairs constraints results
-        # method 1: use the lenth
-        # method 2: use the proportion of the larger one
-        for s in symbolNameList_request:
-            # method 1
-            # self.pairs_request[s] = 1 / len(dict_request[s])
-            # method 2
-            list_msgcount= sorted(dict_request[s].items(),key=lambda x:x[1],reverse=True)
-            # print(list_msgcount)
-            count_total = 0
-            for item in list_msgcount:
-                count_total += item[1]
-            if len(list_msgcount) > 0:
-                self.pairs_request[s] = list_msgcount[0][1] / count_total
-            else:
-                self.pairs_request[s] = 0
-        for s in symbolNameList_response:
-            # method 1
-            #self.pairs_response[s] = 1 / len(dict_response[s])
-            # method 2
-            list_msgcount= sorted(dict_response[s].items(),key=lambda x:x[1],reverse=True)
-            count_total = 0
-            for item in list_msgcount:
-                count_total += item[1]
-            if len(list_msgcount) > 0:
-                self.pairs_response[s] = list_msgcount[0][1] / count_total
-            else:
-                self.pairs_response[s] = 0
-        '''
-        print("Number of Request msg types: {0}".format(len(symbolNameList_request)))
-        print(dict_result_request)
-        print("Number of Response msg types: {0}".format(len(symbolNameList_response)))
-        print(self.pairs_response)
-        '''
+        num_request = np.max(self.labels_request, axis=1, initial=-1) + 1
+        num_response = np.max(self.labels_response, axis=1, initial=-1) + 1
+        # the clusters of the paired messages
+        labels_request = self.labels_request[:, self.session_index.request_ids]
+        labels_response = self.labels_response[:, self.session_index.response_ids]
+
+        pairs = np.asarray(self.pairs, dtype=np.int64).reshape(-1, 2)
+        num_chunk = max(1, RemoteCoupling.MAX_CODES // max(1, len(self.session_index.request_ids)))
+        for start in range(0, len(pairs), num_chunk):
+            i_request, i_response = pairs[start:start + num_chunk, 0], pairs[start:start + num_chunk, 1]
+            pairs_request, pairs_response = self.count_pairs(labels_request[i_request], labels_response[i_response], num_request[i_request], num_response[i_response])
+            self.pairs_request.extend(pairs_request)
+            self.pairs_response.extend(pairs_response)
         return 
 
-    # compute p_r
+    # count pair info of a chunk of pairs of clusterings
+    # the clusters of all pairs are numbered together (rows: request clusters, cols: response clusters)
+    @staticmethod
+    def count_pairs(labels_request, labels_response, num_request, num_response):
+        offsets_request = np.cumsum(num_request) - num_request
+        offsets_response = np.cumsum(num_response) - num_response
+        num_rows, num_cols = int(np.sum(num_request)), int(np.sum(num_response))
+        rows = labels_request + offsets_request[:, np.newaxis]
+        cols = labels_response + offsets_response[:, np.newaxis]
+
+        codes, counts = np.unique((rows * num_cols + cols).ravel(), return_counts=True)
+        rows, cols = codes // max(1, num_cols), codes % max(1, num_cols)
+
+        # compute pairs constraints results: the proportion of the larger one
+        pairs_result = list()
+        for clusters, num_clusters, num in [(rows, num_rows, num_request), (cols, num_cols, num_response)]:
+            count_max = np.zeros(num_clusters, dtype=np.int64)
+            np.maximum.at(count_max, clusters, counts)
+            count_total = np.bincount(clusters, weights=counts, minlength=num_clusters)
+            proportions = np.zeros(num_clusters)
+            np.divide(count_max, count_total, out=proportions, where=count_total > 0)
+            pairs_result.append(np.split(proportions, np.cumsum(num)[:-1]))
+        return pairs_result
+
+    # compute p_r (a list for each pair)
     def compute_constraint_remote_coupling(self, direction):
         test_type = "request" if direction == RemoteCoupling.TEST_TYPE_REQUEST else "response"
         logging.debug("[+] Compute observation probabilities of remote coupling: {}".format(test_type))
         
-        symbols = self.symbols_request if direction == RemoteCoupling.TEST_TYPE_REQUEST else self.symbols_response
         pairs = self.pairs_request if direction == RemoteCoupling.TEST_TYPE_REQUEST else self.pairs_response
 
-        sn_list = [str(s.name) for s in symbols.values()]
-        p_r = list()
-        for s in sn_list:
-            if pairs[s] > 0:
-                p_r.append(pairs[s])
-            else:
-                p_r.append(-1)
+        p_r_list = list()
+        for proportions in pairs:
+            p_r = list()
+            for proportion in proportions.tolist():
+                if proportion > 0:
+                    p_r.append(proportion)
+                else:
+                    p_r.append(-1)
+            p_r_list.append(p_r)
 
-        return p_r
-    
\ No newline at end of file
+        return p_r_list
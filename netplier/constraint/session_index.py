@@ -0,0 +1,71 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import logging
+
+import numpy as np
+
+from session_builder import SessionBuilder
+
+"""
+The sessions of a trace, built once and shared by the remote coupling of all candidate fids
+The messages are kept in the order of the sessions (by date in each session); each response is paired with the
+last request before it in its session (the responses before the first request of their session have no pair)
+The index is immutable: select gives the index of a subset of the messages without rebuilding the sessions
+"""
+class SessionIndex:
+    def __init__(self, order, sessions, direction_list):
+        self.order = self.freeze(np.asarray(order, dtype=np.int64)) # the message indices in the order of the sessions
+        self.sessions = self.freeze(np.asarray(sessions, dtype=np.int64)) # the session of each of them
+        self.direction_list = self.freeze(np.asarray(direction_list, dtype=np.int64))
+
+        # the index of each response message and the index of its preceding request
+        response_ids, request_ids = self.compute_adjacency()
+        self.response_ids = self.freeze(response_ids)
+        self.request_ids = self.freeze(request_ids)
+
+    @staticmethod
+    def from_messages(messages, direction_list):
+        logging.debug("[+] Build the session index")
+        sessions = SessionBuilder(messages)
+        return SessionIndex(sessions.order, sessions.get_ordered_session_ids(), direction_list)
+
+    # the index of the messages of indices (in their new positions)
+    def select(self, indices):
+        positions = np.full(len(self.direction_list), -1, dtype=np.int64)
+        positions[indices] = np.arange(len(indices))
+        order = positions[self.order]
+        kept = order >= 0
+        return SessionIndex(order[kept], self.sessions[kept], self.direction_list[indices])
+
+    def compute_adjacency(self):
+        num = len(self.order)
+        slots = np.arange(num)
+        is_request = self.direction_list[self.order] == 0
+
+        # the first slot of the session of each slot
+        starts = np.flatnonzero(np.concatenate(([True], self.sessions[1:] != self.sessions[:-1])))
+        session_start = np.repeat(starts, np.diff(np.append(starts, num)))
+        # the last request slot at or before each slot
+        last_request = np.maximum.accumulate(np.where(is_request, slots, -1)) if num > 0 else slots
+
+        valid = ~is_request & (last_request >= session_start)
+        return self.order[valid], self.order[last_request[valid]]
+
+    @staticmethod
+    def freeze(array):
+        array.flags.writeable = False
+        return array
@@ -14,22 +14,109 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>
 
-from pgmpy.models import FactorGraph
-from pgmpy.factors.discrete import DiscreteFactor
-from pgmpy.inference import BeliefPropagation
+import numpy as np
 
+# p_observation: ObservationProbabilities; p_implication: [p_ktox, p_xtok] in the same layout
 class MyFactorGraph:
+    # exact: closed-form marginal of the star graph around k (numpy)
+    # bp: generic belief propagation (pgmpy)
+    ENGINE_EXACT = 'exact'
+    ENGINE_BP = 'bp'
 
-    def __init__(self, p_observation, p_implication, remote=True):
+    def __init__(self, p_observation, p_implication, remote=True, engine='exact'):
         self.p_observation = p_observation
         self.p_implication = p_implication
         self.remote = remote
+        self.engine = engine
+
+        assert self.engine in [MyFactorGraph.ENGINE_EXACT, MyFactorGraph.ENGINE_BP], "the factor graph engine should be exact or bp"
 
     # Compute Pk
     # type_list: 0: k2x & x2k, 1: k2x, 2: x2k, -1: not test
     def compute_pk(self, type_list, fid):
         assert len(type_list) == 5, print("ComputePk Error: number of type_list should be 5")
 
+        if self.engine == MyFactorGraph.ENGINE_EXACT:
+            return self.compute_pk_exact(type_list, fid)
+        return self.compute_pk_bp(type_list, fid)
+
+    # The graph is a star around k (every x only connects to k), so BP is exact and
+    # P(k) is the normalized product of the messages sent by each x to k.
+    # The messages are multiplied in log-space to avoid underflow with many clusters.
+    def compute_pk_exact(self, type_list, fid):
+        return self.compute_pk_batch(type_list, [fid])[0]
+
+    # Compute Pk of all fids in one pass
+    # observation/implication probabilities are packed into padded arrays (fids x constraints x clusters)
+    def compute_pk_batch(self, type_list, fid_list):
+        assert len(type_list) == 5, print("ComputePk Error: number of type_list should be 5")
+
+        constraint_name = ['m', 'r', 's', 'd', 'v']
+        num_fid, num_constraint = len(fid_list), len(type_list)
+        if num_fid == 0:
+            return np.zeros(0)
+
+        # scatter the flat arrays into the padded arrays
+        p_ktox_all, p_xtok_all = self.p_implication
+        fid_rows = np.array([self.p_observation.fid_index[fid] for fid in fid_list], dtype=np.int64)
+        num_cluster = max([int(np.max(np.diff(offsets)[fid_rows])) for offsets in self.p_observation.offsets] + [1])
+        p_x = np.full((num_fid, num_constraint, num_cluster), 0.5)
+        p_ktox = np.full((num_fid, num_constraint, num_cluster), 0.5)
+        p_xtok = np.full((num_fid, num_constraint, num_cluster), 0.5)
+        mask = np.zeros((num_fid, num_constraint, num_cluster), dtype=bool)
+        i_row = np.full(len(self.p_observation), -1, dtype=np.int64)
+        i_row[fid_rows] = np.arange(num_fid)
+        for i in range(num_constraint):
+            f = i_row[self.p_observation.get_fid_indices(i)]
+            is_selected = f >= 0
+            f, c = f[is_selected], self.p_observation.get_positions(i)[is_selected]
+            p_x[f, i, c] = self.p_observation.values[i][is_selected]
+            p_ktox[f, i, c] = p_ktox_all.values[i][is_selected]
+            p_xtok[f, i, c] = p_xtok_all.values[i][is_selected]
+            mask[f, i, c] = self.p_observation.mask[i][is_selected]
+
+        # constraints that are not tested
+        type_array = np.array(type_list)
+        is_tested = np.isin(type_array, [0, 1, 2])
+        if not self.remote:
+            is_tested[constraint_name.index('r')] = False
+        mask &= is_tested[None, :, None]
+
+        use_ktox = np.isin(type_array, [0, 1])[None, :, None]
+        use_xtok = np.isin(type_array, [0, 2])[None, :, None]
+        m_k0, m_k1 = MyFactorGraph.compute_messages_to_k(p_x, p_ktox, p_xtok, use_ktox, use_xtok)
+
+        # masked messages are 1 (e.g., the removed r with p = -1)
+        with np.errstate(divide='ignore'):
+            logm_k0 = np.log(np.where(mask, m_k0, 1.0)).sum(axis=(1, 2))
+            logm_k1 = np.log(np.where(mask, m_k1, 1.0)).sum(axis=(1, 2))
+
+        # if both messages to k are 0, neither value of k is supported and P(k=1) is 0 (instead of nan)
+        logm_total = np.logaddexp(logm_k0, logm_k1)
+        with np.errstate(invalid='ignore'):
+            pk = np.exp(logm_k1 - logm_total)
+        return np.where(np.isneginf(logm_total), 0.0, pk)
+
+    # Messages from each x to k, summing x out of phi1 * phi2 * phi3
+    # phi1(x): [1 - p1, p1]
+    # phi2(k,x) (k -> x): [p2, p2, 1 - p2, p2]
+    # phi3(k,x) (x -> k): [p3, 1 - p3, p3, p3]
+    # use_ktox/use_xtok: whether phi2/phi3 is in the graph (a missing factor is a table of ones)
+    @staticmethod
+    def compute_messages_to_k(p_x, p_ktox, p_xtok, use_ktox=True, use_xtok=True):
+        phi2 = [np.where(use_ktox, p, 1.0) for p in [p_ktox, p_ktox, 1 - p_ktox, p_ktox]]
+        phi3 = [np.where(use_xtok, p, 1.0) for p in [p_xtok, 1 - p_xtok, p_xtok, p_xtok]]
+
+        m_k0 = (1 - p_x) * phi2[0] * phi3[0] + p_x * phi2[1] * phi3[1]
+        m_k1 = (1 - p_x) * phi2[2] * phi3[2] + p_x * phi2[3] * phi3[3]
+
+        return m_k0, m_k1
+
+    # pgmpy is only needed by this engine
+    def compute_pk_bp(self, type_list, fid):
+        from pgmpy.models import FactorGraph
+        from pgmpy.inference import BeliefPropagation
+
         constraint_name = ['m', 'r', 's', 'd', 'v']
         '''
         m, r, s, d, v = type_list
@@ -46,11 +133,11 @@ class MyFactorGraph:
                 continue
             
             if type_list[i] == 0:
-                fg = self.add_constraints_k2x_x2k(fg, self.p_observation[fid][i], self.p_implication[fid][0][i], self.p_implication[fid][1][i], constraint_name[i])
+                fg = self.add_constraints_k2x_x2k(fg, self.p_observation[fid][i], self.p_implication[0][fid][i], self.p_implication[1][fid][i], constraint_name[i])
             elif type_list[i] == 1:
-                fg = self.add_constraints_k2x(fg, self.p_observation[fid][i], self.p_implication[fid][0][i], constraint_name[i])
+                fg = self.add_constraints_k2x(fg, self.p_observation[fid][i], self.p_implication[0][fid][i], constraint_name[i])
             elif type_list[i] == 2:
-                fg = self.add_constraints_x2k(fg, self.p_observation[fid][i], self.p_implication[fid][1][i], constraint_name[i])
+                fg = self.add_constraints_x2k(fg, self.p_observation[fid][i], self.p_implication[1][fid][i], constraint_name[i])
         '''
         if m == 0:
             fg = add_constraints_kv_vk(fg, p_m, p_ktom, p_mtok, 'm')
@@ -101,6 +188,7 @@ class MyFactorGraph:
     # Addd Constraints
     # k -> x
     def add_constraints_k2x(self, fg, p_x, p_ktox, x_name):
+        from pgmpy.factors.discrete import DiscreteFactor
         for i in range(len(p_x)):
             p1 = p_x[i]
             p2 = p_ktox[i]
@@ -114,6 +202,7 @@ class MyFactorGraph:
 
     # x -> k
     def add_constraints_x2k(self, fg, p_x, p_xtok, x_name):
+        from pgmpy.factors.discrete import DiscreteFactor
         for i in range(len(p_x)):
             p1 = p_x[i]
             p3 = p_xtok[i]
@@ -127,6 +216,7 @@ class MyFactorGraph:
 
     # k -> x & x -> k
     def add_constraints_k2x_x2k(self, fg, p_x, p_ktox, p_xtok, x_name):
+        from pgmpy.factors.discrete import DiscreteFactor
         for i in range(len(p_x)):
             p1 = p_x[i]
             p2 = p_ktox[i]
@@ -0,0 +1,68 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import numpy as np
+
+"""
+The column ranges of the fields in the aligned matrix: the offsets are the prefix sums of the field sizes (in
+characters of the alignment, i.e., size // 8 of msa_fields_info.txt), computed once instead of summing the sizes of
+the previous fields for each fid
+The values of a field are factorized into codes (numbered by first appearance): the code matrix has one row of codes
+per fid, and the clusters of a candidate fid are the codes of its row
+"""
+class FieldTable:
+    def __init__(self, sizes):
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.sizes)))
+
+    # the table of the netzob fields (see NetPlier.generate_fields_by_fieldsinfo)
+    @staticmethod
+    def from_fields(fields):
+        return FieldTable([field.domain.dataType.size[1] // 8 for field in fields])
+
+    # the columns [il, ir) of field fid
+    def get_range(self, fid):
+        return int(self.offsets[fid]), int(self.offsets[fid + 1])
+
+    def get_size(self, fid):
+        return int(self.sizes[fid])
+
+    # the code matrix of the rows of matrix (all rows if None): one row of codes per fid of fid_list
+    def compute_codes(self, matrix, fid_list, rows=None):
+        num_rows = matrix.num_rows if rows is None else len(rows)
+        codes = np.zeros((len(fid_list), num_rows), dtype=np.int64)
+        for k, fid in enumerate(fid_list):
+            il, ir = self.get_range(fid)
+            codes[k] = FieldTable.factorize(matrix.get_field_keys(il, ir, rows))[0]
+        return codes
+
+    # the codes of values (numbered by first appearance) and the number of codes
+    @staticmethod
+    def factorize(values):
+        if len(values) == 0:
+            return np.zeros(0, dtype=np.int64), 0
+        values_unique, firsts, codes = np.unique(values, return_index=True, return_inverse=True)
+        ranks = np.empty(len(values_unique), dtype=np.int64)
+        ranks[np.argsort(firsts, kind='stable')] = np.arange(len(values_unique))
+        return ranks[codes], len(values_unique)
+
+    # the codes of the tuples of codes (one row per field), as if the fields were one
+    @staticmethod
+    def combine(codes):
+        combined, num = np.zeros(codes.shape[1], dtype=np.int64), 1
+        for codes_field in codes:
+            combined, num = FieldTable.factorize(combined * (codes_field.max(initial=0) + 1) + codes_field)
+        return combined, num
@@ -24,6 +24,7 @@ logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 from netplier import NetPlier
 from processing import Processing
 from alignment import Alignment
+from aligned_matrix import AlignedMatrix
 from clustering import Clustering
 
 
@@ -43,40 +44,44 @@ if __name__ == '__main__':
     parser.add_argument('-single', '--single', dest='single', default=False, action='store_true', help='unidirectional calculation')
     parser.add_argument('-remote', '--remote', dest='remote', default=True, action='store_false', help='do remote coupling')
     parser.add_argument('-origgt', '--origgt', dest='origgt', default=False, action='store_true', help='use the original Netplier KW indexes')
-    parser.add_argument('-double', '--double', dest='double', default=False, action='store_true', help='double messages and balance dirs')
+    parser.add_argument('-double', '--double', dest='double', default=False, action='store_true', help='use each message as both a request and a response (balanced directions)')
+    parser.add_argument('-cp', '--constraint_processes', dest='processes', default=1, type=int, help='the number of worker processes of the constraints of the candidate fids')
+    parser.add_argument('-pr', '--pairing', dest='pairing', default='diagonal', help='the pairs of request and response fids of the constraints: [diagonal, full]')
+    parser.add_argument('-resp', '--response', dest='response', default=False, action='store_true', help='also compute the observation probabilities of the responses (prob_response.txt)')
+    parser.add_argument('-fg', '--fgengine', dest='fg_engine', default='exact', help='the engine of factor graph inference: [exact, bp]')
+    parser.add_argument('-bs', '--bootstrap', dest='bootstrap', default=0, type=int, help='the number of resamples for the confidence of the inferred keyword')
+    parser.add_argument('-bsr', '--bootstrap_ratio', dest='bootstrap_ratio', default=0.8, type=float, help='the ratio of messages in each resample')
+    parser.add_argument('-sim', '--similarity', dest='similarity', default='exact', help='the mode of message similarity: [exact, approx, profile, stratified, pairwise]')
+    parser.add_argument('-eps', '--epsilon', dest='similarity_epsilon', default=0.01, type=float, help='the error bound of the approximate message similarity')
+    parser.add_argument('-pb', '--pair_budget', dest='similarity_budget', default=1 << 14, type=int, help='the number of sampled inner (and inter) pairs per cluster of the stratified message similarity')
+    parser.add_argument('-ssd', '--similarity_seed', dest='similarity_seed', default=0, type=int, help='the random seed of the sampled message similarity')
+    parser.add_argument('-bw', '--band', dest='similarity_band', default=32, type=int, help='the band of the pairwise alignments of the pairwise message similarity')
+    parser.add_argument('-ms', '--min_score', dest='similarity_min_score', default=0.0, type=float, help='the pairwise alignments below this score are abandoned (scored 0)')
+    parser.add_argument('-ss', '--similarity_storage', dest='similarity_storage', default='memory', help='the storage of the similarity matrix: [memory, disk]')
+    parser.add_argument('-nc', '--nocache', dest='similarity_cache', default=True, action='store_false', help='recompute the similarity matrix instead of loading it from the output directory')
+    parser.add_argument('-mb', '--memory_budget', dest='memory_budget', default=1024, type=int, help='the memory budget (MB) of computing the similarity matrix')
 
     args = parser.parse_args()
 
     p = Processing(filepath=args.filepath_input, protocol_type=args.protocol_type, layer=args.layer, randomdir=args.randomdir, sessiondir=args.sessiondir)
     # p.print_dataset_info()
     
-    if args.double:
-
-        newmsgs =[]
-        newdirs = []
-
-        for m in p.messages:
-          newmsgs.append(m)
-          newdirs.append(0)
-          newmsgs.append(m)
-          newdirs.append(1)
-        # msglen = len(p.messages)
-        # newmsgs = p.messages + p.messages
-        # newdirs = [1 for i in range(msglen)] + [0 for i in range(msglen)]
-        
-
-        p.messages = newmsgs
-        p.direction_list = newdirs
-        
+    # the messages are not doubled: with double, NetPlier uses each message as both a request and a response
     if args.randomdir:
         import random
-        random.shuffle(p.direction_list)
+        direction_list = list(p.direction_list)
+        random.shuffle(direction_list)
+        p.set_direction_list(direction_list)
     
     
     mode = args.mafft_mode
     if args.protocol_type in['dnp3']: # tftp
         mode = 'linsi'
-    netplier = NetPlier(messages=p.messages, direction_list=p.direction_list, output_dir=args.output_dir, mode=mode, multithread=args.multithread,single=args.single,remote=args.remote)
+    netplier = NetPlier(messages=p.messages, direction_list=p.direction_list, output_dir=args.output_dir, mode=mode, multithread=args.multithread,single=args.single,remote=args.remote, double=args.double, fg_engine=args.fg_engine, bootstrap=args.bootstrap, bootstrap_ratio=args.bootstrap_ratio,
+        similarity=args.similarity, similarity_epsilon=args.similarity_epsilon, similarity_storage=args.similarity_storage, memory_budget=args.memory_budget << 20,
+        similarity_cache=args.similarity_cache, similarity_budget=args.similarity_budget, similarity_seed=args.similarity_seed,
+        similarity_band=args.similarity_band, similarity_min_score=args.similarity_min_score, processes=args.processes,
+        pairing=args.pairing, response=args.response)
     fid_inferred = netplier.execute()
     if len(fid_inferred) > 0:
         print("fid_inferred",fid_inferred)
@@ -84,19 +89,28 @@ if __name__ == '__main__':
         print("fid_inferred","No Field Inferred")
         quit()
     # Clustering
-    messages_aligned = Alignment.get_messages_aligned(netplier.messages, os.path.join(netplier.output_dir, Alignment.FILENAME_OUTPUT_ONELINE))
-    messages_request, messages_response = Processing.divide_msgs_by_directionlist(netplier.messages, netplier.direction_list)
-    messages_request_aligned, messages_response_aligned = Processing.divide_msgs_by_directionlist(messages_aligned, netplier.direction_list)
+    aligned_matrix = AlignedMatrix.load(os.path.join(netplier.output_dir, Alignment.FILENAME_OUTPUT_ONELINE))
+    messages_aligned = Alignment.attach_messages(netplier.messages, aligned_matrix)
+    if args.double:
+        messages_request, messages_response = netplier.messages, netplier.messages
+        messages_request_aligned, messages_response_aligned = messages_aligned, messages_aligned
+        matrix_request, matrix_response = aligned_matrix, aligned_matrix
+    else:
+        # the splits of the batch are index views of its columns (the netzob messages are only needed by the ground truth)
+        batch_request, batch_response = p.batch.divide_by_directionlist()
+        messages_request, messages_response = batch_request.to_messages(), batch_response.to_messages()
+        messages_request_aligned, messages_response_aligned = Processing.divide_msgs_by_directionlist(messages_aligned, netplier.direction_list)
+        matrix_request, matrix_response = aligned_matrix.divide_by_directionlist(netplier.direction_list)
 
     clustering = Clustering(fields=netplier.fields, protocol_type=args.protocol_type)
     clustering_result_request_true = clustering.cluster_by_kw_true(messages_request)
     clustering_result_response_true = clustering.cluster_by_kw_true(messages_response)
     print("result request")
-    clustering_result_request_netplier = clustering.cluster_by_kw_inferred(fid_inferred, messages_request_aligned)
+    clustering_result_request_netplier = clustering.cluster_by_kw_inferred(fid_inferred, messages_request_aligned, aligned_matrix=matrix_request)
     print("results response")
-    clustering_result_response_netplier = clustering.cluster_by_kw_inferred(fid_inferred, messages_response_aligned)
+    clustering_result_response_netplier = clustering.cluster_by_kw_inferred(fid_inferred, messages_response_aligned, aligned_matrix=matrix_response)
     print("results both")
-    clustering_result_netplier = clustering.cluster_by_kw_inferred(fid_inferred, messages_aligned)
+    clustering_result_netplier = clustering.cluster_by_kw_inferred(fid_inferred, messages_aligned, aligned_matrix=aligned_matrix)
     clustering.evaluation([clustering_result_request_true, clustering_result_response_true], [clustering_result_request_netplier, clustering_result_response_netplier])
     
 
@@ -0,0 +1,113 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import numpy as np
+from netzob.Model.Vocabulary.Messages.RawMessage import RawMessage
+
+"""
+The messages of a trace in columns: the payloads are [start, end) ranges of one contiguous buffer, and the dates,
+endpoints (ids in the list of endpoint strings) and directions are arrays
+Selecting (by a slice, a boolean mask or indices), dividing by direction and truncating the payloads only index the
+arrays: the buffer is shared by all batches derived from the same trace
+to_messages is the adapter to the netzob messages (the imported ones if the batch was built from them)
+"""
+class MessageBatch:
+    def __init__(self, payload, starts, ends, dates, sources, destinations, endpoints, directions=None, messages=None):
+        self.payload = payload # uint8 buffer of all payloads
+        self.starts = starts
+        self.ends = ends
+        self.dates = dates
+        self.sources = sources # the endpoint ids of the sources and destinations
+        self.destinations = destinations
+        self.endpoints = endpoints # the endpoint strings (e.g., ip:port)
+        self.directions = directions # 0: request, 1: response (None if unknown)
+        self.messages = messages # the netzob messages of the rows (None if the batch wasn't built from them)
+
+    @staticmethod
+    def from_messages(messages):
+        data_list = [bytes(message.data) for message in messages]
+        lengths = np.array([len(data) for data in data_list], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        dict_endpoints = dict()
+        sources = [dict_endpoints.setdefault(str(message.source), len(dict_endpoints)) for message in messages]
+        destinations = [dict_endpoints.setdefault(str(message.destination), len(dict_endpoints)) for message in messages]
+        return MessageBatch(payload=np.frombuffer(b''.join(data_list), dtype=np.uint8), starts=ends - lengths, ends=ends,
+            dates=np.array([message.date if message.date is not None else 0 for message in messages], dtype=np.float64),
+            sources=np.array(sources, dtype=np.int64), destinations=np.array(destinations, dtype=np.int64),
+            endpoints=list(dict_endpoints.keys()), messages=list(messages))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get_lengths(self):
+        return self.ends - self.starts
+
+    def get_data(self, i):
+        return self.payload[self.starts[i]:self.ends[i]].tobytes()
+
+    def get_data_list(self):
+        return [self.get_data(i) for i in range(len(self))]
+
+    # the bytes [il, il+width) of each payload (padded with 0 after its end), as a matrix
+    def get_columns(self, il, width):
+        positions = self.starts[:, np.newaxis] + il + np.arange(width)
+        inside = positions < self.ends[:, np.newaxis]
+        return np.where(inside, self.payload[np.where(inside, positions, 0)] if len(self.payload) > 0 else 0, 0).astype(np.uint8), inside
+
+    # the batch of the rows of index (a slice, a boolean mask or indices)
+    def select(self, index):
+        messages = None
+        if self.messages is not None:
+            messages = [self.messages[i] for i in np.arange(len(self))[index]]
+        return MessageBatch(payload=self.payload, starts=self.starts[index], ends=self.ends[index], dates=self.dates[index],
+            sources=self.sources[index], destinations=self.destinations[index], endpoints=self.endpoints,
+            directions=self.directions[index] if self.directions is not None else None, messages=messages)
+
+    # the batches of the requests and the responses
+    def divide_by_directionlist(self, direction_list=None):
+        directions = np.asarray(direction_list if direction_list is not None else self.directions)
+        return self.select(directions == 0), self.select(directions != 0)
+
+    # keep the first lengths bytes of each payload
+    def truncate(self, lengths):
+        ends = self.starts + np.clip(lengths, 0, self.get_lengths())
+        batch = self.select(slice(None))
+        batch.ends = ends
+        return batch
+
+    # skip the first lengths bytes of each payload
+    def skip(self, lengths):
+        batch = self.select(slice(None))
+        batch.starts = self.starts + np.clip(lengths, 0, self.get_lengths())
+        return batch
+
+    # the batch with new payloads (a new buffer)
+    def replace_data(self, data_list):
+        lengths = np.array([len(data) for data in data_list], dtype=np.int64)
+        batch = self.select(slice(None))
+        batch.payload = np.frombuffer(b''.join(data_list), dtype=np.uint8)
+        batch.ends = np.cumsum(lengths)
+        batch.starts = batch.ends - lengths
+        return batch
+
+    # the netzob messages of the rows, with the payloads of the batch
+    def to_messages(self):
+        if self.messages is None:
+            self.messages = [RawMessage(data=self.get_data(i), date=float(self.dates[i]), source=self.endpoints[self.sources[i]],
+                destination=self.endpoints[self.destinations[i]]) for i in range(len(self))]
+        for i, message in enumerate(self.messages):
+            message.data = self.get_data(i)
+        return self.messages
@@ -26,16 +26,34 @@ from netzob.Model.Vocabulary.Types.Raw import Raw
 from alignment import Alignment
 from constraint.constraint import Constraint
 from probabilistic_inference import ProbabilisticInference
+from bootstrap import Bootstrap
 
 class NetPlier:
-    def __init__(self, messages, direction_list=None, output_dir='tmp/', mode='ginsi', multithread=False,single=False,remote=True):
+    def __init__(self, messages, direction_list=None, output_dir='tmp/', mode='ginsi', multithread=False,single=False,remote=True, double=False, fg_engine='exact', bootstrap=0, bootstrap_ratio=0.8, similarity='exact', similarity_epsilon=0.01, similarity_storage='memory', memory_budget=1 << 30, similarity_cache=True, similarity_budget=1 << 14, similarity_seed=0, similarity_band=32, similarity_min_score=0.0, processes=1, pairing='diagonal', response=False):
         self.messages = messages
         self.direction_list = direction_list
         self.output_dir = output_dir
         self.mode = mode
         self.multithread = multithread
         self.single = single
+        self.double = double # each message is both a request and a response (virtually, it is aligned once)
         self.remote = remote
+        self.fg_engine = fg_engine
+        self.bootstrap = bootstrap # number of resamples (0: no bootstrap)
+        self.bootstrap_ratio = bootstrap_ratio
+        self.bootstrap_result = None
+        self.similarity = similarity # the mode of message similarity: exact, approx or profile
+        self.similarity_epsilon = similarity_epsilon
+        self.similarity_storage = similarity_storage
+        self.memory_budget = memory_budget
+        self.similarity_cache = similarity_cache
+        self.similarity_budget = similarity_budget
+        self.similarity_seed = similarity_seed
+        self.similarity_band = similarity_band
+        self.similarity_min_score = similarity_min_score
+        self.processes = processes # the worker processes of the constraints
+        self.pairing = pairing # the pairs of request and response fids: diagonal (the ones of ffid_list) or full
+        self.response = response # also compute the response direction (saved in prob_response.txt, not used by the inference)
 
         if not os.path.exists(self.output_dir):
             logging.debug("Folder {0} doesn't exist".format(self.output_dir))
@@ -55,26 +73,39 @@ class NetPlier:
         self.fields, fid_list = self.generate_fields_by_fieldsinfo(filepath_fields_info)
         logging.debug("Number of keyword candidates: {}\nfid: {}".format(len(fid_list), fid_list))
         
+        # the single mode: all messages are one population (requests), without remote coupling
+        # the double mode is the same: the requests and responses are the same messages, and each message is the response
+        # of its own request, so the response constraints are the ones of the requests and the remote coupling is void
+        direction_list, remote, pairing = self.direction_list, self.remote, self.pairing
+        if self.single or self.double:
+            direction_list, remote, pairing = [0] * len(self.messages), False, Constraint.PAIRING_SINGLE
+
         # Compute probabilities of observation constraints
-        constraint = Constraint(messages=self.messages, direction_list=self.direction_list, fields=self.fields, fid_list=fid_list, output_dir=self.output_dir)
+        directions = [Constraint.TEST_TYPE_REQUEST, Constraint.TEST_TYPE_RESPONSE] if self.response else [Constraint.TEST_TYPE_REQUEST]
+        constraint = Constraint(messages=self.messages, direction_list=direction_list, fields=self.fields, fid_list=fid_list, output_dir=self.output_dir,
+            similarity_mode=self.similarity, similarity_epsilon=self.similarity_epsilon, similarity_storage=self.similarity_storage, memory_budget=self.memory_budget,
+            similarity_cache=self.similarity_cache, similarity_budget=self.similarity_budget, similarity_seed=self.similarity_seed,
+            similarity_band=self.similarity_band, similarity_min_score=self.similarity_min_score, processes=self.processes,
+            pairing=pairing, constraints=ProbabilisticInference.get_required_constraints(remote), directions=directions)
         
-        pairs_p, pairs_size = constraint.compute_observation_probabilities()
-        pairs_p_request, pairs_p_response = pairs_p
-        pairs_size_request, pairs_size_response = pairs_size
-        constraint.save_observation_probabilities(pairs_p_request, pairs_size_request, Constraint.TEST_TYPE_REQUEST)
-        constraint.save_observation_probabilities(pairs_p_response, pairs_size_response, Constraint.TEST_TYPE_RESPONSE)
+        p_observation_request, p_observation_response = constraint.compute_observation_probabilities()
+        constraint.close()
+        constraint.save_observation_probabilities(p_observation_request, Constraint.TEST_TYPE_REQUEST)
+        if p_observation_response is not None:
+            constraint.save_observation_probabilities(p_observation_response, Constraint.TEST_TYPE_RESPONSE)
         
-        # pairs_p_request, pairs_size_request = constraint.load_observation_probabilities(Constraint.TEST_TYPE_REQUEST)
-        # pairs_p_response, pairs_size_response = constraint.load_observation_probabilities(Constraint.TEST_TYPE_RESPONSE)
-        # print(pairs_p_request, pairs_size_request)
-        # print(pairs_p_response, pairs_size_response)
-
-        # Probabilistic inference
-        pairs_p_all, pairs_size_all = self.merge_constraint_results(pairs_p_request, pairs_p_response, pairs_size_request, pairs_size_response)
+        # p_observation_request = constraint.load_observation_probabilities(Constraint.TEST_TYPE_REQUEST)
+        # p_observation_response = constraint.load_observation_probabilities(Constraint.TEST_TYPE_RESPONSE)
 
+        # Probabilistic inference (only the request direction is used)
         ffid_list = ["{0}-{0}".format(fid) for fid in fid_list] #only test same fid for both sides
-        pi = ProbabilisticInference(pairs_p=pairs_p_request, pairs_size=pairs_size_request,remote=self.remote)
+        pi = ProbabilisticInference(p_observation=p_observation_request,remote=remote, engine=self.fg_engine)
         fid_inferred = pi.execute(ffid_list)
+
+        # Confidence of the inferred fid
+        if self.bootstrap > 0 and len(fid_inferred) > 0:
+            bs = Bootstrap(constraint=constraint, ffid_list=ffid_list, remote=remote, engine=self.fg_engine, num=self.bootstrap, ratio=self.bootstrap_ratio, output_dir=self.output_dir)
+            self.bootstrap_result = bs.execute(fid_inferred[0], Bootstrap.compute_margin(pi.pk_result))
         
         ## TODO: iterative
         ## TODO: format inference
@@ -115,22 +146,3 @@ class NetPlier:
                 logging.error("Field type is not Raw")
 
         return fields
-
-    def merge_constraint_results(self, pairs_p_request, pairs_p_response, pairs_size_request, pairs_size_response):
-        pairs_p_all, pairs_size_all = dict(), dict()
-        assert pairs_p_request.keys() == pairs_p_response.keys(), \
-            "pairs_p_request/pairs_p_response do not have the same fid pairs"
-
-        for fid in pairs_p_request:
-            pairs_p_all[fid] = list()
-            for i in range(len(pairs_p_request[fid])):
-                pairs_p_all[fid].append(pairs_p_request[fid][i] + pairs_p_response[fid][i])
-                '''
-                if i == 1: # not merge rc
-                    pairs_p_all[fid].append(pairs_p_request[fid][i])
-                else:
-                    pairs_p_all[fid].append(pairs_p_request[fid][i] + pairs_p_response[fid][i])
-                '''
-            pairs_size_all[fid] = pairs_size_request[fid] + pairs_size_response[fid]
-
-        return pairs_p_all, pairs_size_all
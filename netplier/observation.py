@@ -0,0 +1,154 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import numpy as np
+
+"""
+Observation probabilities of all fid pairs, stored as ragged arrays
+test_id: 0: m, 1: r, 2: s, 3: d, 4: v
+values[test_id]: flat float64 array of the probabilities of all fid pairs
+offsets[test_id]: values[test_id][offsets[test_id][i]:offsets[test_id][i+1]] belong to fid_list[i]
+sizes/size_offsets: the size of each cluster, in the same layout
+mask[test_id]: the probabilities used by inference (the sentinels -1/-2 are values < 0)
+"""
+class ObservationProbabilities:
+    NUM_CONSTRAINTS = 5
+
+    def __init__(self, fid_list, values, offsets, sizes, size_offsets, mask=None):
+        self.fid_list = list(fid_list)
+        self.values = values
+        self.offsets = offsets
+        self.sizes = sizes
+        self.size_offsets = size_offsets
+        if mask is None:
+            mask = [np.ones(len(v), dtype=bool) for v in values]
+        self.mask = mask
+
+        self.fid_index = dict()
+        for i, fid in enumerate(self.fid_list):
+            self.fid_index[fid] = i
+
+    # pairs_p: {fid: [p_m, p_r, p_s, p_d, p_v]}; pairs_size: {fid: list of cluster sizes}
+    @staticmethod
+    def from_lists(pairs_p, pairs_size):
+        fid_list = list(pairs_p.keys())
+        values, offsets = list(), list()
+        for test_id in range(ObservationProbabilities.NUM_CONSTRAINTS):
+            p_lists = [pairs_p[fid][test_id] for fid in fid_list]
+            values.append(ObservationProbabilities.concatenate(p_lists, np.float64))
+            offsets.append(ObservationProbabilities.compute_offsets(p_lists))
+        size_lists = [pairs_size[fid] for fid in fid_list]
+        sizes = ObservationProbabilities.concatenate(size_lists, np.int64)
+        size_offsets = ObservationProbabilities.compute_offsets(size_lists)
+
+        return ObservationProbabilities(fid_list, values, offsets, sizes, size_offsets)
+
+    @staticmethod
+    def concatenate(lists, dtype):
+        if len(lists) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.concatenate([np.asarray(l, dtype=dtype) for l in lists])
+
+    @staticmethod
+    def compute_offsets(lists):
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(l) for l in lists])
+        return offsets
+
+    def keys(self):
+        return list(self.fid_list)
+
+    def __contains__(self, fid):
+        return fid in self.fid_index
+
+    def __len__(self):
+        return len(self.fid_list)
+
+    # the p lists of a fid pair (only the ones in mask)
+    def __getitem__(self, fid):
+        return [self.get(fid, test_id) for test_id in range(ObservationProbabilities.NUM_CONSTRAINTS)]
+
+    def get(self, fid, test_id):
+        i = self.fid_index[fid]
+        il, ir = self.offsets[test_id][i], self.offsets[test_id][i+1]
+        return self.values[test_id][il:ir][self.mask[test_id][il:ir]].tolist()
+
+    def get_size(self, fid):
+        i = self.fid_index[fid]
+        return self.sizes[self.size_offsets[i]:self.size_offsets[i+1]].tolist()
+
+    # the index of fid (in fid_list) for each value
+    def get_fid_indices(self, test_id):
+        return np.repeat(np.arange(len(self.fid_list)), np.diff(self.offsets[test_id]))
+
+    # the position of each value in the p list of its fid
+    def get_positions(self, test_id):
+        return np.arange(len(self.values[test_id])) - np.repeat(self.offsets[test_id][:-1], np.diff(self.offsets[test_id]))
+
+    # the size of the cluster of each value (-1 if the value has no cluster)
+    def get_cluster_sizes(self, test_id):
+        fid_indices, positions = self.get_fid_indices(test_id), self.get_positions(test_id)
+        num_clusters = np.diff(self.size_offsets)[fid_indices]
+        has_cluster = positions < num_clusters
+        cluster_sizes = np.full(len(positions), -1, dtype=np.int64)
+        cluster_sizes[has_cluster] = self.sizes[self.size_offsets[fid_indices[has_cluster]] + positions[has_cluster]]
+        return cluster_sizes
+
+    # the total size of the clusters of each fid
+    def get_size_sums(self):
+        fid_indices = np.repeat(np.arange(len(self.fid_list)), np.diff(self.size_offsets))
+        return np.bincount(fid_indices, weights=self.sizes, minlength=len(self.fid_list))
+
+    def is_sentinel(self, test_id):
+        return self.values[test_id] < 0
+
+    # copy the flat arrays (the layout is shared)
+    def copy(self):
+        return self.full_like([v.copy() for v in self.values], mask=[m.copy() for m in self.mask])
+
+    # a container with the same layout and new values
+    # values: list of arrays, or a constant for each test_id
+    def full_like(self, values, mask=None):
+        values = [np.asarray(v, dtype=np.float64) for v in values]
+        values = [np.full(len(self.values[test_id]), v) if v.ndim == 0 else v for test_id, v in enumerate(values)]
+        if mask is None:
+            mask = [m.copy() for m in self.mask]
+        return ObservationProbabilities(self.fid_list, values, self.offsets, self.sizes, self.size_offsets, mask)
+
+    def select(self, fid_list):
+        pairs_p, pairs_size = self.to_lists(fid_list)
+        return ObservationProbabilities.from_lists(pairs_p, pairs_size)
+
+    # merge the p lists of the fid pairs of two containers (e.g., request and response)
+    def merge(self, other):
+        assert self.fid_list == other.fid_list, "the two containers do not have the same fid pairs"
+
+        pairs_p, pairs_size = self.to_lists()
+        pairs_p_other, pairs_size_other = other.to_lists()
+        for fid in self.fid_list:
+            pairs_p[fid] = [pairs_p[fid][i] + pairs_p_other[fid][i] for i in range(ObservationProbabilities.NUM_CONSTRAINTS)]
+            pairs_size[fid] = pairs_size[fid] + pairs_size_other[fid]
+
+        return ObservationProbabilities.from_lists(pairs_p, pairs_size)
+
+    def to_lists(self, fid_list=None):
+        if fid_list is None:
+            fid_list = self.fid_list
+        pairs_p, pairs_size = dict(), dict()
+        for fid in fid_list:
+            pairs_p[fid] = self[fid]
+            pairs_size[fid] = self.get_size(fid)
+        return pairs_p, pairs_size
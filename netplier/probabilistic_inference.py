@@ -16,7 +16,6 @@
 
 from sklearn import preprocessing
 import numpy as np
-import copy
 import logging
 
 from factor_graph import MyFactorGraph
@@ -29,11 +28,35 @@ class ProbabilisticInference:
     P_K2V, P_V2K = 0.9, 0.6
 
     BONUS_VALUE_X2K = 0.2
-
-    def __init__(self, pairs_p, pairs_size,remote=True):
-        self.pairs_p = pairs_p # observation prob
-        self.pairs_size = pairs_size
+    BONUS_VALUE = 0.2 # bonus of observation prob by cluster size
+
+    # target ranges of normalize_p_observation
+    NORM_M_MIN, NORM_M_MAX = 0.2, 0.80 #[0.1, 0.95]
+    NORM_R_MIN, NORM_R_MAX = 0.2, 0.8
+    NORM_S_MIN, NORM_S_MAX = 0.2, 0.8
+    NORM_D_MIN, NORM_D_MAX = 0.1, 0.75
+
+    # the parameters that can be overridden for each run (e.g., by ParameterSweep)
+    PARAMETERS = ['P_K2M', 'P_M2K', 'P_K2R', 'P_R2K', 'P_K2S', 'P_S2K', 'P_K2D', 'P_D2K', 'P_K2V', 'P_V2K',
+        'BONUS_VALUE_X2K', 'BONUS_VALUE',
+        'NORM_M_MIN', 'NORM_M_MAX', 'NORM_R_MIN', 'NORM_R_MAX', 'NORM_S_MIN', 'NORM_S_MAX', 'NORM_D_MIN', 'NORM_D_MAX']
+
+    # the constraints of the observation probabilities used by the inference (see Constraint.CONSTRAINTS)
+    @staticmethod
+    def get_required_constraints(remote=True):
+        return ['m', 'r', 's', 'd', 'v'] if remote else ['m', 's', 'd', 'v']
+
+    # p_observation: ObservationProbabilities of all fid pairs
+    # params: {parameter name: value}, e.g., {'P_K2M': 0.7}
+    def __init__(self, p_observation, remote=True, engine='exact', params=None):
+        self.p_observation = p_observation # observation prob
         self.remote = remote
+        self.engine = engine # exact or bp (see MyFactorGraph)
+
+        if params is not None:
+            for name, value in params.items():
+                assert name in ProbabilisticInference.PARAMETERS, "unknown parameter: {}".format(name)
+                setattr(self, name, value)
 
     # inference
     def execute(self, fid_list = None):
@@ -41,18 +64,17 @@ class ProbabilisticInference:
 
         # update fid_list if it is specified
         if fid_list == None:
-            fid_list = list(pairs_p.keys())
+            fid_list = self.p_observation.keys()
         else:
-            fid_list = [fid for fid in fid_list if fid in self.pairs_p]
+            fid_list = [fid for fid in fid_list if fid in self.p_observation]
         logging.debug("fid_list: {}".format(fid_list)) #debug
         
         # compute implication probabilities
-        self.p_implication = dict()
-        for fid in self.pairs_p.keys():
-            self.p_implication[fid] = self.compute_p_implication(self.pairs_p[fid], self.pairs_size[fid])
-            #self.p_implication[fid] = self.compute_p_implication_weighted(self.pairs_p[fid], self.pairs_size[fid])
+        self.p_implication = self.compute_p_implication(self.p_observation)
+        #self.p_implication = self.compute_p_implication_weighted(self.p_observation)
         
-        p_observation = copy.deepcopy(self.pairs_p)
+        # only the flat arrays are copied
+        p_observation = self.p_observation.copy()
         #self.print_p_lists(fid_list, p_observation)
 
         # normalize observation prob
@@ -62,10 +84,9 @@ class ProbabilisticInference:
         # adjust observation/implication probabilities by cluster size
         logging.debug('[++++] Add bonus by size')
         # test_id: 0: m, 1: r, 2: s, 3: d, 4: v
-        for fid in p_observation.keys():
-            for test_id in [0, 1, 2]:
-                p_observation[fid][test_id] = self.add_bonus_value(p_observation[fid][test_id], self.pairs_size[fid], 0.2)
-                #self.p_implication[fid][1][test_id] = self.add_bonus_value(self.p_implication[fid][1][test_id], self.pairs_size[fid], ProbabilisticInference.BONUS_VALUE_X2K)
+        for test_id in [0, 1, 2]:
+            p_observation.values[test_id] = self.add_bonus_value(p_observation, test_id, self.BONUS_VALUE)
+            #self.p_implication[1].values[test_id] = self.add_bonus_value(self.p_implication[1], test_id, self.BONUS_VALUE_X2K)
         # self.print_p_lists(fid_list, p_observation)
 
         # deal with p < 0
@@ -76,118 +97,74 @@ class ProbabilisticInference:
         #P_lists_dict =  PadPLists(P_lists_dict, dict_sn_msgnum, fid_list)
 
         # factor graph
-        fg_result = dict()
-        for fid in fid_list:
-            pk_list = list() 
-            fg = MyFactorGraph(p_observation=p_observation, p_implication=self.p_implication,remote=self.remote)
-            # can test different constraints together
-            # test type (m/r/s/d/v): 0: k2x & x2k, 1: k2x, 2: x2k, -1: not test
-            pk_list.append(fg.compute_pk([0,0,0,0,0], fid)) #kv:mrsdv, vk: mrsdv
-
-            ## Weighted Ave
-            '''
-            p_list_q_weighted, p_list_s_weighted, p_list_g_weighted = p_lists_dict_weighted[fid]
-            p_lists_weighted = [p_list_q_weighted, p_list_s_weighted, p_list_d, p_list_v, p_list_g_weighted]
-            pk_list.append(factorgraph.compute_pk([0,0,0,0,0], p_lists_weighted, p_values_const_dict[fid]))
-            '''
-            fg_result[fid] = pk_list
+        # test type (m/r/s/d/v): 0: k2x & x2k, 1: k2x, 2: x2k, -1: not test
+        type_list = [0,0,0,0,0] #kv:mrsdv, vk: mrsdv
+        fg = MyFactorGraph(p_observation=p_observation, p_implication=self.p_implication,remote=self.remote, engine=self.engine)
+        if self.engine == MyFactorGraph.ENGINE_EXACT:
+            # all fids are solved together
+            pk_result = fg.compute_pk_batch(type_list, fid_list)
+        else:
+            pk_result = np.array([fg.compute_pk(type_list, fid) for fid in fid_list])
 
+        ## Weighted Ave
+        '''
+        p_list_q_weighted, p_list_s_weighted, p_list_g_weighted = p_lists_dict_weighted[fid]
+        p_lists_weighted = [p_list_q_weighted, p_list_s_weighted, p_list_d, p_list_v, p_list_g_weighted]
+        pk_list.append(factorgraph.compute_pk([0,0,0,0,0], p_lists_weighted, p_values_const_dict[fid]))
+        '''
+
+        # {fid: P(k=1)}
+        self.pk_result = dict(zip(fid_list, pk_result))
         logging.debug("\n[++++] Final Result")
-        try:
-            pk_list_size = len(list(fg_result.values())[0]) # num of different test
-            for i in range(pk_list_size):
-                result = dict()
-                for fid in fg_result:
-                    result[fid] = fg_result[fid][i]
-                logging.debug(sorted(result.items(), key=lambda x:x[1], reverse=True))
-        except:
-            pass
-        return self.get_fid_inferred(fg_result)
+        logging.debug(sorted(self.pk_result.items(), key=lambda x:x[1], reverse=True))
+
+        return self.get_fid_inferred(fid_list, pk_result)
 
     def print_p_lists(self, fid_list, p_observation, p_implication = None):
         for fid in fid_list:
             print("\nField {}".format(fid))
-            print("Num of messages: {}".format(self.pairs_size[fid]))
+            print("Num of messages: {}".format(p_observation.get_size(fid)))
             p_lists = p_observation[fid]
             if p_implication == None:
                 print("M: {0[0]}\nR: {0[1]}\nS: {0[2]}\nD: {0[3]}\nV: {0[4]}".format(p_lists))
             else:
-                print("M: {} {}".format(p_lists[0], p_implication[fid][1][0]))
-                print("R: {} {}".format(p_lists[1], p_implication[fid][1][1]))
-                print("S: {} {}".format(p_lists[2], p_implication[fid][1][2]))
-                print("D: {} {}".format(p_lists[3], p_implication[fid][1][3]))
-                print("V: {} {}".format(p_lists[4], p_implication[fid][1][4]))
+                p_xtok = p_implication[1][fid]
+                print("M: {} {}".format(p_lists[0], p_xtok[0]))
+                print("R: {} {}".format(p_lists[1], p_xtok[1]))
+                print("S: {} {}".format(p_lists[2], p_xtok[2]))
+                print("D: {} {}".format(p_lists[3], p_xtok[3]))
+                print("V: {} {}".format(p_lists[4], p_xtok[4]))
 
     # weighted
-    def add_bonus_value(self, p_list, size_list, bonus_value):
-        size_sum = sum(size_list)
-        #p_list = [p + bonus_value * (s / size_sum) for p,s in list(zip(p_list, size_list))]
-        result = list()
-        for p,s in list(zip(p_list, size_list)):
-            if p > 0:
-                result.append(p + bonus_value * (s / size_sum))
-            else:
-                result.append(p)
-
-        return result
+    # add bonus_value * (cluster size / total size of the fid) to the p > 0 of test_id
+    def add_bonus_value(self, p_observation, test_id, bonus_value):
+        p_list = p_observation.values[test_id]
+        size_list = p_observation.get_cluster_sizes(test_id)
+        size_sum = p_observation.get_size_sums()[p_observation.get_fid_indices(test_id)]
 
-    def weight_by_size_(self, p_initial, size_list):
-        size_sum = sum(size_list)
-        p_list = [p_initial + 0.2 * (size / size_sum)  for size in size_list]
+        is_bonus = (p_list > 0) & (size_list >= 0)
+        result = p_list.copy()
+        result[is_bonus] = p_list[is_bonus] + bonus_value * (size_list[is_bonus] / size_sum[is_bonus])
 
-        return p_list
-
-    # output: p_ktox, p_xtok (x: m/r/s/d/v)
-    def compute_p_implication_weighted(self, p_lists, size_list):
-        p_m, p_r, p_s, p_d, p_v = p_lists
+        return result
 
-        # k->x
-        p_ktom = [ProbabilisticInference.P_K2M] * len(p_m)
-        p_ktor = [ProbabilisticInference.P_K2R] * len(p_r)
-        p_ktos = [ProbabilisticInference.P_K2S] * len(p_s)
-        p_ktod = [ProbabilisticInference.P_K2D] * len(p_d)
-        p_ktov = [ProbabilisticInference.P_K2V] * len(p_v)
+    # output: p_ktox, p_xtok (x: m/r/s/d/v), in the same layout of p_observation
+    def compute_p_implication_weighted(self, p_observation):
+        p_ktox, p_xtok = self.compute_p_implication(p_observation)
 
         # x->k
-        p_mtok = [ProbabilisticInference.P_M2K] * len(p_m)
-        p_mtok = self.add_bonus_value(p_mtok, size_list, ProbabilisticInference.BONUS_VALUE_X2K)
-        #p_mtok = self.weight_by_size_(ProbabilisticInference.P_M2K, size_list)
-
-        p_rtok = [ProbabilisticInference.P_R2K] * len(p_r) # TODO: check weighted
-        p_rtok = self.add_bonus_value(p_rtok, size_list, ProbabilisticInference.BONUS_VALUE_X2K)
-
-        p_stok = [ProbabilisticInference.P_S2K] * len(p_s)
-        p_stok = self.add_bonus_value(p_stok, size_list, ProbabilisticInference.BONUS_VALUE_X2K)
-        #p_stok = self.weight_by_size_(ProbabilisticInference.P_S2K, size_list)
+        for test_id in [0, 1, 2]: # m, r (TODO: check weighted), s
+            p_xtok.values[test_id] = self.add_bonus_value(p_xtok, test_id, self.BONUS_VALUE_X2K)
         
-        p_dtok = [ProbabilisticInference.P_D2K] * len(p_d)
-        p_vtok = [ProbabilisticInference.P_V2K] * len(p_v)
-
-        p_ktox = [p_ktom, p_ktor, p_ktos, p_ktod, p_ktov]
-        p_xtok = [p_mtok, p_rtok, p_stok, p_dtok, p_vtok]
         p_implication = [p_ktox, p_xtok]
         
         return p_implication
 
-    # output: p_ktox, p_xtok (x: m/r/s/d/v)
-    def compute_p_implication(self, p_lists, size_list):
-        p_m, p_r, p_s, p_d, p_v = p_lists
-
-        p_ktom = [ProbabilisticInference.P_K2M] * len(p_m)
-        p_ktor = [ProbabilisticInference.P_K2R] * len(p_r)
-        p_ktos = [ProbabilisticInference.P_K2S] * len(p_s)
-        p_ktod = [ProbabilisticInference.P_K2D] * len(p_d)
-        p_ktov = [ProbabilisticInference.P_K2V] * len(p_v)
-
+    # output: p_ktox, p_xtok (x: m/r/s/d/v), in the same layout of p_observation
+    def compute_p_implication(self, p_observation):
+        p_ktox = p_observation.full_like([self.P_K2M, self.P_K2R, self.P_K2S, self.P_K2D, self.P_K2V])
+        p_xtok = p_observation.full_like([self.P_M2K, self.P_R2K, self.P_S2K, self.P_D2K, self.P_V2K])
 
-        p_mtok = [ProbabilisticInference.P_M2K] * len(p_m)
-        p_rtok = [ProbabilisticInference.P_R2K] * len(p_r)
-        p_stok = [ProbabilisticInference.P_S2K] * len(p_s)
-        p_dtok = [ProbabilisticInference.P_D2K] * len(p_d)
-        p_vtok = [ProbabilisticInference.P_V2K] * len(p_v)
-
-        p_ktox = [p_ktom, p_ktor, p_ktos, p_ktod, p_ktov]
-        p_xtok = [p_mtok, p_rtok, p_stok, p_dtok, p_vtok]
         p_implication = [p_ktox, p_xtok]
 
         return p_implication
@@ -198,85 +175,54 @@ class ProbabilisticInference:
 
         observation_id = [0, 1, 2, 3] # 0: m, 1: r, 2: s, 3: d, 4: v
         for test_id in observation_id:
-            p_list_total = list()
-            for fid in p_observation:
-                p_list_total += p_observation[fid][test_id]
-
             # remove -1
-            p_list_total = [p for p in p_list_total if p >= 0]
+            is_valid = ~p_observation.is_sentinel(test_id)
+            p_list_total = p_observation.values[test_id][is_valid]
             if len(p_list_total) == 0:
                 continue
 
             # TODO: compute the balance value automatically
             # TODO: compute the boundary value automatically
+            p_list_total_min = np.min(p_list_total)
+            p_list_total_max = np.max(p_list_total)
             if test_id in [0]: # ms
                 #if len(p_list_total) > 1:
                 #    p_list_total = self.standardize(p_list_total)
                 #p_list_total = self.normalize_max_min(p_list_total)
-
-                p_list_total_min = np.min(p_list_total)
-                p_list_total_max = np.max(p_list_total)
                 if p_list_total_min != p_list_total_max:
-                    p_list_total = self.normalize_range(p_list_total, p_list_total_min, p_list_total_max, 0.2, 0.80) #[0.1, 0.95]
+                    p_list_total = self.normalize_range(p_list_total, p_list_total_min, p_list_total_max, self.NORM_M_MIN, self.NORM_M_MAX)
                 else:
-                    p_balance = MyFactorGraph.compute_fg_threshold(ProbabilisticInference.P_K2M, ProbabilisticInference.P_M2K)
-                    p_list_total = [p_balance for p in p_list_total]
+                    p_balance = MyFactorGraph.compute_fg_threshold(self.P_K2M, self.P_M2K)
+                    p_list_total = np.full(len(p_list_total), p_balance)
                     #p_list_total = [0.5 for p in p_list_total]
             elif test_id in [1]: # rc
-                p_list_total_min = np.min(p_list_total)
-                p_list_total_max = np.max(p_list_total)
                 if p_list_total_min != p_list_total_max:
                     #p_list_total = self.normalize_range(p_list_total, p_list_total_min, p_list_total_max, 0.2, 0.8)
-                    p_list_total = self.normalize_range(p_list_total, 0, 1, 0.2, 0.8)
+                    p_list_total = self.normalize_range(p_list_total, 0, 1, self.NORM_R_MIN, self.NORM_R_MAX)
                 else:
-                    p_balance = MyFactorGraph.compute_fg_threshold(ProbabilisticInference.P_K2R, ProbabilisticInference.P_R2K)
-                    p_list_total = [p_balance for p in p_list_total]
+                    p_balance = MyFactorGraph.compute_fg_threshold(self.P_K2R, self.P_R2K)
+                    p_list_total = np.full(len(p_list_total), p_balance)
                     #p_list_total = [0.5 for p in p_list_total]
             elif test_id in [2]: # structure
                 #if len(p_list_total) > 1:
                 #    p_list_total = self.standardize(p_list_total)
-
-                p_list_total_min = np.min(p_list_total)
-                p_list_total_max = np.max(p_list_total)
                 if p_list_total_min != p_list_total_max:
                     #p_list_total = self.normalize_range(p_list_total, p_list_total_min, p_list_total_max, 0.2, 0.8)
-                    p_list_total = self.normalize_range(p_list_total, 0, 1, 0.2, 0.8)
+                    p_list_total = self.normalize_range(p_list_total, 0, 1, self.NORM_S_MIN, self.NORM_S_MAX)
                 else:
-                    p_balance = MyFactorGraph.compute_fg_threshold(ProbabilisticInference.P_K2S, ProbabilisticInference.P_S2K)
-                    p_list_total = [p_balance for p in p_list_total]
+                    p_balance = MyFactorGraph.compute_fg_threshold(self.P_K2S, self.P_S2K)
+                    p_list_total = np.full(len(p_list_total), p_balance)
                     #p_list_total = [0.5 for p in p_list_total]
             elif test_id in [3]: # d
-                p_list_total_min = np.min(p_list_total)
-                p_list_total_max = np.max(p_list_total)
                 if p_list_total_min != p_list_total_max:
                     #p_list_total = self.normalize_range(p_list_total, p_list_total_min, p_list_total_max, 0.1, 0.75)
-                    p_list_total = self.normalize_range(p_list_total, 0, 1, 0.1, 0.75)
+                    p_list_total = self.normalize_range(p_list_total, 0, 1, self.NORM_D_MIN, self.NORM_D_MAX)
                 else:
-                    p_list_total = [0.95 for p in p_list_total]
+                    p_list_total = np.full(len(p_list_total), 0.95)
             # print(p_list_total)
 
             # write back to p_observation (with -1)
-            count = 0
-            for fid in p_observation:
-                for i,p in enumerate(p_observation[fid][test_id]):
-                    if p >= 0:
-                        p_observation[fid][test_id][i] = p_list_total[count]
-                        count += 1
-                    #else:
-                    #    p_observation[fid][test_id][i] = -1
-                        '''
-                        # TODO: for rc, replace 01
-                        if test_id == 1:
-                            p_observation[fid][test_id][i] = -1
-                        else:
-                            p_observation[fid][test_id][i] = 0.7272 #-1
-                        '''
-            '''
-                p_list_len = len(p_observation[fid][test_id])
-                p_observation[fid][test_id] = p_list_total[count:count+P_list_len]
-                count += p_list_len
-            #print("total: {}, count: {}".format(len(p_list_total), count))
-            '''
+            p_observation.values[test_id][is_valid] = p_list_total
 
         return p_observation
 
@@ -304,7 +250,7 @@ class ProbabilisticInference:
 
     #range1: original; range2: target
     def normalize_range(self, p_list, min1, max1, min2, max2):
-        p_list = [min2 + (p - min1)*(max2 - min2)/(max1 - min1) for p in p_list]
+        p_list = min2 + (np.asarray(p_list) - min1)*(max2 - min2)/(max1 - min1)
         
         return p_list
 
@@ -334,60 +280,45 @@ class ProbabilisticInference:
 
     def update_invalid_p(self, p_observation):
         logging.debug("[++++] Update invalid p")
-        for fid, p_lists in p_observation.items():
-            # test_id: 0: m, 1: r, 2: s, 3: d, 4: v
-            
-            # TODO: only need to check ms. others could not be invalid
-            for test_id in [0]:
-                p_balance = MyFactorGraph.compute_fg_threshold(ProbabilisticInference.P_K2M, ProbabilisticInference.P_M2K)
-                for i, p in enumerate(p_lists[test_id]):
-                    if p < 0: 
-                        p_lists[test_id][i] = p_balance if p < -1.5 else 0.4 #0.7272
-
-
-            # for r, remove -1 (the messages that have no request/response)
-            # also update the num of p in p_implication
-            for test_id in [1]:
-                #i_filter = [i for i in range(len(p_lists[test_id])) if p_lists[test_id][i] > 0]
-                i_filter = [i for i in range(len(p_lists[test_id])) if p_lists[test_id][i] >0 and self.pairs_size[fid][i] > 1]
-                p_r = [p_lists[test_id][i] for i in i_filter]
-                q_ktox_list_weighted_new = [self.p_implication[fid][0][test_id][i] for i in i_filter]
-                q_xtok_list_weighted_new = [self.p_implication[fid][1][test_id][i] for i in i_filter]
-
-                p_observation[fid][test_id] = p_r
-                #self.p_implication[fid][0][test_id] = q_ktov_list_const_new
-                #self.p_implication[fid][1][test_id] = q_vtok_list_const_new
-                self.p_implication[fid][0][test_id] = q_ktox_list_weighted_new
-                self.p_implication[fid][1][test_id] = q_xtok_list_weighted_new
-
-            # TODO: no need. could not be invalid
-            for test_id in [2, 3]:
-                for i, p in enumerate(p_lists[test_id]):
-                    if p < 0:
-                        # TODO: compute the balance value automatically
-                        p_lists[test_id][i] = 0.4 #0.7272
-
-            # TODO
-            for test_id in [4]:
-                for i,p in enumerate(p_lists[test_id]):
-                    if p < 0:
-                        p_balance = MyFactorGraph.compute_fg_threshold(ProbabilisticInference.P_K2V, ProbabilisticInference.P_V2K)
-                        p_lists[test_id][i] = p_balance - 0.45 #0.2
-                    else:
-                        p_lists[test_id][i] = 0.95 # TODO: remove it// 0.95
+        # test_id: 0: m, 1: r, 2: s, 3: d, 4: v
+        values = p_observation.values
+
+        # TODO: only need to check ms. others could not be invalid
+        for test_id in [0]:
+            p_balance = MyFactorGraph.compute_fg_threshold(self.P_K2M, self.P_M2K)
+            values[test_id] = np.where(values[test_id] < -1.5, p_balance, np.where(values[test_id] < 0, 0.4, values[test_id])) #0.7272
+
+        # for r, remove -1 (the messages that have no request/response)
+        # the removed p are masked out, so p_implication keeps the same layout
+        for test_id in [1]:
+            p_observation.mask[test_id] &= (values[test_id] > 0) & (p_observation.get_cluster_sizes(test_id) > 1)
+
+        # TODO: no need. could not be invalid
+        for test_id in [2, 3]:
+            # TODO: compute the balance value automatically
+            values[test_id] = np.where(values[test_id] < 0, 0.4, values[test_id]) #0.7272
+
+        # TODO
+        # each pair is mapped once: the nested lists of the original version shared the p_v list of a fid among its pairs,
+        # so the list was mapped again for each other pair, and a fid with one cluster got 0.95 as if it had several
+        for test_id in [4]:
+            p_balance = MyFactorGraph.compute_fg_threshold(self.P_K2V, self.P_V2K)
+            values[test_id] = np.where(values[test_id] < 0, p_balance - 0.45, 0.95) #0.2 # TODO: remove it// 0.95
 
         return p_observation
 
     # TODO: add algorithms to infer the fid from fg results
-    def get_fid_inferred(self, fg_result, max_num=1, precision=0.01):
-        result = dict()
-        for fid in fg_result:
-            result[fid] = fg_result[fid][0] # only use the first test
-        result_sorted = sorted(result.items(), key=lambda x:x[1], reverse=True)
-        fid_inferred = [result_sorted[0][0]]
-        for i in range(1, len(result_sorted)):
-            if result_sorted[i][1] - result_sorted[0][1]< precision:
-                fid_inferred.append(result_sorted[i][0])
+    # pk_result: P(k=1) of each fid in fid_list
+    def get_fid_inferred(self, fid_list, pk_result, max_num=1, precision=0.01):
+        if len(fid_list) == 0:
+            return list()
+
+        pk_result = np.asarray(pk_result)
+        i_sorted = np.argsort(-pk_result, kind='stable') # keep the order of fid_list for ties
+        fid_inferred = [fid_list[i_sorted[0]]]
+        for i in i_sorted[1:]:
+            if pk_result[i] - pk_result[i_sorted[0]] < precision:
+                fid_inferred.append(fid_list[i])
         fid_inferred = [int(fid.split("-")[0]) for fid in fid_inferred[:max_num]]
         #print(fid_inferred)
 
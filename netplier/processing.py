@@ -15,12 +15,13 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>
 
 import logging
-import copy
+import numpy as np
 import struct
 from netzob.Import.PCAPImporter.all import *
-from netzob.Model.Vocabulary.Session import Session
 from sklearn import metrics
 from getkw import get_true_keyword_updated as gtk
+from session_builder import SessionBuilder
+from message_batch import MessageBatch
 
 class Processing:
     MAX_LEN = 1500 #100 // reduce the time for MSA
@@ -30,6 +31,7 @@ class Processing:
         self.protocol_type = protocol_type
         self.layer = layer
         self.messages = messages
+        self.batch = None # the messages in columns (see MessageBatch)
         self.direction_list = list()
         self.randomdir = randomdir
         self.sessiondir = sessiondir
@@ -48,43 +50,37 @@ class Processing:
         if self.protocol_type == 'icmp':
             self.layer = 3
         messages = PCAPImporter.readFile(filePath=self.filepath, importLayer=self.layer).values()
+        batch = MessageBatch.from_messages(messages)
 
         ## Filter messages
         # extract from IP msgs
         if self.protocol_type == "icmp":
-            for message in messages:
-                len_header = message.data[0] & 0x0000000f
-                startIndex = len_header * 4 #*32/8
-                message.data = message.data[startIndex:]
+            len_header = batch.get_columns(0, 1)[0][:, 0] & 0x0000000f
+            batch = batch.skip(len_header.astype(np.int64) * 4) #*32/8
         # in mb2, some msgs contain more than one mbtcp
         elif self.protocol_type == 'modbus':
-            for i, message in enumerate(messages):
-                length = int.from_bytes(message.data[4:4+2], byteorder='big', signed=True)
-                if len(message.data) != length + 6:
-                    message.data = message.data[:length+6]
-        elif self.protocol_type == 'smb':
-            for message in messages[::-1]:
-                # delete not smb msgs
-                if message.data[4:8].hex() != "ff534d42":
-                    messages.remove(message)
-                if len(message.data) > 1500:
-                    message.data = message.data[:1500]
-        elif self.protocol_type == 'smb2':
-            for message in messages[::-1]:
-                if message.data[4:8].hex() != "fe534d42":
-                    messages.remove(message)
-                if len(message.data) > 1500:
-                    message.data = message.data[:1500]
+            # the length field (signed, big endian) of the bytes [4, 6) of each msg
+            columns, inside = batch.get_columns(4, 2)
+            length = np.where(inside[:, 1], columns[:, 0].astype(np.int64) * 256 + columns[:, 1], columns[:, 0])
+            num_bytes = inside.sum(axis=1)
+            length = np.where((num_bytes > 0) & (length >= 1 << (8 * num_bytes - 1)), length - (1 << (8 * num_bytes)), length)
+            # keep data[:length+6]
+            length_kept = length + 6
+            batch = batch.truncate(np.where(length_kept >= 0, length_kept, batch.get_lengths() + length_kept))
+        elif self.protocol_type in ['smb', 'smb2']:
+            # delete not smb msgs
+            signature = bytes.fromhex("ff534d42" if self.protocol_type == 'smb' else "fe534d42")
+            columns, inside = batch.get_columns(4, 4)
+            batch = batch.select(np.all(inside, axis=1) & np.all(columns == np.frombuffer(signature, dtype=np.uint8), axis=1))
+            batch = batch.truncate(1500)
         elif self.protocol_type == 'zeroaccess':
-            for message in messages:
-                message.data = self.decrypt_za_msg(message.data)
+            batch = batch.replace_data([self.decrypt_za_msg(data) for data in batch.get_data_list()])
 
         # MAX_LEN = 500 
-        for message in messages:
-            if len(message.data) > Processing.MAX_LEN:
-                message.data = message.data[:Processing.MAX_LEN]
+        batch = batch.truncate(Processing.MAX_LEN)
 
-        self.messages = messages
+        self.batch = batch
+        self.messages = batch.to_messages()
         try:
             self.dump(self.messages)
         except:
@@ -122,31 +118,19 @@ class Processing:
                     logging.error("Error: GetMsgsDirectionlistBySpecification")
                 direction_list.append(d)
 
-        self.direction_list = direction_list
-
-    def get_msgs_directionlist_by_sessions(self):
-        dict_idtoi = dict()
-        for i,message in enumerate(self.messages):
-            dict_idtoi[message.id] = i
-
-        direction_list = [-1]*len(self.messages)
-
-        sessions = Session(self.messages)
-        #print(sessions.getEndpointsList())
-        #logging.info("Number of Sessions: {0}".format(len(sessions.getTrueSessions())))
-        for session in sessions.getTrueSessions():
-            messages_list = list(session.messages.values())
-            messages_list = sorted(messages_list, key=lambda x:x.date)
+        self.set_direction_list(direction_list)
 
-            srcIP = messages_list[0].source
-            for message in messages_list:
-                if message.source == srcIP:
-                    result = 0
-                else:
-                    result = 1
-                direction_list[dict_idtoi[message.id]] = result
+    # the directions of the messages (e.g., shuffled by randomdir), kept in sync with the ones of the batch
+    def set_direction_list(self, direction_list):
+        self.direction_list = list(direction_list)
+        if self.batch is not None:
+            self.batch.directions = np.array(self.direction_list, dtype=np.int64)
 
-        return direction_list
+    # the first speaker of each session sends the requests
+    def get_msgs_directionlist_by_sessions(self):
+        sessions = SessionBuilder(self.batch if self.batch is not None else self.messages)
+        #logging.info("Number of Sessions: {0}".format(sessions.num_sessions))
+        return sessions.get_direction_list()
 
     def get_msg_direction_by_specification(self, message):
         ##0: request; 1: response
@@ -267,12 +251,7 @@ class Processing:
             print("  Symbol {0} msgs numbers: {1}".format(s, types_list_response.count(s)))
 
         ## Session info
-        messages = copy.deepcopy(self.messages)
-        sessions = Session(messages)
-        for i in range(len(self.direction_list)):
-            data = [messages[i].data, self.direction_list[i]]
-            messages[i].data = data
-        num_of_session = len(sessions.getTrueSessions())
+        num_of_session = SessionBuilder(self.batch if self.batch is not None else self.messages).num_sessions
         print("\nNumber of Sessions: {0}".format(num_of_session))
         print("[++++++++] End\n")
 
@@ -297,6 +276,9 @@ class Processing:
         
     @staticmethod
     def divide_msgs_by_directionlist(messages, direction_list):
+        # the batches share the payloads of the messages
+        if isinstance(messages, MessageBatch):
+            return messages.divide_by_directionlist(direction_list)
         messages_request = list()
         messages_response = list()
         for i in range(len(direction_list)):
@@ -0,0 +1,64 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import numpy as np
+
+from message_batch import MessageBatch
+
+"""
+Reconstruct the sessions of the messages (instead of netzob Session)
+A session is the messages between a couple of endpoints (source and destination, i.e., ip:port above the network layer),
+in either direction, as the true sessions of netzob; the messages of each session are ordered by date (by their
+position in the trace for the same date)
+"""
+class SessionBuilder:
+    # messages: the netzob messages, or a MessageBatch (its endpoint ids and dates are used as they are)
+    def __init__(self, messages):
+        self.num_messages = len(messages)
+
+        if isinstance(messages, MessageBatch):
+            sources, destinations, dates = messages.sources, messages.destinations, messages.dates
+        else:
+            dict_endpoints = dict()
+            sources = np.array([dict_endpoints.setdefault(str(message.source), len(dict_endpoints)) for message in messages], dtype=np.int64)
+            destinations = np.array([dict_endpoints.setdefault(str(message.destination), len(dict_endpoints)) for message in messages], dtype=np.int64)
+            dates = np.array([message.date if message.date is not None else 0 for message in messages], dtype=np.float64)
+        self.source_ids = sources
+
+        # the session of each message (numbered by first message): the couple of endpoints in either direction
+        endpoints = np.minimum(sources, destinations) * (np.maximum(sources, destinations).max(initial=0) + 1) + np.maximum(sources, destinations)
+        endpoints_unique, firsts, session_ids = np.unique(endpoints, return_index=True, return_inverse=True)
+        self.num_sessions = len(endpoints_unique)
+        ranks = np.empty(self.num_sessions, dtype=np.int64)
+        ranks[np.argsort(firsts, kind='stable')] = np.arange(self.num_sessions)
+        self.session_ids = ranks[session_ids]
+
+        # the message indices in the order of the sessions
+        self.order = np.lexsort((np.arange(self.num_messages), dates, self.session_ids))
+
+    # the session of each message in the order of the sessions
+    def get_ordered_session_ids(self):
+        return self.session_ids[self.order]
+
+    # the direction of each message: 0 if it is sent by the first speaker of its session (request), 1 otherwise (response)
+    def get_direction_list(self):
+        if self.num_messages == 0:
+            return list()
+        sessions_ordered = self.get_ordered_session_ids()
+        firsts = self.order[np.flatnonzero(np.concatenate(([True], sessions_ordered[1:] != sessions_ordered[:-1])))]
+        first_speakers = np.empty(self.num_sessions, dtype=np.int64)
+        first_speakers[self.session_ids[firsts]] = self.source_ids[firsts]
+        return (self.source_ids != first_speakers[self.session_ids]).astype(int).tolist()
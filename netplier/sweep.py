@@ -0,0 +1,188 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import argparse
+import contextlib
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from netplier import NetPlier
+from processing import Processing
+from alignment import Alignment
+from aligned_matrix import AlignedMatrix
+from clustering import Clustering
+from constraint.constraint import Constraint
+from probabilistic_inference import ProbabilisticInference
+
+"""
+Sweep the parameters of ProbabilisticInference (implication probabilities, bonus values, normalization ranges)
+The observation probabilities (prob_request.txt) and the V-measure of each candidate fid are computed once per trace,
+then each setting only reruns the inference
+"""
+class ParameterSweep:
+    FILENAME_RESULTS = "sweep_results.txt"
+
+    # traces: list of [output_dir of a previous run, filepath of input trace, protocol_type]
+    def __init__(self, traces, output_dir='tmp/', remote=True, processes=None):
+        self.traces = traces
+        self.output_dir = output_dir
+        self.remote = remote
+        self.processes = processes if processes else os.cpu_count()
+
+        # [trace name, p_observation, ffid_list, {fid: V-measure}] of each trace
+        self.traces_info = list()
+
+        if not os.path.exists(self.output_dir):
+            logging.debug("Folder {0} doesn't exist".format(self.output_dir))
+            os.makedirs(self.output_dir)
+
+    def load_traces(self):
+        print("[++++++++] Load traces")
+        for trace_dir, filepath, protocol_type in self.traces:
+            p = Processing(filepath=filepath, protocol_type=protocol_type)
+            netplier = NetPlier(messages=p.messages, direction_list=p.direction_list, output_dir=trace_dir)
+            fields, fid_list = netplier.generate_fields_by_fieldsinfo(os.path.join(trace_dir, Alignment.FILENAME_FIELDS_INFO))
+
+            constraint = Constraint(messages=p.messages, direction_list=p.direction_list, fields=fields, fid_list=fid_list, output_dir=trace_dir)
+            p_observation = constraint.load_observation_probabilities(Constraint.TEST_TYPE_REQUEST)
+            ffid_list = ["{0}-{0}".format(fid) for fid in fid_list if "{0}-{0}".format(fid) in p_observation]
+
+            v_measures = self.compute_v_measures(p.messages, p.direction_list, fields, [int(fid.split("-")[0]) for fid in ffid_list], trace_dir, protocol_type)
+            self.traces_info.append([trace_dir, p_observation, ffid_list, v_measures])
+            logging.info("Trace {}: {} candidates".format(trace_dir, len(ffid_list)))
+
+    # V-measure (total) of clustering by each candidate fid
+    def compute_v_measures(self, messages, direction_list, fields, fid_list, trace_dir, protocol_type):
+        aligned_matrix = AlignedMatrix.load(os.path.join(trace_dir, Alignment.FILENAME_OUTPUT_ONELINE))
+        messages_request, messages_response = Processing.divide_msgs_by_directionlist(messages, direction_list)
+        matrix_request, matrix_response = aligned_matrix.divide_by_directionlist(direction_list)
+
+        clustering = Clustering(fields=fields, protocol_type=protocol_type)
+        clustering_result_true = [clustering.cluster_by_kw_true(messages_request), clustering.cluster_by_kw_true(messages_response)]
+
+        v_measures = dict()
+        for fid in fid_list:
+            clustering_result_method = [clustering.label_by_kw_inferred([fid], matrix_request), clustering.label_by_kw_inferred([fid], matrix_response)]
+            results_list = clustering.compute_scores(clustering_result_true, clustering_result_method)
+            v_measures[fid] = results_list[2][2] if results_list is not None else 0.0
+
+        return v_measures
+
+    # params: {parameter name: value}
+    # output: [fid inferred, V-measure] of each trace
+    def evaluate(self, params):
+        results = list()
+        for trace_dir, p_observation, ffid_list, v_measures in self.traces_info:
+            pi = ProbabilisticInference(p_observation=p_observation, remote=self.remote, params=params)
+            fid_inferred = pi.execute(ffid_list)
+            fid = fid_inferred[0] if len(fid_inferred) > 0 else None
+            results.append([fid, v_measures.get(fid, 0.0)])
+        return results
+
+    def execute(self, settings):
+        print("[++++++++] Sweep {} settings on {} traces".format(len(settings), len(self.traces_info)))
+        time_start = time.time()
+
+        # the loaded traces are shared with the workers when they are forked
+        chunksize = max(1, len(settings) // (self.processes * 4))
+        with multiprocessing.Pool(self.processes, initializer=ParameterSweep.init_worker, initargs=(self,)) as pool:
+            results = pool.map(ParameterSweep.evaluate_in_worker, settings, chunksize=chunksize)
+
+        time_used = time.time() - time_start
+        logging.info("{} settings in {:.2f}s ({:.0f} settings/min)".format(len(settings), time_used, len(settings) / max(time_used, 1e-9) * 60))
+
+        self.save_results(settings, results)
+        return results
+
+    def save_results(self, settings, results):
+        filepath = os.path.join(self.output_dir, ParameterSweep.FILENAME_RESULTS)
+        result_best, v_mean_best = None, -1
+        with open(filepath, 'w') as fout:
+            fout.write("params\t{}\tmean_v\n".format('\t'.join([trace_info[0] for trace_info in self.traces_info])))
+            for params, result in zip(settings, results):
+                v_mean = sum([v for fid, v in result]) / max(len(result), 1)
+                params_str = ','.join(["{}={}".format(name, value) for name, value in params.items()])
+                fout.write("{}\t{}\t{}\n".format(params_str, '\t'.join(["{}:{:.8}".format(fid, v) for fid, v in result]), v_mean))
+                if v_mean > v_mean_best:
+                    result_best, v_mean_best = params_str, v_mean
+        logging.info("Best setting: {} (mean V-measure {:.8})".format(result_best, v_mean_best))
+
+    @staticmethod
+    def init_worker(sweep):
+        global _sweep
+        _sweep = sweep
+
+    @staticmethod
+    def evaluate_in_worker(params):
+        with contextlib.redirect_stdout(io.StringIO()): # skip the progress info of each inference
+            return _sweep.evaluate(params)
+
+    # space: {parameter name: list of values}
+    @staticmethod
+    def generate_grid(space):
+        names = list(space.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+    # space: {parameter name: [low, high]}
+    @staticmethod
+    def generate_random(space, num, seed=None):
+        rng = random.Random(seed)
+        return [{name: rng.uniform(low, high) for name, (low, high) in space.items()} for i in range(num)]
+
+_sweep = None
+
+# NAME=v1,v2,...
+def parse_space(items):
+    space = dict()
+    for item in items:
+        name, values = item.split('=')
+        assert name in ProbabilisticInference.PARAMETERS, "unknown parameter: {}".format(name)
+        space[name] = [float(v) for v in values.split(',')]
+    return space
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-tr', '--trace', required=True, dest='traces', nargs=3, action='append', metavar=('OUTPUT_DIR', 'INPUT', 'TYPE'),
+        help='a trace: the output directory of a previous run, the filepath of input trace, and the type of the protocol')
+    parser.add_argument('-o', '--output_dir', dest='output_dir', default='tmp_sweep/', help='output directory')
+    parser.add_argument('-g', '--grid', dest='grid', default=[], action='append', help='grid search of a parameter: NAME=v1,v2,...')
+    parser.add_argument('-r', '--random', dest='random', default=[], action='append', help='random search of a parameter: NAME=low,high')
+    parser.add_argument('-n', '--num', dest='num', default=100, type=int, help='the number of settings of random search')
+    parser.add_argument('-s', '--seed', dest='seed', default=None, type=int, help='the seed of random search')
+    parser.add_argument('-p', '--processes', dest='processes', default=None, type=int, help='the number of worker processes')
+    parser.add_argument('-remote', '--remote', dest='remote', default=True, action='store_false', help='do remote coupling')
+
+    args = parser.parse_args()
+
+    if len(args.random) > 0:
+        settings = ParameterSweep.generate_random(parse_space(args.random), args.num, args.seed)
+        # the grid parameters are combined with each random setting
+        settings = [dict(s, **g) for s in settings for g in ParameterSweep.generate_grid(parse_space(args.grid))]
+    else:
+        settings = ParameterSweep.generate_grid(parse_space(args.grid))
+
+    sweep = ParameterSweep(traces=args.traces, output_dir=args.output_dir, remote=args.remote, processes=args.processes)
+    sweep.load_traces()
+    sweep.execute(settings)
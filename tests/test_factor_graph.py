@@ -0,0 +1,80 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+DIR_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DIR_ROOT, 'netplier'))
+
+from constraint.constraint import Constraint
+from observation import ObservationProbabilities
+from probabilistic_inference import ProbabilisticInference
+from factor_graph import MyFactorGraph
+
+"""
+Checks of the exact engine of the factor graph against the belief propagation of pgmpy
+"""
+
+# the observation probabilities of the requests saved in tmp_results
+def load_p_observation(protocol_type):
+    constraint = Constraint(messages=[], direction_list=[], fields=[], fid_list=[], output_dir=os.path.join(DIR_ROOT, 'tmp_results', protocol_type))
+    return constraint.load_observation_probabilities(Constraint.TEST_TYPE_REQUEST)
+
+# P(k) of each candidate fid of a trace by both engines
+def test_exact_bp():
+    pytest.importorskip('pgmpy')
+    pk = dict()
+    for engine in [MyFactorGraph.ENGINE_EXACT, MyFactorGraph.ENGINE_BP]:
+        p_observation = load_p_observation('dhcp')
+        fid_list = ["{0}-{0}".format(fid.split('-')[0]) for fid in p_observation.keys() if fid.split('-')[0] == fid.split('-')[1]]
+        pi = ProbabilisticInference(p_observation=p_observation, engine=engine)
+        pi.execute(fid_list)
+        pk[engine] = [pi.pk_result[fid] for fid in fid_list]
+
+    assert len(fid_list) > 1
+    np.testing.assert_allclose(pk[MyFactorGraph.ENGINE_EXACT], pk[MyFactorGraph.ENGINE_BP], rtol=0, atol=1e-9)
+
+# both messages to k are 0 (the implications are 0): P(k) is 0 instead of nan
+def test_exact_zero_messages():
+    pairs_size = {"1-1": [10]}
+    p_observation = ObservationProbabilities.from_lists({"1-1": [[0.5]] * 5}, pairs_size)
+    p_implication = [ObservationProbabilities.from_lists({"1-1": [[0.0]] * 5}, pairs_size) for i in range(2)]
+    fg = MyFactorGraph(p_observation=p_observation, p_implication=p_implication)
+
+    assert fg.compute_pk_exact([0, 0, 0, 0, 0], "1-1") == 0.0
+
+# P(k) of all fids in one batch, padded to the most clusters, against each fid alone
+@pytest.mark.parametrize('remote', [True, False])
+@pytest.mark.parametrize('type_list', [[0, 0, 0, 0, 0], [1, 2, 0, -1, 1]])
+def test_batch_by_fid(type_list, remote):
+    rng = np.random.RandomState(0)
+    pairs_size = {"{0}-{0}".format(fid): [int(n) for n in rng.randint(1, 20, size=num_cluster)] for fid, num_cluster in enumerate([1, 3, 8, 2])}
+    def generate_p_lists():
+        return ObservationProbabilities.from_lists({fid: [rng.uniform(0.05, 0.95, size=len(sizes)).tolist() for i in range(5)]
+            for fid, sizes in pairs_size.items()}, pairs_size)
+    p_observation = generate_p_lists()
+    # some r are not used (e.g., the clusters without request/response)
+    p_observation.mask[1] = rng.uniform(size=len(p_observation.mask[1])) < 0.7
+    fg = MyFactorGraph(p_observation=p_observation, p_implication=[generate_p_lists(), generate_p_lists()], remote=remote)
+
+    fid_list = list(pairs_size.keys())
+    pk_batch = fg.compute_pk_batch(type_list, fid_list)
+    np.testing.assert_allclose(pk_batch, [fg.compute_pk_exact(type_list, fid) for fid in fid_list], rtol=0, atol=1e-12)
+    np.testing.assert_allclose(fg.compute_pk_batch(type_list, fid_list[::-1]), pk_batch[::-1], rtol=0, atol=1e-12)
@@ -0,0 +1,87 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+DIR_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DIR_ROOT, 'netplier'))
+
+from processing import Processing
+from alignment import Alignment
+from netplier import NetPlier
+from constraint.constraint import Constraint
+from observation import ObservationProbabilities
+from probabilistic_inference import ProbabilisticInference
+from factor_graph import MyFactorGraph
+
+"""
+Regression checks of the inferred keyword on the bundled traces
+The alignment of tmp_results is reused (mafft is not run), so only the constraints and the inference are checked
+"""
+
+# the inferred fid of each bundled trace
+# dnp3 was 2 and smb2 was 27 while the p_v lists were shared by the pairs of a fid (see update_invalid_p)
+# smb2: the field of the command (bytes 16-17) is fid 10, which is not the inferred one
+FIDS_INFERRED = {'dhcp': 33, 'dnp3': 11, 'modbus': 5, 'ntp': 1, 'smb': 4, 'smb2': 1, 'tftp': 1, 'zeroaccess': 5}
+
+@pytest.mark.parametrize('pairing', ['diagonal', 'full'])
+@pytest.mark.parametrize('protocol_type', sorted(FIDS_INFERRED))
+def test_keyword(tmp_path, monkeypatch, protocol_type, pairing):
+    output_dir = str(tmp_path / protocol_type)
+    shutil.copytree(os.path.join(DIR_ROOT, 'tmp_results', protocol_type), output_dir)
+    for filename in ['prob_request.txt', 'prob_response.txt']:
+        os.remove(os.path.join(output_dir, filename))
+    monkeypatch.setattr(Alignment, 'execute', lambda self: None)
+
+    p = Processing(filepath=os.path.join(DIR_ROOT, 'data', '{}_100.pcap'.format(protocol_type)), protocol_type=protocol_type)
+    netplier = NetPlier(messages=p.messages, direction_list=p.direction_list, output_dir=output_dir, pairing=pairing)
+    assert netplier.execute() == [FIDS_INFERRED[protocol_type]]
+
+# the pairs that share the lists of a fid get the same p_v
+def test_shared_p_v_lists():
+    p_lists = [[0.9], [-1], [0.9], [1.0], [-1]]
+    pairs_p = {"1-1": p_lists, "1-2": p_lists}
+    pairs_size = {"1-1": [10], "1-2": [10]}
+    p_observation = ProbabilisticInference(p_observation=None).update_invalid_p(ObservationProbabilities.from_lists(pairs_p, pairs_size))
+
+    p_balance = MyFactorGraph.compute_fg_threshold(ProbabilisticInference.P_K2V, ProbabilisticInference.P_V2K)
+    assert p_observation.values[4].tolist() == [p_balance - 0.45] * 2
+
+# the observation probabilities of all pairs (pairing full) against the ones of the baseline saved in tmp_results
+@pytest.mark.parametrize('protocol_type', sorted(FIDS_INFERRED))
+def test_observation_full(tmp_path, monkeypatch, protocol_type):
+    output_dir = str(tmp_path / protocol_type)
+    shutil.copytree(os.path.join(DIR_ROOT, 'tmp_results', protocol_type), output_dir)
+    for filename in ['prob_request.txt', 'prob_response.txt']:
+        os.remove(os.path.join(output_dir, filename))
+    monkeypatch.setattr(Alignment, 'execute', lambda self: None)
+
+    p = Processing(filepath=os.path.join(DIR_ROOT, 'data', '{}_100.pcap'.format(protocol_type)), protocol_type=protocol_type)
+    NetPlier(messages=p.messages, direction_list=p.direction_list, output_dir=output_dir, pairing='full', response=True).execute()
+
+    for direction in [Constraint.TEST_TYPE_REQUEST, Constraint.TEST_TYPE_RESPONSE]:
+        p_baseline = Constraint(messages=[], direction_list=[], fields=[], fid_list=[], output_dir=os.path.join(DIR_ROOT, 'tmp_results', protocol_type)).load_observation_probabilities(direction)
+        p_observation = Constraint(messages=[], direction_list=[], fields=[], fid_list=[], output_dir=output_dir).load_observation_probabilities(direction)
+        assert sorted(p_observation.keys()) == sorted(p_baseline.keys())
+        for fid in p_baseline.keys():
+            assert p_observation.get_size(fid) == p_baseline.get_size(fid)
+            for p_list, p_list_baseline in zip(p_observation[fid], p_baseline[fid]):
+                np.testing.assert_allclose(p_list, p_list_baseline, rtol=0, atol=1e-9)
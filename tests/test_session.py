@@ -0,0 +1,59 @@
+# This file is part of NetPlier, a tool for binary protocol reverse engineering.
+# Copyright (C) 2021 Yapeng Ye
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+import copy
+import os
+import sys
+
+import pytest
+
+DIR_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(DIR_ROOT, 'netplier'))
+
+from netzob.Model.Vocabulary.Session import Session
+
+from processing import Processing
+from session_builder import SessionBuilder
+from constraint.session_index import SessionIndex
+
+"""
+Checks of the sessions of SessionBuilder/SessionIndex against the true sessions of netzob (used by the previous remote coupling)
+"""
+
+# the messages of each session (by date), as sorted by the previous remote coupling
+def get_sessions_netzob(messages):
+    messages = copy.deepcopy(messages)
+    i_message = {message.id: i for i, message in enumerate(messages)}
+    sessions = list()
+    for session in Session(messages).getTrueSessions():
+        messages_list = sorted(session.messages.values(), key=lambda x:x.date)
+        sessions.append([i_message[message.id] for message in messages_list])
+    return sessions
+
+@pytest.mark.parametrize('protocol_type', ['dhcp', 'dnp3', 'modbus', 'ntp', 'smb', 'smb2', 'tftp', 'zeroaccess'])
+def test_sessions(protocol_type):
+    p = Processing(filepath=os.path.join(DIR_ROOT, 'data', '{}_100.pcap'.format(protocol_type)), protocol_type=protocol_type)
+    sessions_netzob = get_sessions_netzob(p.messages)
+
+    for messages in [p.messages, p.batch]:
+        sessions = SessionBuilder(messages)
+        sessions_builder = [sessions.order[sessions.get_ordered_session_ids() == s].tolist() for s in range(sessions.num_sessions)]
+        assert sorted(sessions_builder) == sorted(sessions_netzob)
+
+    # the indexed sessions are the same (in the order of their first message)
+    index = SessionIndex.from_messages(p.messages, p.direction_list)
+    sessions_index = [index.order[index.sessions == s].tolist() for s in range(sessions.num_sessions)]
+    assert sessions_index == sorted(sessions_netzob, key=min)